@@ -1,11 +1,28 @@
 from fastapi import FastAPI, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from fastapi import FastAPI, UploadFile, File
-import pandas as pd
-import io
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from fastapi import Request
+from starlette.concurrency import run_in_threadpool
+from fastapi import FastAPI, UploadFile, File, WebSocket
+import os
 import json
-from services.LLM.agent import FinancialCrew
+import math
+import time
+import asyncio
+import threading
+import pandas as pd
+from typing import List, Optional
+from services.jobs import create_job_queue, JobQueueFullError
+from services.result_cache import analysis_cache_key, get_default_result_cache
+from services.LLM.llm_cache import get_default_llm_response_cache, model_id
+from services.LLM.search_cache import get_default_search_cache
+from services.ingestion import load_holdings, IngestionError
+from services.batch import combine_accounts, split_accounts, run_batch_analysis
+from services.metrics import MetricsStage, SUMMARY_FIELDS, with_rebalance
+from services.snapshots import get_default_snapshot_store, diff_holdings, turnover, incremental_update, full_update, material_changes, next_snapshot
+from services.monitoring import get_default_monitor, MonitorFullError
+from services.telemetry import span, telemetry
+from config import WARM_START, BATCH_ACCOUNT_COLUMN, BATCH_MAX_ACCOUNTS, MONITOR_PUSH_INTERVAL
 
 app = FastAPI()
 
@@ -17,24 +34,358 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+job_queue = create_job_queue()
+monitor = get_default_monitor()
+
+# Progress of the startup warm-up, reported on /health
+warm_state = {"ready": False, "seconds": None, "error": None}
+
+def warm_up():
+    """Import the crew and build the shared LLM clients and search tool ahead of the first request"""
+    started = time.perf_counter()
+    try:
+        with span('warm_up'):
+            from services.LLM.agent import FinancialCrew  # noqa: F401
+            from services.LLM.clients import llm_pool, get_search_tool
+
+            for securityMode in (False, True):
+                llm_pool.get(securityMode)
+            get_search_tool()
+    except Exception as e:
+        warm_state["error"] = f"{type(e).__name__}: {e}"
+    else:
+        warm_state["ready"] = True
+    warm_state["seconds"] = round(time.perf_counter() - started, 2)
+
+@app.on_event("startup")
+async def warm_start():
+    # crewai, litellm and the clients load in the background, so the server answers right away
+    if WARM_START:
+        threading.Thread(target=warm_up, name='warm-start', daemon=True).start()
+    # Replays MONITOR_FEED_PATH when one is configured
+    try:
+        monitor.start()
+    except Exception as e:
+        monitor.error = f"{type(e).__name__}: {e}"
+
+@app.on_event("shutdown")
+async def stop_monitor():
+    monitor.stop()
+
+def json_safe(value):
+    """`value` with NaN and infinite floats as None, which JSON.parse cannot read otherwise"""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(item) for item in value]
+    return value
+
+
+def snapshot_update(df_input, portfolio_id):
+    """(snapshot, update, diff, traded, fallback) of the holdings against the portfolio's last snapshot"""
+    # A portfolio analysed before under the same id is diffed against its snapshot, so only
+    # changed lots are recomputed
+    snapshot = get_default_snapshot_store().get(portfolio_id) if portfolio_id else None
+    update, diff, traded, fallback = None, None, 0.0, None
+    if snapshot is not None:
+        with span('snapshot.update', lots=len(df_input)) as update_span:
+            diff = diff_holdings(snapshot.holdings, df_input)
+            try:
+                traded = turnover(snapshot, df_input, diff)
+                update = incremental_update(snapshot, df_input, diff)
+            except Exception as e:
+                fallback = f"{type(e).__name__}: {e}"
+            update_span.set(incremental=update is not None, **diff.summary())
+    if update is None:
+        update = full_update(MetricsStage().run(df_input))
+    return snapshot, update, diff, traded, fallback
+
+
+def record_cached_snapshot(securityMode, investmentStrategy, referenceInvestor, df_input, result, portfolio_id):
+    """Keep a snapshot of holdings answered from the result cache, so the next upload is diffed against them"""
+    snapshot, update, _, traded, _ = snapshot_update(df_input, portfolio_id)
+    update.metrics = with_rebalance(update.metrics, investmentStrategy)
+    context = {"investmentStrategy": investmentStrategy, "referenceInvestor": referenceInvestor, "model": model_id(securityMode)}
+    if 'fx' not in update.metrics.errors:
+        get_default_snapshot_store().put(next_snapshot(portfolio_id, df_input, update, result, context, snapshot, traded=traded))
+
+
+def run_analysis(securityMode, investmentStrategy, referenceInvestor, df_input, cache_key=None, use_cache=True, portfolio_id=None, emit=None):
+    # Imported on first use; with WARM_START this is already done by the time a job runs
+    from services.LLM.agent import FinancialCrew
+
+    # The narrative of a portfolio with a snapshot is only rewritten for material changes
+    snapshot, update, diff, traded, fallback = snapshot_update(df_input, portfolio_id)
+    update.metrics = with_rebalance(update.metrics, investmentStrategy)
+
+    result = reused = None
+    context = {"investmentStrategy": investmentStrategy, "referenceInvestor": referenceInvestor, "model": model_id(securityMode)}
+    if snapshot is not None:
+        summary = update.metrics.summary()
+        changes = material_changes(snapshot.narrative_summary, summary, snapshot.turnover + traded)
+        if snapshot.result is not None and snapshot.context == context and not changes:
+            # Numbers computed in Python always override the narrative's; one this run could not
+            # compute is cleared rather than left at its old value
+            result = reused = {**snapshot.result, **dict.fromkeys(SUMMARY_FIELDS), **summary, "errors": update.metrics.errors or None}
+        if emit:
+            emit('snapshot', {
+                "portfolio_id": portfolio_id,
+                "diff": diff.summary(),
+                "incremental": update.incremental,
+                "fallback": fallback,
+                "material_changes": changes,
+                "regenerated": reused is None,
+            })
+        if reused is not None and emit:
+            emit('metrics', summary)
+
+    if result is None:
+        crew = FinancialCrew(securityMode=securityMode, investmentStrategy=investmentStrategy,referenceInvestor=referenceInvestor,df_input=df_input,metrics=update.metrics,use_cache=use_cache)
+        with span('analysis', model=model_id(securityMode), lots=len(df_input)):
+            crew_output = crew.run(on_event=emit)
+        result = json.loads(crew_output)
+    # A snapshot holds base-currency values, so none is kept when the conversion failed
+    if portfolio_id and 'fx' not in update.metrics.errors:
+        get_default_snapshot_store().put(next_snapshot(portfolio_id, df_input, update, result, context, snapshot, regenerated=reused is None, traded=traded))
+    # A result missing some metrics is not cached, so the next request gets a chance at a full one
+    if cache_key and not update.metrics.errors:
+        get_default_result_cache().put(cache_key, result)
+    return result
+
 @app.post("/analyze-portfolio")
 async def analyze_portfolio(
     file: UploadFile = File(...),
     securityMode: bool = Form(...),
     investmentStrategy: str = Form(...),
-    referenceInvestor: str = Form(...)
+    referenceInvestor: str = Form(...),
+    bypassCache: bool = Form(False),
+    portfolioId: str = Form("")
 ):
-    contents = await file.read()
-    df_input = pd.read_csv(io.StringIO(contents.decode('utf-8')))
+    # Parsed in chunks straight from the spooled upload, rows that fail validation are reported back
+    try:
+        with span('ingestion') as ingestion_span:
+            holdings = await run_in_threadpool(load_holdings, file.file)
+            ingestion_span.set(rows=len(holdings), rejected_rows=holdings.rejected_rows)
+    except IngestionError as e:
+        return JSONResponse(status_code=422, content={"detail": str(e)})
+    df_input = holdings.frame
+    ingestion = {"rows": len(holdings), "rejected_rows": holdings.rejected_rows, "errors": holdings.errors}
 
     if not referenceInvestor:
         referenceInvestor = "Portfolio Manager"
-    
-    crew = FinancialCrew(securityMode=securityMode, investmentStrategy=investmentStrategy,referenceInvestor=referenceInvestor,df_input=df_input)
-    crew_output = crew.run()
-    
-    parsed_output = json.loads(crew_output)
-    return JSONResponse(content=parsed_output)
+
+    # Identical uploads within the market-data freshness window are answered from the cache
+    cache_key = analysis_cache_key(df_input, investmentStrategy, referenceInvestor, securityMode, model_id(securityMode))
+    cached = None if bypassCache else get_default_result_cache().get(cache_key)
+    if not bypassCache:
+        telemetry.record_cache('analysis_results', hit=cached is not None)
+    if cached is not None:
+        if portfolioId.strip():
+            # The next upload under this id is diffed against these holdings, not the ones before
+            with span('snapshot.cached', lots=len(df_input)):
+                await run_in_threadpool(record_cached_snapshot, securityMode, investmentStrategy, referenceInvestor, df_input, cached, portfolioId.strip())
+        return JSONResponse(content={"job_id": None, "status": "succeeded", "result": json_safe(cached), "cached": True, "ingestion": ingestion})
+
+    # The crew blocks for minutes, so it runs on the job queue and the client polls /jobs/{job_id}
+    try:
+        job_id = job_queue.submit(run_analysis, securityMode, investmentStrategy, referenceInvestor, df_input, cache_key=cache_key, use_cache=not bypassCache, portfolio_id=portfolioId.strip() or None)
+    except JobQueueFullError as e:
+        return JSONResponse(status_code=503, content={"detail": str(e)})
+    return JSONResponse(status_code=202, content={"job_id": job_id, "status": "queued", "ingestion": ingestion})
+
+def run_batch(securityMode, investmentStrategy, referenceInvestor, df_input, use_cache=True, emit=None):
+    with span('batch', model=model_id(securityMode), lots=len(df_input)):
+        return run_batch_analysis(securityMode, investmentStrategy, referenceInvestor, df_input, use_cache=use_cache, result_cache=get_default_result_cache(), emit=emit)
+
+@app.post("/analyze-portfolios")
+async def analyze_portfolios(
+    files: List[UploadFile] = File(...),
+    securityMode: bool = Form(...),
+    investmentStrategy: str = Form(...),
+    referenceInvestor: str = Form(...),
+    accountColumn: str = Form(BATCH_ACCOUNT_COLUMN),
+    bypassCache: bool = Form(False)
+):
+    """
+    Many accounts in one request: several CSV files (one account each, named after the file)
+    and/or files with an account column. Market data is fetched once for all of them, and
+    per-account results stream as `account` events on /jobs/{job_id}/events.
+    """
+    frames, ingestion = {}, {}
+    for file in files:
+        name = os.path.splitext(os.path.basename(file.filename or ''))[0] or f"portfolio-{len(ingestion) + 1}"
+        try:
+            with span('ingestion') as ingestion_span:
+                holdings = await run_in_threadpool(load_holdings, file.file, extra_columns=(accountColumn,))
+                ingestion_span.set(rows=len(holdings), rejected_rows=holdings.rejected_rows)
+        except IngestionError as e:
+            return JSONResponse(status_code=422, content={"detail": f"{file.filename}: {e}"})
+        ingestion[file.filename or name] = {"rows": len(holdings), "rejected_rows": holdings.rejected_rows, "errors": holdings.errors}
+
+        frame = holdings.frame
+        if accountColumn in frame:
+            # Rows without an account belong to the file's own
+            frame[accountColumn] = frame[accountColumn].astype(object).where(frame[accountColumn].notna(), name)
+            accounts = split_accounts(frame, accountColumn)
+        else:
+            accounts = {name: frame}
+        for account, account_frame in accounts.items():
+            # The same account in several files is analysed as one portfolio
+            frames[account] = pd.concat([frames[account], account_frame], ignore_index=True) if account in frames else account_frame
+
+    if len(frames) > BATCH_MAX_ACCOUNTS:
+        return JSONResponse(status_code=422, content={"detail": f"{len(frames)} accounts in one request, at most {BATCH_MAX_ACCOUNTS} are allowed"})
+    df_input = combine_accounts(frames, BATCH_ACCOUNT_COLUMN)
+
+    if not referenceInvestor:
+        referenceInvestor = "Portfolio Manager"
+
+    try:
+        job_id = job_queue.submit(run_batch, securityMode, investmentStrategy, referenceInvestor, df_input, use_cache=not bypassCache)
+    except JobQueueFullError as e:
+        return JSONResponse(status_code=503, content={"detail": str(e)})
+    return JSONResponse(status_code=202, content={
+        "job_id": job_id,
+        "status": "queued",
+        "accounts": {account: len(frame) for account, frame in frames.items()},
+        "ingestion": ingestion,
+    })
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"detail": "Job not found"})
+    return JSONResponse(content=json_safe(job))
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return JSONResponse(content={
+        "analysis_results": get_default_result_cache().stats(),
+        "llm_responses": get_default_llm_response_cache().stats(),
+        "search_results": get_default_search_cache().stats(),
+    })
+
+@app.get("/health")
+async def health():
+    return JSONResponse(content={"status": "ok", "warm": warm_state})
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Stage latency histograms, token counts and cache hits in the Prometheus text format"""
+    return PlainTextResponse(telemetry.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, request: Request):
+    """Server-Sent Events: metrics, each task's output, then the final result or error"""
+    if job_queue.get(job_id) is None:
+        return JSONResponse(status_code=404, content={"detail": "Job not found"})
+
+    # Reconnecting clients resume after the last event they saw; a malformed id replays from the start
+    try:
+        last_event_id = int(request.headers.get("last-event-id", 0))
+    except ValueError:
+        last_event_id = 0
+
+    async def event_stream():
+        after = last_event_id
+        while True:
+            events = await run_in_threadpool(job_queue.events, job_id, after)
+            for seq, event, data in events:
+                after = seq
+                yield f"id: {seq}\nevent: {event}\ndata: {json.dumps(json_safe(data), allow_nan=False)}\n\n"
+                if event in ("result", "error"):
+                    return
+            if await request.is_disconnected():
+                return
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/monitor/portfolios")
+async def monitor_portfolio(
+    portfolioId: str = Form(...),
+    file: Optional[UploadFile] = File(None)
+):
+    """Monitor the uploaded holdings, or without a file those of the last analysis under the same portfolioId"""
+    portfolio_id = portfolioId.strip()
+    ingestion = None
+    if file is not None:
+        try:
+            holdings = await run_in_threadpool(load_holdings, file.file)
+        except IngestionError as e:
+            return JSONResponse(status_code=422, content={"detail": str(e)})
+        df_input = holdings.frame
+        ingestion = {"rows": len(holdings), "rejected_rows": holdings.rejected_rows, "errors": holdings.errors}
+    else:
+        snapshot = await run_in_threadpool(get_default_snapshot_store().get, portfolio_id)
+        if snapshot is None:
+            return JSONResponse(status_code=404, content={"detail": "No analysed portfolio with this id, upload its holdings"})
+        df_input = snapshot.holdings
+
+    try:
+        state = await run_in_threadpool(monitor.subscribe, portfolio_id, df_input)
+    except MonitorFullError as e:
+        return JSONResponse(status_code=503, content={"detail": str(e)})
+    return JSONResponse(status_code=201, content={"portfolio": state, "ingestion": ingestion})
+
+@app.get("/monitor/portfolios/{portfolio_id}")
+async def get_monitored_portfolio(portfolio_id: str):
+    state = monitor.state([portfolio_id])
+    if not state:
+        return JSONResponse(status_code=404, content={"detail": "Portfolio is not monitored"})
+    return JSONResponse(content=state[0])
+
+@app.delete("/monitor/portfolios/{portfolio_id}")
+async def stop_monitoring(portfolio_id: str):
+    if not monitor.unsubscribe(portfolio_id):
+        return JSONResponse(status_code=404, content={"detail": "Portfolio is not monitored"})
+    return JSONResponse(content={"portfolio_id": portfolio_id, "status": "removed"})
+
+@app.get("/monitor")
+async def monitor_stats():
+    return JSONResponse(content=monitor.stats())
+
+@app.websocket("/monitor/ws")
+async def monitor_socket(websocket: WebSocket, portfolios: str = ""):
+    """
+    Pushes `updates` (the state of every watched portfolio first, then of those that changed)
+    and `alerts` events.
+    Watches the comma-separated `portfolios`, or all of them; clients can send
+    {"subscribe": [...]} and {"unsubscribe": [...]} to change the set.
+    """
+    await websocket.accept()
+    watched = [portfolio_id.strip() for portfolio_id in portfolios.split(",") if portfolio_id.strip()]
+    subscriber = monitor.connect(watched or None)
+
+    async def receive():
+        while True:
+            message = await websocket.receive_json()
+            if isinstance(message, dict):
+                subscriber.watch([str(portfolio_id) for portfolio_id in message.get("subscribe") or []])
+                subscriber.unwatch([str(portfolio_id) for portfolio_id in message.get("unsubscribe") or []])
+
+    async def send():
+        await websocket.send_json({"event": "updates", "data": monitor.state(watched or None)})
+        while True:
+            changed, alerts, dropped = await subscriber.next()
+            if alerts or dropped:
+                await websocket.send_json({"event": "alerts", "data": alerts, "dropped": dropped})
+            if changed:
+                await websocket.send_json({"event": "updates", "data": monitor.state(changed)})
+            # Whatever changes meanwhile is coalesced into the next message
+            await asyncio.sleep(MONITOR_PUSH_INTERVAL)
+
+    tasks = [asyncio.create_task(receive()), asyncio.create_task(send())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        monitor.disconnect(subscriber)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
 if __name__ == "__main__":
     import uvicorn
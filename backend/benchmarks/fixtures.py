@@ -0,0 +1,107 @@
+import zlib
+import threading
+import numpy as np
+import pandas as pd
+from datetime import date, timedelta
+from services.ingestion import CATEGORY_COLUMNS, SCHEMA_COLUMNS
+from tools.price_history import PriceHistoryProvider
+
+SECTORS = ('Technology', 'Healthcare', 'Financials', 'Energy', 'Consumer', 'Industrials', 'Utilities', 'Materials', 'Real Estate')
+# Share of the synthetic universe listed in each currency
+CURRENCY_MIX = (('USD', 0.8), ('EUR', 0.15), ('JPY', 0.05))
+# Synthetic history starts here, so the same ticker gets the same path on every run
+SYNTHETIC_ORIGIN = '2018-01-01'
+
+
+class SyntheticPriceHistoryProvider(PriceHistoryProvider):
+    """
+    Offline market data for any ticker: a geometric random walk on business days, seeded by the
+    ticker name so every run and every process sees the same closes. FX pairs (`...=X`) move
+    around 1 with a lower volatility. Paths are generated once per ticker and kept in memory.
+    """
+
+    def __init__(self, seed=0, origin=SYNTHETIC_ORIGIN):
+        self.seed = seed
+        self.calendar = pd.bdate_range(origin, date.today() + timedelta(days=7), name='Date')
+        self._paths = {}
+        self._lock = threading.Lock()
+
+    def path(self, ticker):
+        with self._lock:
+            closes = self._paths.get(ticker)
+        if closes is not None:
+            return closes
+        rng = np.random.default_rng([self.seed, zlib.crc32(ticker.encode())])
+        if ticker.endswith('=X'):
+            level, volatility, drift = rng.uniform(0.5, 1.5), 0.005, 0.0
+        else:
+            level, volatility, drift = rng.uniform(10, 500), rng.uniform(0.008, 0.03), rng.normal(0.0003, 0.0003)
+        closes = level * np.exp(np.cumsum(rng.normal(drift, volatility, len(self.calendar))))
+        with self._lock:
+            self._paths.setdefault(ticker, closes)
+        return closes
+
+    def fetch(self, tickers, start, end):
+        first, last = self.calendar.searchsorted(pd.Timestamp(start)), self.calendar.searchsorted(pd.Timestamp(end))
+        return pd.DataFrame({ticker: self.path(ticker)[first:last] for ticker in tickers}, index=self.calendar[first:last])
+
+
+class EmptyBetaStore():
+    """Beta store that never has an entry, so every run regresses all tickers"""
+
+    def get_many(self, tickers, benchmark):
+        return {}
+
+    def put_many(self, betas, benchmark, observations):
+        pass
+
+
+def universe_size(lots):
+    # Roughly twenty lots per ticker, like an account that keeps adding to its positions
+    return int(min(max(lots // 20, 5), 3000))
+
+
+def synthetic_holdings(lots, tickers=None, provider=None, seed=0, currency_mix=CURRENCY_MIX, as_of=None):
+    """
+    `lots` purchase lots spread over `tickers` tickers, typed exactly like `load_holdings` output.
+    Purchases fall within the last five years; with a `provider` the purchase and current prices
+    are the closes it reports, otherwise they are drawn at random.
+    """
+    rng = np.random.default_rng(seed)
+    tickers = tickers or universe_size(lots)
+    as_of = pd.Timestamp(as_of or date.today()).normalize()
+    names = np.array([f"T{i:05d}" for i in range(tickers)])
+    currencies = rng.choice([currency for currency, _ in currency_mix], size=tickers, p=[share for _, share in currency_mix])
+    sectors = rng.choice(SECTORS, size=tickers)
+
+    # A few large positions and a long tail, as in real accounts
+    popularity = rng.pareto(1.5, tickers) + 1
+    codes = rng.choice(tickers, size=lots, p=popularity / popularity.sum())
+    purchase_dates = as_of - pd.to_timedelta(rng.integers(1, 5 * 365, lots), unit='D')
+    quantity = rng.integers(1, 200, lots).astype(float)
+
+    if provider is not None:
+        closes = provider.get_close_prices(names, purchase_dates.min() - timedelta(days=10), as_of + timedelta(days=1)).ffill().bfill()
+        rows = np.clip(closes.index.searchsorted(purchase_dates, side='right') - 1, 0, len(closes) - 1)
+        history = closes.reindex(columns=names).to_numpy()
+        purchase_price = history[rows, codes]
+        current_price = history[-1, codes]
+    else:
+        purchase_price = rng.uniform(10, 500, lots)
+        current_price = purchase_price * np.exp(rng.normal(0.05, 0.3, lots))
+
+    frame = pd.DataFrame({
+        'Ticker': names[codes],
+        'Asset Name': np.char.add(names[codes], ' Corp'),
+        'Quantity': quantity,
+        'Purchase Price': purchase_price,
+        'Current Price': current_price,
+        'Purchase Date': purchase_dates,
+        'Sector': sectors[codes],
+        'Currency': currencies[codes],
+        'Dividend Yield': rng.uniform(0, 0.05, lots).astype('float32'),
+        'Total Cost': quantity * purchase_price,
+    }, columns=SCHEMA_COLUMNS)
+    for column in CATEGORY_COLUMNS:
+        frame[column] = frame[column].astype('category')
+    return frame
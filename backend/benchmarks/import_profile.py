@@ -0,0 +1,98 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import subprocess
+from datetime import datetime
+
+# One line per imported module from `python -X importtime`: self and cumulative microseconds, indented by depth
+IMPORT_TIME_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODULES = ('app', 'services.LLM.agent')
+
+
+def parse_import_times(stderr):
+    entries = []
+    for line in stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append({'module': name, 'depth': len(indent) // 2, 'self_us': int(self_us), 'cumulative_us': int(cumulative_us)})
+    return entries
+
+
+def profile_import(module, top=20):
+    """Import `module` in a fresh interpreter and break the time down by package and by top-level import"""
+    started = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True, env={**os.environ, 'WARM_START': 'false'},
+    )
+    wall = time.perf_counter() - started
+    entries = parse_import_times(process.stderr)
+
+    packages = {}
+    for entry in entries:
+        package = entry['module'].split('.')[0]
+        packages[package] = packages.get(package, 0) + entry['self_us']
+    top_level = sorted((entry for entry in entries if entry['depth'] == 0), key=lambda entry: entry['cumulative_us'], reverse=True)
+
+    report = {
+        'module': module,
+        'wall_seconds': round(wall, 3),
+        'import_seconds': round(sum(entry['self_us'] for entry in entries) / 1e6, 3),
+        'modules_imported': len(entries),
+        'packages': [{'package': name, 'seconds': round(us / 1e6, 3)} for name, us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]],
+        'slowest_imports': [{'module': entry['module'], 'seconds': round(entry['cumulative_us'] / 1e6, 3)} for entry in top_level[:top]],
+    }
+    if process.returncode != 0:
+        # The last lines of a failed import are the traceback, not timings
+        report['error'] = [line for line in process.stderr.splitlines() if not line.startswith('import time:')][-1:]
+    return report
+
+
+def profile_warm_up():
+    """Seconds the app's background warm-up takes after `import app`"""
+    script = "import json, app; app.warm_up(); print(json.dumps(app.warm_state))"
+    process = subprocess.run([sys.executable, '-c', script], cwd=BACKEND_DIR, capture_output=True, text=True, env={**os.environ, 'WARM_START': 'false'})
+    lines = process.stdout.strip().splitlines()
+    if process.returncode != 0 or not lines:
+        return {'error': process.stderr.strip().splitlines()[-1:]}
+    return json.loads(lines[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.import_profile', description="Where backend start-up time goes")
+    parser.add_argument('modules', nargs='*', default=list(DEFAULT_MODULES), help="modules to import, each in a fresh interpreter")
+    parser.add_argument('--top', type=int, default=15, help="packages and imports to list")
+    parser.add_argument('--warm-up', action='store_true', help="also time the startup warm-up of the crew and clients")
+    parser.add_argument('--output', default=f".cache/benchmarks/import-profile-{datetime.now():%Y%m%d-%H%M%S}.json")
+    args = parser.parse_args(argv)
+
+    reports = []
+    for module in args.modules:
+        report = profile_import(module, args.top)
+        reports.append(report)
+        print(f"import {module}: {report['import_seconds']:.2f}s in imports, {report['wall_seconds']:.2f}s wall, {report['modules_imported']} modules", file=sys.stderr)
+        for row in report['packages']:
+            print(f"  {row['seconds']:>8.3f}s  {row['package']}", file=sys.stderr)
+        if 'error' in report:
+            print(f"  failed: {' '.join(report['error'])}", file=sys.stderr)
+
+    result = {'created_at': datetime.now().isoformat(timespec='seconds'), 'python': sys.version.split()[0], 'imports': reports}
+    if args.warm_up:
+        result['warm_up'] = profile_warm_up()
+        print(f"warm-up: {result['warm_up']}", file=sys.stderr)
+
+    if os.path.dirname(args.output):
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"report written to {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
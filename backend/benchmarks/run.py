@@ -0,0 +1,271 @@
+import os
+import gc
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import subprocess
+import tracemalloc
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from config import BETA_BENCHMARK, BASE_CURRENCY, TAIL_RISK_PATHS
+from benchmarks.fixtures import SyntheticPriceHistoryProvider, EmptyBetaStore, synthetic_holdings
+
+# Keep crewai's own telemetry from reaching out during benchmarks
+os.environ.setdefault('OTEL_SDK_DISABLED', 'true')
+
+CASES = ('calculate_portfolio', 'calculate_portfolio_beta', 'calculate_portfolio_ratios', 'tail_risk', 'rebalance', 'monitor', 'crew')
+DEFAULT_SIZES = (10, 100, 1000, 10000, 100000)
+
+
+def percentile(values, q):
+    # Nearest rank, so p99 of a few samples is the slowest one rather than an interpolation
+    values = np.sort(values)
+    return float(values[min(len(values) - 1, int(np.ceil(q / 100 * len(values))) - 1)])
+
+
+def measure(func, repeat, warmup=1):
+    """Latencies of `repeat` calls after `warmup` untimed ones, then the peak traced memory of one more"""
+    for _ in range(warmup):
+        func()
+    latencies = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - started)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return np.array(latencies), peak
+
+
+def market_data(args):
+    """The price provider and FX rates every case reads from, never the network"""
+    from tools.fx_rates import FxRates
+
+    if args.prices:
+        from tools.price_warehouse import PriceWarehouse, WarehousePriceHistoryProvider
+
+        provider = WarehousePriceHistoryProvider(None, PriceWarehouse(args.prices), refresh=False)
+    else:
+        provider = SyntheticPriceHistoryProvider(seed=args.seed)
+    return provider, FxRates(provider)
+
+
+def install_market_data(provider, fx):
+    # The crew builds its metrics stage with the default singletons, so point them at the fixtures
+    import tools.price_history as price_history
+    import tools.fx_rates as fx_rates
+    import tools.beta_store as beta_store
+
+    price_history._default_provider = provider
+    fx_rates._default_fx_rates = fx
+    beta_store._default_store = EmptyBetaStore()
+
+
+def crew_case(args, df, provider, fx):
+    from services.LLM.agent import FinancialCrew
+    from services.LLM.llm_cache import LLMResponseCache
+    from services.LLM.search_cache import SearchCache
+    from services.cache import TieredCache, SQLiteCacheTier
+    from benchmarks.stubs import StubLLM, StubSearchTool
+
+    install_market_data(provider, fx)
+    recorded = None
+    if args.llm_fixtures:
+        recorded = LLMResponseCache(TieredCache(1024, float('inf'), SQLiteCacheTier(args.llm_fixtures, 'llm_responses', float('inf'))))
+    results = {}
+    if args.search_fixtures:
+        with open(args.search_fixtures) as f:
+            results = {' '.join(query.lower().split()): text for query, text in json.load(f).items()}
+
+    def run():
+        llm = StubLLM(latency=args.llm_latency, recorded=recorded)
+        # Every run starts with an empty search cache, so repeated searches within one analysis are the only hits
+        search = StubSearchTool(n_results=3, results=results, latency=args.search_latency, search_cache=SearchCache(TieredCache(1024, float('inf'))))
+        FinancialCrew(False, 'Balanced', 'Portfolio Manager', df, use_cache=False, llm=llm, search=search).run()
+    return run
+
+
+def monitor_case(args, df, fx):
+    from services.monitoring import PortfolioBook, monitored_positions
+
+    # --monitor-portfolios portfolios, each holding a random half of the synthetic positions
+    positions, _ = monitored_positions(df, BASE_CURRENCY, fx)
+    book = PortfolioBook()
+    for i in range(args.monitor_portfolios):
+        book.add(f"portfolio-{i}", positions.sample(frac=0.5, random_state=args.seed + i))
+    rng = np.random.default_rng(args.seed)
+    tickers = positions['Ticker'].to_numpy()
+    prices = positions['Price'].to_numpy(dtype=float)
+    clock = iter(range(10 ** 9))
+
+    def tick_every_ticker():
+        # One batch with a tick for every ticker, a random walk from the uploaded prices
+        prices[:] *= np.exp(rng.normal(0, 0.001, len(prices)))
+        return book.apply(pd.Timestamp('2026-01-05 14:30') + pd.Timedelta(seconds=next(clock)), tickers, prices)
+    return tick_every_ticker
+
+
+def build_case(name, args, df, provider, fx):
+    if name == 'calculate_portfolio':
+        from tools.calculate_portfolio_tools import calculate_portfolio
+        return lambda: calculate_portfolio(df)
+    if name == 'calculate_portfolio_beta':
+        from tools.caluculate_beta import calculate_portfolio_beta
+        from services.positions import aggregate_positions
+        # Beta is computed per position, as in the metrics stage
+        positions = aggregate_positions(df).frame
+        return lambda: calculate_portfolio_beta(positions, BETA_BENCHMARK, provider, EmptyBetaStore(), BASE_CURRENCY, fx)
+    if name == 'calculate_portfolio_ratios':
+        from tools.calculate_ratio import calculate_portfolio_ratios
+        from tools.fx_rates import convert_holdings
+        converted = convert_holdings(df, BASE_CURRENCY, fx)
+        return lambda: calculate_portfolio_ratios(converted, provider=provider, fx=fx)
+    if name == 'tail_risk':
+        from tools.calculate_ratio import load_portfolio_returns
+        from tools.fx_rates import convert_holdings
+        from tools.tail_risk import calculate_tail_risk, load_stress_prices
+        from services.positions import aggregate_positions
+        converted = convert_holdings(df, BASE_CURRENCY, fx)
+        positions = aggregate_positions(converted).frame
+        # Market data is loaded once, as the metrics stage does; the case times the covariance, simulation and replays
+        _, returns = load_portfolio_returns(converted, provider, fx=fx)
+        stress_prices = load_stress_prices(positions['Ticker'].unique(), provider)
+        return lambda: calculate_tail_risk(positions, returns, stress_prices=stress_prices, paths=args.tail_risk_paths, workers=args.tail_risk_workers)
+    if name == 'rebalance':
+        from tools.calculate_ratio import load_portfolio_returns
+        from tools.fx_rates import convert_holdings
+        from tools.optimizer import optimize_portfolio
+        from services.positions import aggregate_positions
+        converted = convert_holdings(df, BASE_CURRENCY, fx)
+        positions = aggregate_positions(converted).frame
+        _, returns = load_portfolio_returns(converted, provider, fx=fx)
+        # Solved every time, without the plan cache
+        return lambda: optimize_portfolio(positions, returns, args.strategy)
+    if name == 'monitor':
+        return monitor_case(args, df, fx)
+    if name == 'crew':
+        return crew_case(args, df, provider, fx)
+    raise ValueError(f"unknown case {name}")
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'commit': git_commit(),
+    }
+
+
+def run_benchmarks(args):
+    provider, fx = market_data(args)
+    results = []
+    for lots in args.sizes:
+        df = synthetic_holdings(lots, provider=provider, seed=args.seed)
+        for name in args.cases:
+            repeat = args.crew_repeat if name == 'crew' else args.repeat
+            record = {'case': name, 'lots': lots, 'tickers': int(df['Ticker'].nunique()), 'repeat': repeat}
+            try:
+                latencies, peak = measure(build_case(name, args, df, provider, fx), repeat, args.warmup)
+            except Exception as e:
+                # A case that cannot run here (e.g. crewai missing) is reported, not fatal
+                record['error'] = f"{type(e).__name__}: {e}"
+                print(f"{name:<28}{lots:>8} lots  {record['error']}", file=sys.stderr)
+                results.append(record)
+                continue
+            record.update({
+                'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+                'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+                'mean_ms': round(float(latencies.mean()) * 1000, 3),
+                'min_ms': round(float(latencies.min()) * 1000, 3),
+                'throughput_lots_per_s': round(lots / float(np.median(latencies)), 1),
+                'peak_memory_mb': round(peak / 2 ** 20, 2),
+            })
+            print(f"{name:<28}{lots:>8} lots  p50 {record['p50_ms']:>10.2f} ms  p99 {record['p99_ms']:>10.2f} ms  peak {record['peak_memory_mb']:>8.1f} MB", file=sys.stderr)
+            results.append(record)
+    return results
+
+
+def compare(results, baseline_path, max_regression):
+    """Cases whose p50 is more than `max_regression` slower than in the baseline file"""
+    with open(baseline_path) as f:
+        baseline = {(record['case'], record['lots']): record for record in json.load(f)['results']}
+    regressions = []
+    for record in results:
+        before = baseline.get((record['case'], record['lots']))
+        if not before or 'p50_ms' not in before or 'p50_ms' not in record or not before['p50_ms']:
+            continue
+        record['baseline_p50_ms'] = before['p50_ms']
+        record['p50_change'] = round(record['p50_ms'] / before['p50_ms'] - 1, 3)
+        if record['p50_change'] > max_regression:
+            regressions.append(record)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run', description="Offline benchmarks of the analysis pipeline")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help="portfolio sizes in lots")
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=list(CASES))
+    parser.add_argument('--repeat', type=int, default=10, help="timed runs per case")
+    parser.add_argument('--crew-repeat', type=int, default=3, help="timed runs of the full crew")
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--prices', help="price warehouse directory to replay instead of synthetic prices")
+    parser.add_argument('--llm-fixtures', help="LLM response cache file (LLM_CACHE_PATH) to replay")
+    parser.add_argument('--search-fixtures', help="JSON file of {query: result} to replay")
+    parser.add_argument('--llm-latency', type=float, default=0.0, help="seconds added to every stub LLM call")
+    parser.add_argument('--search-latency', type=float, default=0.0, help="seconds added to every stub search")
+    parser.add_argument('--tail-risk-paths', type=int, default=TAIL_RISK_PATHS, help="Monte Carlo paths of the tail_risk case")
+    parser.add_argument('--tail-risk-workers', type=int, default=0, help="processes simulating the tail_risk case")
+    parser.add_argument('--strategy', default='aggressive', help="investment strategy or objective of the rebalance case")
+    parser.add_argument('--monitor-portfolios', type=int, default=1000, help="portfolios subscribed in the monitor case")
+    parser.add_argument('--output', default=f".cache/benchmarks/{datetime.now():%Y%m%d-%H%M%S}.json")
+    parser.add_argument('--baseline', help="earlier results file to compare against")
+    parser.add_argument('--max-regression', type=float, default=0.2, help="allowed p50 slowdown against the baseline")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args)
+    regressions = compare(results, args.baseline, args.max_regression) if args.baseline else []
+
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'environment': environment(),
+        'options': {name: value for name, value in vars(args).items() if name != 'output'},
+        'results': results,
+        # ru_maxrss is in kilobytes on Linux
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    if os.path.dirname(args.output):
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {args.output}", file=sys.stderr)
+
+    for record in regressions:
+        print(f"regression: {record['case']} at {record['lots']} lots is {record['p50_change']:.0%} slower than the baseline", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,4 +7,152 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 AGENTOPS_API_KEY = os.getenv("AGENTOPS_API_KEY")
 HALLUMINATE_API_KEY = os.getenv("HALLUMINATE_API_KEY")
-HALLUMINATE_UUID= os.getenv("HALLUMINATE_UUID")
\ No newline at end of file
+HALLUMINATE_UUID= os.getenv("HALLUMINATE_UUID")
+
+# Market data
+PRICE_PROVIDER = os.getenv("PRICE_PROVIDER", "yahoo")
+PRICE_DATA_DIR = os.getenv("PRICE_DATA_DIR", "data/prices")
+PRICE_CACHE_DIR = os.getenv("PRICE_CACHE_DIR", ".cache/prices")
+# "warehouse" keeps daily bars in memory-mapped Arrow files, "csv" the older per-ticker CSV cache
+PRICE_STORE = os.getenv("PRICE_STORE", "warehouse")
+PRICE_WAREHOUSE_DIR = os.getenv("PRICE_WAREHOUSE_DIR", ".cache/warehouse")
+# Fetch missing days at request time; turn off when the warehouse is pre-warmed by the CLI
+PRICE_WAREHOUSE_REFRESH = os.getenv("PRICE_WAREHOUSE_REFRESH", "true").lower() == "true"
+# Tickers whose bars stay open in memory in each process
+PRICE_WAREHOUSE_TABLES = int(os.getenv("PRICE_WAREHOUSE_TABLES", 2048))
+
+# FX
+BASE_CURRENCY = os.getenv("BASE_CURRENCY", "USD")
+FX_PROVIDER = os.getenv("FX_PROVIDER", "yahoo")
+FX_DATA_DIR = os.getenv("FX_DATA_DIR", "data/fx")
+FX_CACHE_DIR = os.getenv("FX_CACHE_DIR", ".cache/fx")
+FX_LOOKUP_CACHE_SIZE = int(os.getenv("FX_LOOKUP_CACHE_SIZE", "128"))
+
+# Beta
+BETA_BENCHMARK = os.getenv("BETA_BENCHMARK", "SPY")
+BENCHMARK_CURRENCY = os.getenv("BENCHMARK_CURRENCY", "USD")
+BETA_LOOKBACK_DAYS = int(os.getenv("BETA_LOOKBACK_DAYS", "365"))
+BETA_TTL_HOURS = float(os.getenv("BETA_TTL_HOURS", "24"))
+BETA_STORE_PATH = os.getenv("BETA_STORE_PATH", ".cache/betas.sqlite")
+
+# Metrics stage
+METRICS_WORKERS = int(os.getenv("METRICS_WORKERS", "4"))
+METRICS_TIMEOUT_SECONDS = float(os.getenv("METRICS_TIMEOUT_SECONDS", "60"))
+
+# Tail risk: Monte Carlo VaR/CVaR and historical stress replays
+TAIL_RISK_PATHS = int(os.getenv("TAIL_RISK_PATHS", "20000"))
+# Daily returns the covariance is estimated from, counted back from the latest close
+TAIL_RISK_LOOKBACK_DAYS = int(os.getenv("TAIL_RISK_LOOKBACK_DAYS", "365"))
+# Paths generated at once, so memory stays at one chunk x assets block however many paths are asked for
+TAIL_RISK_CHUNK_PATHS = int(os.getenv("TAIL_RISK_CHUNK_PATHS", "10000"))
+# Processes sharing the chunks out, 0 simulates in the calling thread
+TAIL_RISK_WORKERS = int(os.getenv("TAIL_RISK_WORKERS", "0"))
+# "cholesky", "factor", or "auto": Cholesky up to TAIL_RISK_CHOLESKY_MAX_ASSETS, a PCA factor model above
+TAIL_RISK_METHOD = os.getenv("TAIL_RISK_METHOD", "auto")
+TAIL_RISK_CHOLESKY_MAX_ASSETS = int(os.getenv("TAIL_RISK_CHOLESKY_MAX_ASSETS", "250"))
+TAIL_RISK_FACTORS = int(os.getenv("TAIL_RISK_FACTORS", "20"))
+# Degrees of freedom of the Student-t shocks, 0 for normal shocks
+TAIL_RISK_DOF = float(os.getenv("TAIL_RISK_DOF", "5"))
+TAIL_RISK_SHRINKAGE = float(os.getenv("TAIL_RISK_SHRINKAGE", "0.1"))
+TAIL_RISK_SEED = int(os.getenv("TAIL_RISK_SEED", "0"))
+
+# Rebalancing optimizer: target weights per investment strategy and the trades the advisor explains
+OPTIMIZER_LOOKBACK_DAYS = int(os.getenv("OPTIMIZER_LOOKBACK_DAYS", "365"))
+OPTIMIZER_MAX_WEIGHT = float(os.getenv("OPTIMIZER_MAX_WEIGHT", "0.2"))  # per position, 0 for no cap
+OPTIMIZER_MAX_TURNOVER = float(os.getenv("OPTIMIZER_MAX_TURNOVER", "0.3"))  # one-way share of value, 0 for no limit
+# Expected returns are pulled this far towards the average, since single-asset means are mostly noise
+OPTIMIZER_RETURN_SHRINKAGE = float(os.getenv("OPTIMIZER_RETURN_SHRINKAGE", "0.5"))
+# Weight changes below this are left out of the trade list
+OPTIMIZER_MIN_TRADE = float(os.getenv("OPTIMIZER_MIN_TRADE", "0.005"))
+OPTIMIZER_CACHE_SIZE = int(os.getenv("OPTIMIZER_CACHE_SIZE", "256"))
+OPTIMIZER_CACHE_TTL_HOURS = float(os.getenv("OPTIMIZER_CACHE_TTL_HOURS", "24"))
+
+# Real-time monitoring: portfolios subscribed to a price tick feed, pushed over WebSocket
+# Recorded CSV (or .jsonl) of Timestamp, Ticker, Price rows to replay; empty runs without a feed
+MONITOR_FEED_PATH = os.getenv("MONITOR_FEED_PATH", "")
+MONITOR_REPLAY_SPEED = float(os.getenv("MONITOR_REPLAY_SPEED", "1"))  # 0 replays as fast as possible
+MONITOR_REPLAY_LOOP = os.getenv("MONITOR_REPLAY_LOOP", "false").lower() == "true"
+# Without MONITOR_FEED_PATH, live prices of the monitored tickers are polled from PRICE_PROVIDER this often, 0 for no feed
+MONITOR_POLL_SECONDS = float(os.getenv("MONITOR_POLL_SECONDS", "0"))
+MONITOR_MAX_PORTFOLIOS = int(os.getenv("MONITOR_MAX_PORTFOLIOS", "10000"))
+# Rolling volatility is realized over the last MONITOR_VOLATILITY_WINDOW samples, at most one per MONITOR_SAMPLE_SECONDS of feed time
+MONITOR_VOLATILITY_WINDOW = int(os.getenv("MONITOR_VOLATILITY_WINDOW", "60"))
+MONITOR_SAMPLE_SECONDS = float(os.getenv("MONITOR_SAMPLE_SECONDS", "60"))
+# Alerts fire once when crossed and re-arm after recovering past half the threshold
+MONITOR_DRAWDOWN_ALERT = float(os.getenv("MONITOR_DRAWDOWN_ALERT", "0.05"))  # from the peak since monitoring started
+MONITOR_MOVE_ALERT = float(os.getenv("MONITOR_MOVE_ALERT", "0.03"))  # since the last move alert
+MONITOR_VOLATILITY_ALERT = float(os.getenv("MONITOR_VOLATILITY_ALERT", "0.4"))  # annualized, 0 for none
+# Per WebSocket: updates are coalesced to the latest state and sent at most this often, alerts queue up to MONITOR_QUEUE_SIZE
+MONITOR_PUSH_INTERVAL = float(os.getenv("MONITOR_PUSH_INTERVAL", "0.5"))
+MONITOR_QUEUE_SIZE = int(os.getenv("MONITOR_QUEUE_SIZE", "256"))
+
+# Analysis jobs
+JOB_BACKEND = os.getenv("JOB_BACKEND", "memory")
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", ".cache/jobs.sqlite")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_DEPTH = int(os.getenv("JOB_QUEUE_DEPTH", "16"))
+JOB_RETENTION_HOURS = float(os.getenv("JOB_RETENTION_HOURS", "24"))
+
+# Batch analysis of many accounts in one request
+BATCH_ACCOUNT_COLUMN = os.getenv("BATCH_ACCOUNT_COLUMN", "Account")
+BATCH_MAX_ACCOUNTS = int(os.getenv("BATCH_MAX_ACCOUNTS", "100"))
+# Crews of one batch running at once, bounded so the LLM provider's rate limits hold
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+
+# Analysis result cache
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "256"))
+RESULT_CACHE_TTL_HOURS = float(os.getenv("RESULT_CACHE_TTL_HOURS", "6"))
+RESULT_CACHE_FRESHNESS_HOURS = float(os.getenv("RESULT_CACHE_FRESHNESS_HOURS", "24"))
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", "")
+
+# Portfolio snapshots, so a re-upload under the same portfolio id only recomputes what changed
+SNAPSHOT_STORE_PATH = os.getenv("SNAPSHOT_STORE_PATH", ".cache/snapshots.sqlite")
+SNAPSHOT_TTL_HOURS = float(os.getenv("SNAPSHOT_TTL_HOURS", "720"))
+# The narrative is only written again when a metric moved more than this since it was last written
+MATERIAL_RETURN_CHANGE = float(os.getenv("MATERIAL_RETURN_CHANGE", "1.0"))  # percentage points
+MATERIAL_RATIO_CHANGE = float(os.getenv("MATERIAL_RATIO_CHANGE", "0.1"))  # Sharpe and Sortino
+MATERIAL_BETA_CHANGE = float(os.getenv("MATERIAL_BETA_CHANGE", "0.05"))
+MATERIAL_DRAWDOWN_CHANGE = float(os.getenv("MATERIAL_DRAWDOWN_CHANGE", "0.02"))
+MATERIAL_WEIGHT_CHANGE = float(os.getenv("MATERIAL_WEIGHT_CHANGE", "0.05"))  # any sector's weight
+MATERIAL_TURNOVER = float(os.getenv("MATERIAL_TURNOVER", "0.05"))  # share of cost traded
+
+# LLM response cache
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1024"))
+LLM_CACHE_TTL_HOURS = float(os.getenv("LLM_CACHE_TTL_HOURS", "24"))
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".cache/llm.sqlite")
+
+# Web search cache: results are kept for as long as their topic stays current
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "serper")
+# Stand-in results for SEARCH_BACKEND=local, JSON files of {query: result}
+SEARCH_DATA_DIR = os.getenv("SEARCH_DATA_DIR", "data/search")
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "512"))
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH", ".cache/search.sqlite")
+SEARCH_CACHE_TTL_HOURS = float(os.getenv("SEARCH_CACHE_TTL_HOURS", "24"))
+SEARCH_NEWS_TTL_HOURS = float(os.getenv("SEARCH_NEWS_TTL_HOURS", "6"))
+SEARCH_ANOMALY_TTL_HOURS = float(os.getenv("SEARCH_ANOMALY_TTL_HOURS", "72"))
+SEARCH_INVESTOR_TTL_HOURS = float(os.getenv("SEARCH_INVESTOR_TTL_HOURS", "168"))
+# Reference investors whose searches the prefetch job keeps warm
+SEARCH_PREFETCH_INVESTORS = [name.strip() for name in os.getenv("SEARCH_PREFETCH_INVESTORS", "Warren Buffett,Ray Dalio,Peter Lynch,Charlie Munger,Cathie Wood").split(",") if name.strip()]
+
+# LLM clients, shared by every request in the process
+SECURITY_MODE_MODEL = os.getenv("SECURITY_MODE_MODEL", "ollama/llama3.2")
+CLOUD_MODEL = os.getenv("CLOUD_MODEL", "groq/llama-3.2-90b-text-preview")
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+# Import the crew and build the clients in the background at startup instead of on the first request
+WARM_START = os.getenv("WARM_START", "true").lower() == "true"
+
+# Crew execution: "parallel" runs independent analysts concurrently, "sequential" is the single crewai process
+CREW_PROCESS = os.getenv("CREW_PROCESS", "parallel")
+
+# Number of largest positions listed individually in prompts
+HOLDINGS_SUMMARY_TOP_N = int(os.getenv("HOLDINGS_SUMMARY_TOP_N", "10"))
+
+# CSV ingestion
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "50000"))
+INGEST_MAX_REPORTED_ERRORS = int(os.getenv("INGEST_MAX_REPORTED_ERRORS", "100"))
+
+# Telemetry
+TELEMETRY_ENABLED = os.getenv("TELEMETRY_ENABLED", "true").lower() == "true"
+# Optional local file receiving every span as OTLP/JSON, one export request per line
+TELEMETRY_OTLP_FILE = os.getenv("TELEMETRY_OTLP_FILE", "")
+TELEMETRY_SERVICE_NAME = os.getenv("TELEMETRY_SERVICE_NAME", "nexa-port-backend")
@@ -1,62 +1,115 @@
+import re
+import json
+import math
+import time
+import json_repair
 import pandas as pd
 # import agentops
 from typing import Dict, Optional
 from pydantic import BaseModel, Field
-from tools.halluminate import ReviewTools
-from tools.calculate_ratio import calculate_portfolio_ratios
-from tools.caluculate_beta import calculate_portfolio_beta
-from tools.calculate_portfolio_tools import calculate_portfolio
-from config import OPENAI_API_KEY, GROQ_API_KEY, AGENTOPS_API_KEY
-from crewai import Crew, Agent, Task, LLM
+from services.metrics import MetricsStage, with_rebalance
+from services.LLM.clients import llm_pool, get_search_tool
+from services.telemetry import span, current_context, telemetry
+from concurrent.futures import ThreadPoolExecutor
+from config import AGENTOPS_API_KEY, CREW_PROCESS
+from crewai import Crew, Agent, Task
 from textwrap import dedent
-from langchain_groq import ChatGroq
-from crewai_tools import (
-    SerperDevTool,
-    WebsiteSearchTool,
-)
 from crewai.process import Process
 # agentops.init(api_key=AGENTOPS_API_KEY)
 
-# Tools
-search_tool = SerperDevTool(n_results=3)
-web_rag_tool = WebsiteSearchTool(website='https://www.investopedia.com/articles/financial-theory/11/trading-with-market-anomalies.asp')
-
 class PortfolioStrategyAnalysis(BaseModel):
     """Portfolio analysis model"""
-    overall_score: int = Field(..., description="Overall score of the portfolio")
+    overall_score: Optional[int] = Field(None, description="Overall score of the portfolio")
     overall_analysis: str = Field(..., description="General analysis of the portfolio")
-    total_return: float = Field(..., description="Total return in percentage")
+    total_return: Optional[float] = Field(None, description="Total return in percentage")
     benchmark_outperformance: Optional[float] = Field(None, description="Benchmark outperformance in percentage")
-    top_performer: Dict[str, str] = Field(..., description="Top performer in the portfolio")
-    underperformer: Dict[str, str] = Field(..., description="Underperformer in the portfolio")
+    top_performer: Optional[Dict[str, str]] = Field(None, description="Top performer in the portfolio")
+    underperformer: Optional[Dict[str, str]] = Field(None, description="Underperformer in the portfolio")
     volatility: str = Field(..., description="Volatility description")
     volatility_explanation: str = Field(..., description="Explanation of volatility")
-    portfolio_beta: float = Field(..., description="Portfolio beta value")
+    portfolio_beta: Optional[float] = Field(None, description="Portfolio beta value")
     anomaly: str = Field(..., description="Any anomalies observed in the portfolio")
     anomaly_explanation: str = Field(..., description="Explanation of anomalies")
     portfolio_suggestion: str = Field(..., description="Suggested portfolio strategy")
-    potential_improvement_score: int = Field(..., description="Potential improvement score")
-    sharp_ratio: float = Field(..., description="Sharp ratio value")
+    potential_improvement_score: Optional[int] = Field(None, description="Potential improvement score")
+    sharp_ratio: Optional[float] = Field(None, description="Sharp ratio value")
     sharp_ratio_explanation: str = Field(..., description="Explanation of sharp ratio")
-    sortino_ratio: float = Field(..., description="Sortino ratio value")
+    sortino_ratio: Optional[float] = Field(None, description="Sortino ratio value")
     sortino_ratio_explanation: str = Field(..., description="Explanation of sortino ratio")
-    max_drawdown: float = Field(..., description="Maximum drawdown value")
+    max_drawdown: Optional[float] = Field(None, description="Maximum drawdown value")
     max_drawdown_explanation: str = Field(..., description="Maximum drawdown value")
     performance_overview: str = Field(..., description="Performance overview")
-    portfolio_cagr: float = Field(..., description="Portfolio CAGR value")
+    portfolio_cagr: Optional[float] = Field(None, description="Portfolio CAGR value")
     portfolio_cagr_explanation: str = Field(..., description="Explanation of portfolio CAGR")
+    money_weighted_return: Optional[float] = Field(None, description="Annualized money-weighted return (XIRR) in percentage")
+    time_weighted_return_1y: Optional[float] = Field(None, description="Time-weighted return over the last year in percentage")
+    exposures: Optional[dict] = Field(None, description="Sector weights, contributions to return and risk, and concentration")
+    tail_risk: Optional[dict] = Field(None, description="Monte Carlo VaR/CVaR and historical stress scenario results")
+    rebalance: Optional[dict] = Field(None, description="Optimizer target weights and trade list for the investment strategy")
+    errors: Optional[Dict[str, str]] = Field(None, description="Metrics stages and agents that failed, with the reason")
 
     
 class FinancialCrew:
-    def __init__(self, securityMode, investmentStrategy, referenceInvestor, df_input):
+    def __init__(self, securityMode, investmentStrategy, referenceInvestor, df_input, metrics=None, use_cache=True, llm=None, search=None):
         self.securityMode = securityMode
         self.investmentStrategy = investmentStrategy
         self.referenceInvestor = referenceInvestor
         self.df_input = df_input
+        self.metrics = metrics
+        self.use_cache = use_cache
+        # Replacements for the model client and the web search tool, e.g. offline stubs
+        self.llm = llm
+        self.search = search
+
+    def run(self, on_event=None):
+        # on_event(event, data) receives progress as each stage completes
+        emit = on_event or (lambda event, data: None)
+
+        # Gather all deterministic metrics concurrently before any LLM task is built
+        if self.metrics is None:
+            self.metrics = MetricsStage().run(self.df_input)
+        self.metrics = with_rebalance(self.metrics, self.investmentStrategy)
+        emit('metrics', self.metrics.summary())
+
+        agents = FinancialAnalysisAgents(self.securityMode, self.investmentStrategy, self.use_cache, llm=self.llm, search=self.search)
+        if CREW_PROCESS == 'sequential':
+            return self._run_sequential(agents, emit)
+        return self._run_parallel(agents, emit)
+
+    def _kickoff(self, agent, build_task, emit):
+        crew = Crew(
+            agents=[agent],
+            tasks=[build_task(agent)],
+            verbose=True,
+            process=Process.sequential,
+            task_callback=lambda output: emit('task', _task_event(output))
+        )
+        with span('crew.task', agent=agent.role):
+            return _parse_output(crew.kickoff().raw)
+
+    def _run_parallel(self, agents, emit):
+        # Performance and risk analysis are independent, so they run at the same time and
+        # their outputs are merged in code rather than carried forward by each LLM
+        # A failed or unreadable stage leaves its fields empty and is reported, the rest still runs
+        tasks = FinancialAnalysisTasks(self.metrics, self.referenceInvestor, standalone=True)
+        errors = {}
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix='crew') as executor:
+            performance = executor.submit(current_context().run, self._kickoff, agents.performance_analyst(), tasks.performance_analysis, emit)
+            risk = executor.submit(current_context().run, self._kickoff, agents.risk_analyst(), tasks.risk_analysis, emit)
+            analysis = merge_analyses(_stage_output('performance_analysis', performance.result, errors), _stage_output('risk_analysis', risk.result, errors))
+
+        suggestion = _stage_output('portfolio_suggestion', lambda: self._kickoff(agents.portfolio_advisor(), lambda agent: tasks.create_portfolio_suggestion(agent, analysis), emit), errors)
+        if suggestion is not None and not isinstance(suggestion, dict):
+            suggestion = {'portfolio_suggestion': str(suggestion)}
+        analysis = merge_analyses(analysis, suggestion)
+
+        summary = _stage_output('manager_summary', lambda: self._kickoff(agents.manager(), lambda agent: tasks.manager_summary(agent, analysis), emit), errors)
+        if summary is not None and not isinstance(summary, dict):
+            errors['manager_summary'] = "output is not valid JSON"
+        return build_strategy_analysis(analysis, summary, self.metrics, errors).model_dump_json()
 
-    def run(self):
-        agents = FinancialAnalysisAgents(self.securityMode, self.investmentStrategy)
-        tasks = FinancialAnalysisTasks(self.df_input, self.referenceInvestor)
+    def _run_sequential(self, agents, emit):
+        tasks = FinancialAnalysisTasks(self.metrics, self.referenceInvestor)
 
         performance_analyst = agents.performance_analyst()
         risk_analyst = agents.risk_analyst()
@@ -70,6 +123,15 @@ class FinancialCrew:
         review_suggestion = tasks.review_suggestion(advise_reviewer)
         manager_task = tasks.manager_summary(manager)
 
+        # Tasks run back to back, so each one took the time since the previous one finished
+        last_finished = [time.perf_counter()]
+
+        def on_task(output):
+            now = time.perf_counter()
+            telemetry.observe('crew.task', now - last_finished[0], agent=str(output.agent))
+            last_finished[0] = now
+            emit('task', _task_event(output))
+
         crew = Crew(
             agents=[
                 performance_analyst,
@@ -86,32 +148,100 @@ class FinancialCrew:
                 manager_task
             ],
             verbose=True,
-            process=Process.sequential
+            process=Process.sequential,
+            task_callback=on_task
         )
 
-        result = crew.kickoff()
-        return result.json
+        with span('crew.kickoff'):
+            result = crew.kickoff()
+
+        # Each task saw the ones before it, but the numbers still come from the metrics stage
+        errors = {}
+        analysis = merge_analyses(*(_parse_output(output.raw) for output in result.tasks_output[:-1]))
+        summary = _parse_output(result.raw)
+        if summary is not None and not isinstance(summary, dict):
+            errors['manager_summary'] = "output is not valid JSON"
+        return build_strategy_analysis(analysis, summary, self.metrics, errors).model_dump_json()
+
+def _parse_output(raw):
+    # Models often wrap the JSON in prose or code fences, or leave it slightly malformed
+    try:
+        return json.loads(raw)
+    except (TypeError, ValueError):
+        repaired = json_repair.loads(raw) if raw else None
+        return repaired if isinstance(repaired, dict) and repaired else raw
+
+def _stage_output(stage, run, errors):
+    """run(), or None with the failure recorded in `errors`"""
+    try:
+        return run()
+    except Exception as e:
+        errors[stage] = f"{type(e).__name__}: {e}"
+        return None
+
+def _task_event(output):
+    return {'agent': output.agent, 'output': _parse_output(output.raw)}
+
+def merge_analyses(*outputs):
+    """Merge analyst JSON outputs in order; later outputs win on shared keys"""
+    merged = {}
+    for output in outputs:
+        if isinstance(output, dict):
+            merged.update(output)
+    return merged
+
+def _performer(value):
+    if not isinstance(value, dict):
+        return None
+    return {
+        'ticker': str(value.get('ticker', value.get('Ticker', ''))),
+        'name': str(value.get('name', value.get('Asset Name', ''))),
+    }
+
+def _score(value):
+    """A 0-100 score from what a model wrote: 72, 72.5, "72", "72%" or "7/10"; None when unreadable"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str):
+        match = re.fullmatch(r'\s*(-?\d+(?:\.\d+)?)\s*(?:/\s*(\d+(?:\.\d+)?)|%)?\s*', value)
+        if match is None:
+            return None
+        number, scale = float(match.group(1)), match.group(2)
+        value = number * 100 / float(scale) if scale and float(scale) else number
+    if not isinstance(value, (int, float)) or not math.isfinite(value):
+        return None
+    return int(min(100, max(0, round(value))))
+
+def _number(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+def build_strategy_analysis(analysis, summary, metrics, errors=None):
+    """Assemble the final result from the analysts, the manager summary and the computed metrics"""
+    fields = merge_analyses(analysis, summary)
+    fields['top_performer'] = _performer(fields.get('top_performer') or fields.get('best_performer'))
+    fields['underperformer'] = _performer(fields.get('underperformer'))
+    # Numbers computed in Python always override what the models wrote
+    fields.update(metrics.summary())
+    for name in ('overall_score', 'potential_improvement_score'):
+        fields[name] = _score(fields.get(name))
+    for name, info in PortfolioStrategyAnalysis.model_fields.items():
+        if info.annotation is str:
+            fields[name] = "" if fields.get(name) is None else str(fields[name])
+        elif info.annotation == Optional[float] and name in fields:
+            fields[name] = _number(fields[name])
+    fields['errors'] = {**metrics.errors, **(errors or {})} or None
+    return PortfolioStrategyAnalysis(**{name: fields[name] for name in PortfolioStrategyAnalysis.model_fields if name in fields})
 
 class FinancialAnalysisAgents:
-    def __init__(self, securityMode, investmentStrategy):
+    def __init__(self, securityMode, investmentStrategy, use_cache=True, llm=None, search=None):
         self.investmentStrategy = investmentStrategy
-        if securityMode == True:
-            self.llm = LLM(
-                model="ollama/llama3.2",
-                base_url="http://localhost:11434",
-            )
-        else:
-            # self.llm = LLM(
-            #     model="gpt-4o-mini",
-            #     temperature=0,
-            #     api_key=OPENAI_API_KEY,
-            # )
-            self.llm=ChatGroq(
-                temperature=0,
-                model="groq/llama-3.2-90b-text-preview",
-                groq_api_key=GROQ_API_KEY,
-                verbose=True
-            )
+        # Clients and tools come from process-wide pools and are built on first use
+        self.search_tool = search or get_search_tool()
+        self.llm = llm or llm_pool.get(securityMode, use_cache)
 
     def performance_analyst(self):
         return Agent(
@@ -137,7 +267,7 @@ class FinancialAnalysisAgents:
             """,
             verbose=True,
             tools=[
-                search_tool
+                self.search_tool
             ],
             llm	= self.llm 
         )
@@ -154,12 +284,14 @@ class FinancialAnalysisAgents:
             """,
             verbose=True,
             tools=[
-                search_tool
+                self.search_tool
                 ],
             llm=self.llm 
     )
 
     def advise_reviewer(self):
+        from tools.halluminate import ReviewTools
+
         return Agent(
             role='Portfolio Advise Reviewer',
             goal="Review the portfolio suggestion and brush up the suggestion.",
@@ -187,13 +319,90 @@ class FinancialAnalysisAgents:
             llm	= self.llm 
         )
 
+# Outputs of standalone tasks, which only report their own narrative fields;
+# every numeric field is filled in from the computed metrics
+PERFORMANCE_ANALYSIS_OUTPUT = """
+    Your final output should be a JSON object with the following structure:
+    {
+        "analysis_result": str,
+        "performance_overview": str,
+        "portfolio_cagr_explanation": str
+    }
+"""
+
+RISK_ANALYSIS_OUTPUT = """
+    After analysis, provide a JSON object with the following structure:
+    {
+        "volatility": str,
+        "volatility_explanation": str,
+        "anomaly": str,
+        "anomaly_explanation": str,
+        "sharp_ratio_explanation": str,
+        "sortino_ratio_explanation": str,
+        "max_drawdown_explanation": str,
+        "portfolio_cagr_explanation": str
+    }
+"""
+
+PORTFOLIO_SUGGESTION_OUTPUT = """
+    {
+        "portfolio_suggestion": str
+    }
+"""
+
+MANAGER_SUMMARY_OUTPUT = """
+    {
+        "overall_score": int,
+        "overall_analysis": str,
+        "potential_improvement_score": int
+    }
+"""
+
 class FinancialAnalysisTasks:
-    def __init__(self, df_input, referenceInvestor):
-        self.df_input = df_input
+    def __init__(self, metrics, referenceInvestor, standalone=False):
+        # standalone tasks only report their own fields, the crew merges them in code
+        self.metrics = metrics
         self.referenceInvestor = referenceInvestor
+        self.standalone = standalone
+
+    def _unavailable_note(self, *stages):
+        failed = {stage: self.metrics.errors[stage] for stage in stages if stage in self.metrics.errors}
+        if not failed:
+            return ""
+        return f"Note: these calculations are unavailable, do not invent values for them: {failed}"
+
+    def _context(self, analysis):
+        # The trade list is only for the advisor, who is given it on its own
+        calculated_metrics = {name: value for name, value in self.metrics.summary().items() if name != 'rebalance'}
+        return json.dumps({'calculated_metrics': calculated_metrics, **analysis})
+
+    def _rebalance_steps(self):
+        plan = self.metrics.rebalance
+        if not plan:
+            return "- Provides specific, actionable recommendations (e.g., rebalancing, new positions, exits) that " + self.referenceInvestor + " might suggest"
+        # One line, so the task description still dedents
+        return (
+            f"- Explains the trades in rebalance_plan, computed by the {plan['objective'].replace('_', ' ')} optimizer, as the recommended actions: "
+            "what the largest trades do and how expected return and volatility change from current to target. "
+            f"Do not propose other weights, amounts or positions. rebalance_plan: {json.dumps(plan)}"
+        )
 
     def performance_analysis(self, agent):
-        callucate_result = calculate_portfolio(self.df_input)
+        callucate_result = json.dumps(self.metrics.performance)
+        if self.standalone:
+            # The numbers are already computed, the model only writes the narrative
+            return Task(
+                description=dedent(f"""
+                    Evaluate the portfolio's performance using the calculated results below and provide insights.
+                    - Create a performance overview based on the results.
+                    - Explain the portfolio CAGR in less than 20 words.
+
+                    calculate_result: {callucate_result}
+                    {self._unavailable_note('performance')}
+                """),
+                agent=agent,
+                expected_output=PERFORMANCE_ANALYSIS_OUTPUT
+            )
         return Task(
             description=dedent(f"""
                 Analyze the provided CSV data to evaluate the portfolio's performance.
@@ -209,6 +418,7 @@ class FinancialAnalysisTasks:
                 After calculations, evaluate the results and provide insights.
                                
                 calculate_result: {callucate_result}
+                {self._unavailable_note('performance')}
             """),
             agent=agent,
             expected_output="""
@@ -230,14 +440,20 @@ class FinancialAnalysisTasks:
 
 
     def risk_analysis(self, agent):
-        portfolio_beta, each_stock_result = calculate_portfolio_beta(self.df_input)
-        portfolio_ratio_result = calculate_portfolio_ratios(self.df_input)
+        portfolio_beta = self.metrics.portfolio_beta
+        holdings_summary = json.dumps(self.metrics.holdings_summary())
+        missing_betas = list(self.metrics.missing_betas)
+        portfolio_ratio_result = self.metrics.ratios
+        exposures = json.dumps(self.metrics.exposures)
+        tail_risk = json.dumps(self.metrics.tail_risk)
         return Task(
             description=dedent(f"""
                 Assess the volatility and risk based on the provided reuslts and search data.
                                
                 Perform the following:
                 - Assess portfolio volatility (High,Moderate,Low) based on portfolio_beta results.
+                - Take sector concentration and each sector's share of portfolio risk from sector_exposures into account in the volatility explanation.
+                - Mention the 10-day 99% VaR and CVaR from tail_risk and the worst historical stress scenario in the volatility explanation.
                 - Search for any market anomalies related to the portfolio using search tool. Example Keywords: U.S. Election Uncertainty, Geopolitical Tensions and Market Reactions, Halloween effect etc.
                 - Determine anomaly level (High,Moderate,Low) based on the search results.
                 - Create the volatility and anomaly explanations based on the calculated data with a detailed analysis.
@@ -246,13 +462,17 @@ class FinancialAnalysisTasks:
 
                 Results of the calculations:             
                 - portfolio_beta: {portfolio_beta}
-                - each_stock_result: {each_stock_result}
+                - holdings_summary (largest positions and aggregates): {holdings_summary}
+                - tickers without beta data (excluded from portfolio_beta): {missing_betas}
                 - portfolio_ratio_result: {portfolio_ratio_result}
+                - sector_exposures (weights, contribution to return in percentage points, share of portfolio variance, concentration): {exposures}
+                - tail_risk (Monte Carlo VaR/CVaR as losses in percent and base currency, historical stress replays in percent): {tail_risk}
+                {self._unavailable_note('beta', 'ratios', 'exposure', 'stress', 'tail_risk')}
 
-                Note: Please remain the result of performance_analysis task in output.
+                {"" if self.standalone else "Note: Please remain the result of performance_analysis task in output."}
             """),
             agent=agent,
-            expected_output="""
+            expected_output=RISK_ANALYSIS_OUTPUT if self.standalone else """
                 After analysis, provide a JSON object with the following structure:
                 {
                     "analysis_result": str, 
@@ -281,10 +501,14 @@ class FinancialAnalysisTasks:
         )
     
 
-    def create_portfolio_suggestion(self, agent):
+    def create_portfolio_suggestion(self, agent, analysis=None):
+        if self.standalone:
+            context_note = f"Performance and risk analysis results: {self._context(analysis)}"
+        else:
+            context_note = "!!! note: please remain the result of performance_analysis and risk_analysis tasks in output."
         return Task(
             description=dedent(f"""
-                !!! note: please remain the result of performance_analysis and risk_analysis tasks in output.
+                {context_note}
                 !!! please make sure the output is in json format, must not include comments.
                 !!! please do not mention the name of the referenceInvestor in the portfolio_suggestion.
                 If '{self.referenceInvestor}' is 'Portfolio Manager', Please do not use the SerperDevTool.
@@ -297,7 +521,7 @@ class FinancialAnalysisTasks:
                 4. Develop a detailed investment suggestion that:
                 - Addresses the portfolio's strengths and weaknesses from {self.referenceInvestor}'s perspective
                 - Incorporates {self.referenceInvestor}'s known investment philosophy and recent market views
-                - Provides specific, actionable recommendations (e.g., rebalancing, new positions, exits) that {self.referenceInvestor} might suggest
+                {self._rebalance_steps()}
                 - Considers current market conditions and trends, filtered through {self.referenceInvestor}'s typical analytical approach
                 5. Write the suggestion in a style that closely mimics {self.referenceInvestor}'s communication style, using similar phraseology and focusing on their known areas of expertise.
             
@@ -306,7 +530,7 @@ class FinancialAnalysisTasks:
                 The final output should be presented as if it were personally analyzed and crafted by {self.referenceInvestor}, though their name is not explicitly mentioned.
             """),
             agent=agent,
-            expected_output="""
+            expected_output=PORTFOLIO_SUGGESTION_OUTPUT if self.standalone else """
                 {
                     "analysis_result": str, 
                     "total_value": float,
@@ -372,7 +596,23 @@ class FinancialAnalysisTasks:
                 }
             """
         )
-    def manager_summary(self, agent):
+    def manager_summary(self, agent, analysis=None):
+        if self.standalone:
+            return Task(
+                description=dedent(f"""
+                    !!! please make sure the output is in json format, must not include comments.
+                    Review the combined results of the Performance Analyst, Risk Analyst and Portfolio Advisor below.
+                    Create a comprehensive summary that includes:
+                    - Overall Score (based on results of both analysts. Scale 0-100)
+                    - Overall Analysis (a narrative combining performance and risk insights)
+                    - Potential Improvement Score: based on the overall_score and portfolio_suggestion, provide a score that indicates the potential improvement of the portfolio.
+                      (Please make sure the sum of overall_score and potential_improvement_score is less than 100 and potential_improvement_score must be caluculated strictly based on the portfolio_suggestion.)
+
+                    Analysis results: {self._context(analysis)}
+                """),
+                agent=agent,
+                expected_output=MANAGER_SUMMARY_OUTPUT
+            )
         return Task(
             description=dedent(f"""
                 !!! note: please remain the result of performance_analysis and risk_analysis tasks in output.
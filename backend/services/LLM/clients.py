@@ -0,0 +1,144 @@
+import threading
+from typing import Any
+from crewai import LLM
+from crewai_tools import SerperDevTool
+from litellm.integrations.custom_logger import CustomLogger
+from config import GROQ_API_KEY, SEARCH_BACKEND, OLLAMA_BASE_URL
+from services.LLM.llm_cache import get_default_llm_response_cache, model_id
+from services.LLM.search_cache import get_default_search_cache, default_local_backend
+from services.telemetry import span, telemetry
+
+# crewai clients and tools, built on first use and shared by every request in the process.
+# Importing this module pulls in crewai and litellm, so the app only does it when a crew runs
+# or from the background warm-up.
+
+
+class TokenUsageLogger(CustomLogger):
+    """litellm callback that records the token usage it reports for every completion"""
+
+    def log_success_event(self, kwargs, response_obj, start_time, end_time):
+        usage = getattr(response_obj, 'usage', None)
+        if usage is None and isinstance(response_obj, dict):
+            usage = response_obj.get('usage')
+        if usage is None:
+            return
+        prompt_tokens = usage.get('prompt_tokens') if isinstance(usage, dict) else getattr(usage, 'prompt_tokens', 0)
+        completion_tokens = usage.get('completion_tokens') if isinstance(usage, dict) else getattr(usage, 'completion_tokens', 0)
+        telemetry.record_tokens(kwargs.get('model', 'unknown'), prompt_tokens, completion_tokens)
+
+
+token_usage_logger = TokenUsageLogger()
+
+
+class CachedLLM(LLM):
+    """
+    crewai LLM that answers repeated prompts from the shared response cache.
+    Only deterministic (temperature 0) calls are cached; `use_cache=False` skips
+    cache reads for this client but still stores fresh responses.
+    """
+
+    def __init__(self, *args, response_cache=None, use_cache=True, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.response_cache = response_cache or get_default_llm_response_cache()
+        self.use_cache = use_cache
+
+    def call(self, messages, callbacks=[]):
+        callbacks = [*callbacks, token_usage_logger]
+        with span('llm.call', model=self.model) as call_span:
+            if self.temperature != 0:
+                return super().call(messages, callbacks)
+            key = self.response_cache.key(self, messages)
+            called = []
+
+            def call():
+                called.append(True)
+                return super(CachedLLM, self).call(messages, callbacks)
+
+            response = self.response_cache.get_or_call(key, call, read=self.use_cache)
+            call_span.set(cache_hit=not called)
+            telemetry.record_cache('llm_responses', hit=not called)
+            return response
+
+
+class SerperSearchTool(SerperDevTool):
+    """
+    SerperDevTool answered from the shared search cache. Searches go to Serper, or to
+    `backend` (anything with `search(query, n_results)`) when one is set or SEARCH_BACKEND is local.
+    Subclasses can replace `_search`.
+    """
+
+    backend: Any = None
+    search_cache: Any = None
+
+    def _search(self, **kwargs):
+        backend = self.backend or (default_local_backend() if SEARCH_BACKEND == 'local' else None)
+        if backend is not None:
+            return backend.search(str(kwargs.get('search_query', '')), self.n_results)
+        return super()._run(**kwargs)
+
+    def _run(self, **kwargs):
+        query = str(kwargs.get('search_query', ''))
+        with span('search.call', tool='serper', query=query) as search_span:
+            result, hit = (self.search_cache or get_default_search_cache()).get_or_search(query, lambda: self._search(**kwargs), self.n_results)
+            search_span.set(cache_hit=hit)
+        telemetry.record_cache('search_results', hit=hit)
+        return result
+
+
+class LLMPool():
+    """One client per model and cache setting; a client holds no per-request state"""
+
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get(self, securityMode, use_cache=True):
+        key = (model_id(securityMode), use_cache)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self._clients[key] = create_llm(securityMode, use_cache)
+        return client
+
+
+def create_llm(securityMode, use_cache=True):
+    # Responses to identical temperature-0 prompts are served from the shared LLM cache
+    if securityMode == True:
+        return CachedLLM(
+            temperature=0,
+            model=model_id(securityMode),
+            base_url=OLLAMA_BASE_URL,
+            use_cache=use_cache,
+        )
+    return CachedLLM(
+        temperature=0,
+        model=model_id(securityMode),
+        api_key=GROQ_API_KEY,
+        use_cache=use_cache,
+    )
+
+
+llm_pool = LLMPool()
+
+_tools = {}
+_tools_lock = threading.Lock()
+
+
+def _shared_tool(name, build):
+    with _tools_lock:
+        if name not in _tools:
+            _tools[name] = build()
+        return _tools[name]
+
+
+def get_search_tool():
+    # Searches are shared across analyses through the search cache
+    return _shared_tool('search', lambda: SerperSearchTool(n_results=3))
+
+
+def get_web_rag_tool():
+    """Investopedia page on market anomalies as a RAG tool; indexing it downloads and embeds the page"""
+    from crewai_tools import WebsiteSearchTool
+
+    return _shared_tool('web_rag', lambda: WebsiteSearchTool(website='https://www.investopedia.com/articles/financial-theory/11/trading-with-market-anomalies.asp'))
+
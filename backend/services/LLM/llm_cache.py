@@ -0,0 +1,106 @@
+import json
+import time
+import hashlib
+import threading
+from config import LLM_CACHE_SIZE, LLM_CACHE_TTL_HOURS, LLM_CACHE_PATH, SECURITY_MODE_MODEL, CLOUD_MODEL
+from services.cache import TieredCache, SQLiteCacheTier
+
+# Parameters that change what the model returns, and so belong in the cache key
+KEY_PARAMS = (
+    'temperature', 'top_p', 'n', 'stop', 'max_tokens', 'max_completion_tokens', 'presence_penalty',
+    'frequency_penalty', 'logit_bias', 'response_format', 'seed', 'base_url',
+)
+
+
+def model_id(securityMode):
+    """The model each mode is served by, part of the analysis and LLM cache keys"""
+    return SECURITY_MODE_MODEL if securityMode == True else CLOUD_MODEL
+
+
+class LLMResponseCache:
+    """
+    Shared cache of LLM completions keyed on model, messages and sampling parameters.
+    Identical prompts that are already in flight on another thread wait for that call
+    instead of being sent again.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._saved_seconds = 0.0
+        self._deduplicated = 0
+
+    def key(self, llm, messages):
+        params = {name: getattr(llm, name, None) for name in KEY_PARAMS}
+        # crewai merges stop words through a set, so their order differs between processes
+        if isinstance(params['stop'], list):
+            params['stop'] = sorted(params['stop'])
+        payload = json.dumps({'model': llm.model, 'messages': messages, 'params': params}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _call_and_store(self, key, call):
+        started = time.perf_counter()
+        response = call()
+        self.cache.put(key, {'response': response, 'latency': time.perf_counter() - started})
+        return response
+
+    def get_or_call(self, key, call, read=True):
+        if not read:
+            return self._call_and_store(key, call)
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            with self._lock:
+                self._saved_seconds += cached['latency']
+            return cached['response']
+
+        with self._lock:
+            waiter = self._in_flight.get(key)
+            if waiter is None:
+                waiter = self._in_flight[key] = threading.Event()
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            waiter.wait()
+            cached = self.cache.get(key)
+            if cached is not None:
+                with self._lock:
+                    self._deduplicated += 1
+                return cached['response']
+            # The call we waited on failed, make our own
+            return call()
+
+        try:
+            return self._call_and_store(key, call)
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            waiter.set()
+
+    def stats(self):
+        stats = self.cache.stats()
+        with self._lock:
+            stats['saved_seconds'] = round(self._saved_seconds, 2)
+            stats['deduplicated'] = self._deduplicated
+        return stats
+
+
+def create_llm_response_cache():
+    disk = SQLiteCacheTier(LLM_CACHE_PATH, 'llm_responses', LLM_CACHE_TTL_HOURS * 3600) if LLM_CACHE_PATH else None
+    return LLMResponseCache(TieredCache(LLM_CACHE_SIZE, LLM_CACHE_TTL_HOURS * 3600, disk))
+
+
+_default_llm_response_cache = None
+_default_llm_response_cache_lock = threading.Lock()
+
+
+def get_default_llm_response_cache():
+    # Built on first use, so importing the app does not create LLM_CACHE_PATH
+    global _default_llm_response_cache
+    with _default_llm_response_cache_lock:
+        if _default_llm_response_cache is None:
+            _default_llm_response_cache = create_llm_response_cache()
+    return _default_llm_response_cache
@@ -0,0 +1,216 @@
+import os
+import re
+import sys
+import glob
+import json
+import time
+import argparse
+import threading
+import unicodedata
+from config import (
+    SEARCH_DATA_DIR, SEARCH_CACHE_SIZE, SEARCH_CACHE_PATH, SEARCH_CACHE_TTL_HOURS,
+    SEARCH_NEWS_TTL_HOURS, SEARCH_ANOMALY_TTL_HOURS, SEARCH_INVESTOR_TTL_HOURS, SEARCH_PREFETCH_INVESTORS,
+)
+from services.cache import TieredCache, SQLiteCacheTier
+
+STOPWORDS = {'a', 'an', 'the', 'of', 'in', 'on', 'for', 'and', 'or', 'to', 'about', 'with', 'by', 'at', 'is', 'are', 'what', 's'}
+
+# First matching topic decides how long a result stays fresh
+TOPICS = (
+    ('investor', {'investor', 'investors', 'philosophy', 'quotes', 'quote', 'letter', 'letters', 'strategy', 'strategies'}, SEARCH_INVESTOR_TTL_HOURS),
+    ('anomaly', {'anomaly', 'anomalies', 'effect', 'seasonal', 'seasonality', 'halloween', 'january', 'santa', 'rally', 'may'}, SEARCH_ANOMALY_TTL_HOURS),
+    ('news', {'news', 'latest', 'today', 'breaking', 'week', 'election', 'geopolitical', 'tensions', 'fed', 'inflation', 'earnings'}, SEARCH_NEWS_TTL_HOURS),
+)
+
+# What the risk analyst is told to search for, kept warm by `prefetch`
+ANOMALY_QUERIES = (
+    "U.S. Election Uncertainty",
+    "Geopolitical Tensions and Market Reactions",
+    "Halloween effect",
+    "January effect",
+    "Santa Claus rally",
+    "Sell in May and go away",
+)
+
+
+def investor_query(investor):
+    # The portfolio advisor researches each reference investor's recent views
+    return f"{investor} recent investment strategies market views and quotes"
+
+
+def normalize_query(query):
+    """Lowercase, punctuation- and stopword-free, order-insensitive form of a query"""
+    text = unicodedata.normalize('NFKC', str(query)).lower()
+    tokens = [token for token in re.split(r'[^\w]+', text) if token and token not in STOPWORDS]
+    return ' '.join(sorted(set(tokens)))
+
+
+def query_topic(normalized, investors=SEARCH_PREFETCH_INVESTORS):
+    """(topic, ttl_hours) of a normalized query"""
+    tokens = set(normalized.split())
+    if any(set(normalize_query(investor).split()) <= tokens for investor in investors):
+        return 'investor', SEARCH_INVESTOR_TTL_HOURS
+    for topic, keywords, ttl_hours in TOPICS:
+        if tokens & keywords:
+            return topic, ttl_hours
+    return 'general', SEARCH_CACHE_TTL_HOURS
+
+
+class SearchCache:
+    """
+    Web search results keyed on the normalized query, each kept for its topic's TTL.
+    The same query already in flight on another thread is waited for, not searched again.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._deduplicated = 0
+
+    def key(self, query, n_results):
+        return f"{n_results}|{normalize_query(query)}"
+
+    def get(self, key):
+        entry = self.cache.get(key)
+        if entry is None or entry['expires_at'] <= time.time():
+            return None
+        return entry
+
+    def put(self, key, query, result):
+        topic, ttl_hours = query_topic(key.split('|', 1)[1])
+        entry = {'query': query, 'topic': topic, 'result': result, 'fetched_at': time.time(), 'expires_at': time.time() + ttl_hours * 3600}
+        self.cache.put(key, entry)
+        return entry
+
+    def get_or_search(self, query, search, n_results=3, refresh=False):
+        """(result, hit) for `query`; `search()` is only called when no fresh result is stored"""
+        key = self.key(query, n_results)
+        if not refresh:
+            entry = self.get(key)
+            if entry is not None:
+                return entry['result'], True
+
+        with self._lock:
+            waiter = self._in_flight.get(key)
+            owner = waiter is None
+            if owner:
+                waiter = self._in_flight[key] = threading.Event()
+
+        if not owner:
+            waiter.wait()
+            entry = self.get(key)
+            if entry is not None:
+                with self._lock:
+                    self._deduplicated += 1
+                return entry['result'], True
+            # The search we waited on failed, make our own
+            return search(), False
+
+        try:
+            result = search()
+            self.put(key, query, result)
+            return result, False
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            waiter.set()
+
+    def stats(self):
+        stats = self.cache.stats()
+        with self._lock:
+            stats['deduplicated'] = self._deduplicated
+        return stats
+
+
+class LocalSearchBackend():
+    """
+    Offline stand-in for Serper: answers from JSON files of {query: result} in `path`
+    (a file or a directory of them), matched on the normalized query.
+    """
+
+    def __init__(self, path=SEARCH_DATA_DIR):
+        self.results = {}
+        paths = sorted(glob.glob(os.path.join(path, '*.json'))) if os.path.isdir(path) else [path] if os.path.exists(path) else []
+        for file_path in paths:
+            with open(file_path) as f:
+                self.results.update({normalize_query(query): result for query, result in json.load(f).items()})
+
+    def search(self, query, n_results=3):
+        result = self.results.get(normalize_query(query))
+        if result is not None:
+            return result
+        return f"No stored results for '{query}'."
+
+
+_default_local_backend = None
+
+
+def default_local_backend():
+    global _default_local_backend
+    if _default_local_backend is None:
+        _default_local_backend = LocalSearchBackend()
+    return _default_local_backend
+
+
+def create_search_cache():
+    max_ttl = max(SEARCH_CACHE_TTL_HOURS, *(ttl_hours for _, _, ttl_hours in TOPICS)) * 3600
+    disk = SQLiteCacheTier(SEARCH_CACHE_PATH, 'search_results', max_ttl) if SEARCH_CACHE_PATH else None
+    return SearchCache(TieredCache(SEARCH_CACHE_SIZE, max_ttl, disk))
+
+
+_default_search_cache = None
+_default_search_cache_lock = threading.Lock()
+
+
+def get_default_search_cache():
+    # Built on first use, so importing the app does not create SEARCH_CACHE_PATH
+    global _default_search_cache
+    with _default_search_cache_lock:
+        if _default_search_cache is None:
+            _default_search_cache = create_search_cache()
+    return _default_search_cache
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m services.LLM.search_cache', description="Maintain the shared web search cache")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    prefetch = commands.add_parser('prefetch', help="search the common anomaly and investor topics ahead of time, e.g. from cron")
+    prefetch.add_argument('--investor', action='append', help="reference investor to prefetch (default: SEARCH_PREFETCH_INVESTORS)")
+    prefetch.add_argument('--queries', help="file with one extra query per line")
+    prefetch.add_argument('--n-results', type=int, default=3)
+    prefetch.add_argument('--force', action='store_true', help="search again even when a fresh result is stored")
+
+    export = commands.add_parser('export', help="write the stored results as a JSON file for SEARCH_BACKEND=local")
+    export.add_argument('path')
+
+    args = parser.parse_args(argv)
+    search_cache = get_default_search_cache()
+
+    if args.command == 'prefetch':
+        queries = [*ANOMALY_QUERIES, *(investor_query(investor) for investor in args.investor or SEARCH_PREFETCH_INVESTORS)]
+        if args.queries:
+            with open(args.queries) as f:
+                queries += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        from services.LLM.clients import SerperSearchTool
+
+        tool = SerperSearchTool(n_results=args.n_results)
+        searched = 0
+        for query in dict.fromkeys(queries):
+            _, hit = search_cache.get_or_search(query, lambda: tool._search(search_query=query), args.n_results, refresh=args.force)
+            searched += not hit
+        print(f"prefetched {len(queries)} queries, {searched} searched")
+    elif args.command == 'export':
+        if search_cache.cache.disk is None:
+            parser.error("SEARCH_CACHE_PATH is not set")
+        now = time.time()
+        entries = [entry for entry in search_cache.cache.disk.values() if entry['expires_at'] > now]
+        with open(args.path, 'w') as f:
+            json.dump({entry['query']: entry['result'] for entry in entries}, f, indent=2, default=str)
+        print(f"exported {len(entries)} results to {args.path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,244 @@
+import json
+import time
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+from config import BETA_BENCHMARK, BASE_CURRENCY, BATCH_ACCOUNT_COLUMN, BATCH_LLM_CONCURRENCY, METRICS_WORKERS, METRICS_TIMEOUT_SECONDS
+from tools.calculate_portfolio_tools import calculate_portfolio, time_weighted_return
+from tools.calculate_ratio import calculate_account_ratios, load_portfolio_returns, slice_market
+from tools.caluculate_beta import calculate_portfolio_beta, portfolio_beta_table
+from tools.fx_rates import convert_holdings, unconverted_rows
+from tools.exposure import calculate_exposures
+from tools.tail_risk import calculate_tail_risk, load_stress_prices
+from services.ingestion import CATEGORY_COLUMNS
+from services.metrics import PortfolioMetrics, beta_map, set_aside_unconverted, unconverted_metrics, with_rebalance
+from services.positions import aggregate_positions
+from services.result_cache import analysis_cache_key
+from services.LLM.llm_cache import model_id
+from services.telemetry import span, current_context, telemetry
+
+
+def combine_accounts(frames, column=BATCH_ACCOUNT_COLUMN):
+    """Stack {account: holdings frame} into one frame with the account in `column`"""
+    combined = pd.concat([frame.assign(**{column: account}) for account, frame in frames.items()], ignore_index=True)
+    # Each upload has its own categories, so the stacked columns are re-cast once
+    for name in [*CATEGORY_COLUMNS, column]:
+        combined[name] = combined[name].astype(str).astype('category')
+    return combined
+
+
+def split_accounts(df, column=BATCH_ACCOUNT_COLUMN):
+    """{account: holdings frame without the account column}, in order of first appearance"""
+    return {
+        str(account): frame.drop(columns=[column]).reset_index(drop=True)
+        for account, frame in df.groupby(column, observed=True, sort=False)
+    }
+
+
+def _timed(name, func, *args):
+    with span(f'batch.{name}') as stage_span:
+        result = func(*args)
+    return result, stage_span.duration
+
+
+class BatchMetricsStage:
+    """
+    Deterministic metrics of many accounts at once. Prices, FX rates, betas and stress windows
+    are fetched once for the union of every account's tickers, and the ratios of all accounts come
+    from a single RiskEngine pass over the shared returns matrix; only the cheap per-account
+    regrouping (performance, exposures, beta weights) and the tail-risk simulation run account by account.
+    Like MetricsStage, each shared stage has its own timeout and a stage that times out is recorded in
+    every account's `errors`.
+    """
+
+    stages = ('market', 'beta', 'stress')
+
+    def __init__(self, timeouts=None, max_workers=METRICS_WORKERS, base_currency=BASE_CURRENCY, fx=None, provider=None, benchmark=BETA_BENCHMARK):
+        self.timeouts = {name: METRICS_TIMEOUT_SECONDS for name in self.stages}
+        self.timeouts.update(timeouts or {})
+        self.max_workers = max_workers
+        self.base_currency = base_currency
+        self.fx = fx
+        self.provider = provider
+        self.benchmark = benchmark
+
+    def run(self, df_input, column=BATCH_ACCOUNT_COLUMN):
+        """{account: PortfolioMetrics} for the accounts stacked in `df_input`"""
+        shared_errors = {}
+        try:
+            df_input = convert_holdings(df_input, self.base_currency, self.fx)
+        except Exception as e:
+            shared_errors['fx'] = f"{type(e).__name__}: {e}"
+            return {
+                str(account): unconverted_metrics(frame.drop(columns=[column]).reset_index(drop=True), shared_errors, self.base_currency)
+                for account, frame in df_input.groupby(column, observed=True, sort=False)
+            }
+        # Lots without a rate are set aside account by account; accounts left with none are reported as skipped
+        account_errors, skipped = {}, {}
+        for account, frame in df_input.groupby(column, observed=True, sort=False):
+            errors = account_errors[str(account)] = {}
+            if set_aside_unconverted(frame, errors, self.base_currency).empty:
+                skipped[str(account)] = unconverted_metrics(frame.drop(columns=[column]).reset_index(drop=True), errors, self.base_currency)
+        df_input = df_input[~unconverted_rows(df_input)].reset_index(drop=True)
+        if df_input.empty:
+            return skipped
+
+        # Market data for the union of tickers and the betas of every distinct ticker, concurrently
+        union = aggregate_positions(df_input.drop(columns=[column]))
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='batch')
+        started = time.monotonic()
+        futures = {
+            'market': executor.submit(
+                current_context().run, _timed, 'market', load_portfolio_returns, df_input, self.provider, self.benchmark, self.base_currency, self.fx,
+            ),
+            'beta': executor.submit(current_context().run, _timed, 'beta', calculate_portfolio_beta, union.frame.copy(), self.benchmark, self.provider, None, self.base_currency, self.fx),
+            'stress': executor.submit(current_context().run, _timed, 'stress', load_stress_prices, union.frame['Ticker'].unique(), self.provider, self.benchmark),
+        }
+
+        results, timings = {}, {}
+        for name, future in futures.items():
+            error_key = 'ratios' if name == 'market' else name
+            remaining = max(0.0, started + self.timeouts[name] - time.monotonic())
+            try:
+                results[name], timings[name] = future.result(timeout=remaining)
+            except TimeoutError:
+                shared_errors[error_key] = f"timed out after {self.timeouts[name]:.0f}s"
+            except Exception as e:
+                shared_errors[error_key] = f"{type(e).__name__}: {e}"
+        # Do not wait for stages that timed out
+        executor.shutdown(wait=False, cancel_futures=True)
+        market = results.get('market')
+        betas = beta_map(results['beta'][1]) if 'beta' in results else {}
+        stress_prices = results.get('stress', {})
+
+        codes, accounts = pd.factorize(df_input[column], sort=False)
+        ratios = None
+        if market is not None:
+            try:
+                ratios, timings['ratios'] = _timed('ratios', calculate_account_ratios, df_input, codes, 0.02, self.provider, self.benchmark, self.base_currency, self.fx, market)
+            except Exception as e:
+                shared_errors['ratios'] = f"{type(e).__name__}: {e}"
+
+        metrics = {}
+        for code, rows in df_input.groupby(codes, sort=False).indices.items():
+            metrics[str(accounts[code])] = self._account_metrics(
+                df_input.iloc[rows].drop(columns=[column]).reset_index(drop=True),
+                market, betas, stress_prices, ratios[code] if ratios else None, {**shared_errors, **account_errors[str(accounts[code])]}, dict(timings),
+            )
+        # In the order the accounts were uploaded
+        return {account: metrics[account] if account in metrics else skipped[account] for account in account_errors}
+
+    def _account_metrics(self, df, market, betas, stress_prices, ratios, errors, timings):
+        positions = aggregate_positions(df)
+        with span('batch.account', lots=len(df)) as account_span:
+            if market is not None:
+                market = slice_market(market, df, self.benchmark)
+            performance = None
+            try:
+                performance = json.loads(calculate_portfolio(df))
+                if market is not None:
+                    performance['time_weighted_return_1y'] = time_weighted_return(df, *market)
+            except Exception as e:
+                errors['performance'] = f"{type(e).__name__}: {e}"
+
+            portfolio_beta, each_stock_result, missing_betas = None, None, []
+            if 'beta' not in errors:
+                try:
+                    portfolio_beta, each_stock_result, missing_betas = portfolio_beta_table(positions.frame, betas)
+                except Exception as e:
+                    errors['beta'] = f"{type(e).__name__}: {e}"
+
+            exposures = None
+            try:
+                exposures = calculate_exposures(positions.frame, market and market[1])
+            except Exception as e:
+                errors['exposure'] = f"{type(e).__name__}: {e}"
+
+            # The stress windows were loaded once for every account, each replays and simulates only its own positions
+            tail_risk = None
+            try:
+                tail_risk = calculate_tail_risk(positions.frame, market and market[1], betas, stress_prices, self.provider, self.benchmark)
+            except Exception as e:
+                errors['tail_risk'] = f"{type(e).__name__}: {e}"
+        timings['account'] = account_span.duration
+
+        return PortfolioMetrics(
+            performance=performance,
+            positions=positions,
+            portfolio_beta=portfolio_beta,
+            each_stock_result=each_stock_result,
+            missing_betas=tuple(missing_betas),
+            ratios=ratios,
+            exposures=exposures,
+            tail_risk=tail_risk,
+            market=market,
+            errors=errors,
+            timings=timings,
+        )
+
+
+def run_batch_analysis(securityMode, investmentStrategy, referenceInvestor, df_input, column=BATCH_ACCOUNT_COLUMN,
+                       use_cache=True, result_cache=None, concurrency=BATCH_LLM_CONCURRENCY, emit=None):
+    """
+    Analyse every account stacked in `df_input`. Cached accounts are answered first, the rest
+    share one BatchMetricsStage and then run their crews `concurrency` at a time. Each account's
+    progress is emitted as it happens, tagged with the account, and its result as an `account` event.
+    """
+    # Imported on first use; with WARM_START this is already done by the time a job runs
+    from services.LLM.agent import FinancialCrew
+
+    emit = emit or (lambda event, data: None)
+    frames = split_accounts(df_input, column)
+    results, errors = {}, {}
+
+    # Accounts are cached under the same key as a single-portfolio upload of the same holdings
+    keys = {account: analysis_cache_key(frame, investmentStrategy, referenceInvestor, securityMode, model_id(securityMode)) for account, frame in frames.items()}
+    pending = []
+    for account, key in keys.items():
+        cached = result_cache.get(key) if use_cache and result_cache is not None else None
+        if use_cache and result_cache is not None:
+            telemetry.record_cache('analysis_results', hit=cached is not None)
+        if cached is None:
+            pending.append(account)
+            continue
+        results[account] = cached
+        emit('account', {'account': account, 'status': 'succeeded', 'cached': True, 'result': cached})
+
+    if pending:
+        with span('batch.metrics', accounts=len(pending), lots=len(df_input)):
+            metrics = BatchMetricsStage().run(df_input[df_input[column].isin(pending)], column)
+        metrics = {account: with_rebalance(account_metrics, investmentStrategy) for account, account_metrics in metrics.items()}
+        for account in pending:
+            emit('metrics', {'account': account, 'data': metrics[account].summary()})
+
+        def analyze(account):
+            def account_event(event, data):
+                # Metrics were already published for every account above
+                if event != 'metrics':
+                    emit(event, {'account': account, 'data': data})
+
+            crew = FinancialCrew(securityMode=securityMode, investmentStrategy=investmentStrategy, referenceInvestor=referenceInvestor,
+                                 df_input=frames[account], metrics=metrics[account], use_cache=use_cache)
+            with span('analysis', model=model_id(securityMode), lots=len(frames[account])):
+                return json.loads(crew.run(on_event=account_event))
+
+        # The crews are LLM-bound, so a few of them share the job's thread and each runs in a copy of its trace context
+        with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='batch-crew') as executor:
+            futures = {executor.submit(current_context().run, analyze, account): account for account in pending}
+            for future in as_completed(futures):
+                account = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors[account] = f"{type(e).__name__}: {e}"
+                    emit('account', {'account': account, 'status': 'failed', 'error': errors[account]})
+                    continue
+                results[account] = result
+                if result_cache is not None and not metrics[account].errors:
+                    result_cache.put(keys[account], result)
+                emit('account', {'account': account, 'status': 'succeeded', 'cached': False, 'result': result})
+
+    # Accounts are reported in upload order, whatever order they finished in
+    return {
+        'accounts': {account: results[account] for account in frames if account in results},
+        'errors': errors,
+    }
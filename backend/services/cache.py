@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Expired rows are only skipped on read; writers delete them at most this often
+PURGE_INTERVAL_SECONDS = 3600
+
+
+class SQLiteCacheTier:
+    """JSON values in a SQLite table, shared across restarts and worker processes"""
+
+    def __init__(self, path, table, ttl_seconds):
+        self.path = path
+        self.table = table
+        self.ttl = ttl_seconds
+        self._purged_at = 0.0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        entry = self.entry(key)
+        return None if entry is None else entry[0]
+
+    def entry(self, key):
+        """(value, created_at) of a row younger than the TTL, or None"""
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT value, created_at FROM {self.table} WHERE key = ? AND created_at >= ?",
+                (key, time.time() - self.ttl),
+            ).fetchone()
+        return None if row is None else (json.loads(row[0]), row[1])
+
+    def put(self, key, value):
+        with self._connect() as conn:
+            conn.execute(f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?)", (key, json.dumps(value), time.time()))
+        if time.time() - self._purged_at >= PURGE_INTERVAL_SECONDS:
+            self.purge()
+
+    def values(self):
+        """Every value younger than the TTL"""
+        with self._connect() as conn:
+            rows = conn.execute(f"SELECT value FROM {self.table} WHERE created_at >= ?", (time.time() - self.ttl,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def purge(self):
+        self._purged_at = time.time()
+        with self._connect() as conn:
+            conn.execute(f"DELETE FROM {self.table} WHERE created_at < ?", (time.time() - self.ttl,))
+
+
+class TieredCache:
+    """
+    Bounded in-memory LRU with a TTL, optionally backed by a SQLite tier.
+    Values must be JSON-serializable when the disk tier is enabled; None is never cached.
+    """
+
+    def __init__(self, max_entries, ttl_seconds, disk=None):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.disk = disk
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats['memory_hits'] += 1
+                    return value
+                del self._entries[key]
+
+        entry = self.disk.entry(key) if self.disk is not None else None
+        if entry is None:
+            self._count('misses')
+            return None
+        value, created_at = entry
+        self._count('disk_hits')
+        # The entry has already aged on disk, so it only stays in memory for the rest of its TTL
+        self._remember(key, value, age=max(0.0, time.time() - created_at))
+        return value
+
+    def _remember(self, key, value, age=0.0):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl - age, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def put(self, key, value):
+        if value is None:
+            return
+        self._remember(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+        self._count('writes')
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 4) if lookups else 0.0
+        return stats
@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass, field
+from typing import List
+from pandas.api.types import union_categoricals
+from config import INGEST_CHUNK_ROWS, INGEST_MAX_REPORTED_ERRORS
+
+# Columns of PortfolioItem in frontend/types.ts and the dtype each one is stored as
+CATEGORY_COLUMNS = ['Ticker', 'Asset Name', 'Sector', 'Currency']
+FLOAT64_COLUMNS = ['Quantity', 'Purchase Price', 'Current Price', 'Total Cost']
+FLOAT32_COLUMNS = ['Dividend Yield']
+DATE_COLUMNS = ['Purchase Date']
+SCHEMA_COLUMNS = ['Ticker', 'Asset Name', 'Quantity', 'Purchase Price', 'Current Price', 'Purchase Date', 'Sector', 'Currency', 'Dividend Yield', 'Total Cost']
+REQUIRED_COLUMNS = ['Ticker', 'Quantity', 'Purchase Price', 'Current Price', 'Purchase Date', 'Total Cost']
+POSITIVE_COLUMNS = ['Quantity', 'Purchase Price', 'Current Price', 'Total Cost']
+DATE_FORMAT = '%Y-%m-%d'
+
+
+class IngestionError(ValueError):
+    """The upload cannot be turned into holdings at all"""
+
+
+@dataclass
+class Holdings:
+    """Canonical, typed holdings every tool works on, plus the rows that were rejected"""
+    frame: pd.DataFrame
+    errors: List[dict] = field(default_factory=list)
+    rejected_rows: int = 0
+
+    @property
+    def tickers(self):
+        return list(self.frame['Ticker'].unique())
+
+    def __len__(self):
+        return len(self.frame)
+
+
+def _row_errors(values, invalid, column, message, first_line):
+    return [
+        {'row': int(first_line + position), 'column': column, 'value': None if pd.isna(value) else str(value), 'error': message}
+        for position, value in zip(np.flatnonzero(invalid), values[invalid])
+    ]
+
+
+def _typed_chunk(raw, first_line, errors):
+    chunk = pd.DataFrame(index=raw.index)
+    bad = np.zeros(len(raw), dtype=bool)
+
+    for column in SCHEMA_COLUMNS:
+        values = raw[column].str.strip() if column in raw else pd.Series(None, index=raw.index, dtype=object)
+        if column in REQUIRED_COLUMNS:
+            missing = values.isna() | (values == '')
+            errors.extend(_row_errors(values, missing.to_numpy(), column, 'missing value', first_line))
+            bad |= missing.to_numpy()
+
+        if column in FLOAT64_COLUMNS or column in FLOAT32_COLUMNS:
+            numbers = pd.to_numeric(values.str.replace(',', '', regex=False), errors='coerce')
+            invalid = (numbers.isna() & values.notna() & (values != '')).to_numpy()
+            if column in POSITIVE_COLUMNS:
+                invalid |= (numbers <= 0).to_numpy()
+            errors.extend(_row_errors(values, invalid & ~bad, column, 'not a valid positive number' if column in POSITIVE_COLUMNS else 'not a number', first_line))
+            bad |= invalid
+            chunk[column] = numbers.astype('float32' if column in FLOAT32_COLUMNS else 'float64')
+        elif column in DATE_COLUMNS:
+            dates = pd.to_datetime(values, format=DATE_FORMAT, errors='coerce')
+            invalid = (dates.isna() & values.notna() & (values != '')).to_numpy()
+            errors.extend(_row_errors(values, invalid & ~bad, column, f'not a date in {DATE_FORMAT} format', first_line))
+            bad |= invalid
+            chunk[column] = dates
+        else:
+            chunk[column] = values
+
+    # Optional columns get neutral defaults
+    chunk['Asset Name'] = chunk['Asset Name'].fillna(chunk['Ticker'])
+    chunk['Sector'] = chunk['Sector'].fillna('Unknown')
+    chunk['Currency'] = chunk['Currency'].fillna('USD').str.upper()
+    chunk['Dividend Yield'] = chunk['Dividend Yield'].fillna(0).astype('float32')
+
+    chunk = chunk[~bad]
+    for column in CATEGORY_COLUMNS:
+        chunk[column] = chunk[column].astype('category')
+    return chunk, int(bad.sum())
+
+
+def load_holdings(source, chunk_rows=INGEST_CHUNK_ROWS, extra_columns=()):
+    """
+    Read a holdings CSV from a path or binary file object in chunks of `chunk_rows`,
+    validate it against the PortfolioItem schema and return typed Holdings.
+    Bad rows are dropped and reported with their CSV line number.
+    """
+    wanted = set(SCHEMA_COLUMNS) | set(extra_columns)
+    try:
+        reader = pd.read_csv(
+            source,
+            dtype=str,
+            encoding='utf-8-sig',
+            skipinitialspace=True,
+            usecols=lambda column: column.strip() in wanted,
+            chunksize=chunk_rows,
+        )
+        chunks, errors, rejected = [], [], 0
+        first_line = 2  # line 1 is the header
+        for raw in reader:
+            raw.columns = [column.strip() for column in raw.columns]
+            missing_columns = [column for column in REQUIRED_COLUMNS if column not in raw.columns]
+            if missing_columns:
+                raise IngestionError(f"Missing required columns: {', '.join(missing_columns)}")
+            chunk, bad_rows = _typed_chunk(raw, first_line, errors)
+            for column in extra_columns:
+                if column in raw:
+                    chunk[column] = raw.loc[chunk.index, column].str.strip().astype('category')
+            # A chunk whose rows were all rejected adds nothing and would make the concat warn
+            if len(chunk):
+                chunks.append(chunk)
+            rejected += bad_rows
+            first_line += len(raw)
+            # Keep only as many error details as will be reported
+            del errors[INGEST_MAX_REPORTED_ERRORS:]
+    except (UnicodeDecodeError, pd.errors.ParserError, pd.errors.EmptyDataError) as e:
+        raise IngestionError(f"Could not read the CSV file: {e}") from e
+
+    if not chunks:
+        raise IngestionError("The CSV file has no valid holdings")
+
+    frame = pd.concat(chunks, ignore_index=True)
+    # Concatenating chunks with different categories falls back to object, so merge them explicitly
+    for column in [*CATEGORY_COLUMNS, *[column for column in extra_columns if column in frame]]:
+        frame[column] = union_categoricals([chunk[column] for chunk in chunks if column in chunk]) if len(chunks) > 1 else frame[column]
+    return Holdings(frame=frame, errors=errors, rejected_rows=rejected)
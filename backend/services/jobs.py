@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from config import JOB_BACKEND, JOB_DB_PATH, JOB_WORKERS, JOB_QUEUE_DEPTH, JOB_RETENTION_HOURS
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class JobQueueFullError(Exception):
+    """Raised when the analysis queue is at its configured depth"""
+
+
+class InMemoryJobBackend:
+    """Job records kept in this process, dropped after the retention period"""
+
+    def __init__(self, retention_hours=24):
+        self.retention = retention_hours * 3600
+        self._jobs = {}
+        self._events = {}
+        self._lock = threading.Lock()
+
+    def create(self, job_id):
+        now = time.time()
+        with self._lock:
+            # Forget finished jobs older than the retention period
+            for key in [key for key, job in self._jobs.items() if job['finished_at'] and job['finished_at'] < now - self.retention]:
+                del self._jobs[key]
+                self._events.pop(key, None)
+            self._events[job_id] = []
+            self._jobs[job_id] = {
+                'id': job_id,
+                'status': QUEUED,
+                'created_at': now,
+                'started_at': None,
+                'finished_at': None,
+                'result': None,
+                'error': None,
+            }
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def add_event(self, job_id, event, data):
+        with self._lock:
+            events = self._events[job_id]
+            events.append((len(events) + 1, event, data))
+
+    def get_events(self, job_id, after=0):
+        with self._lock:
+            return list(self._events.get(job_id, [])[after:])
+
+
+class SQLiteJobBackend:
+    """Job records in a SQLite file, so every worker process can answer status polls"""
+
+    columns = ('id', 'status', 'created_at', 'started_at', 'finished_at', 'result', 'error')
+
+    def __init__(self, path, retention_hours=24):
+        self.path = path
+        self.retention = retention_hours * 3600
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    result TEXT,
+                    error TEXT
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_events (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT NOT NULL,
+                    event TEXT NOT NULL,
+                    data TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS job_events_job_id ON job_events (job_id, seq)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def create(self, job_id):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM job_events WHERE job_id IN (SELECT id FROM jobs WHERE finished_at < ?)", (now - self.retention,))
+            conn.execute("DELETE FROM jobs WHERE finished_at < ?", (now - self.retention,))
+            conn.execute("INSERT INTO jobs (id, status, created_at) VALUES (?, ?, ?)", (job_id, QUEUED, now))
+
+    def update(self, job_id, **fields):
+        if 'result' in fields:
+            fields['result'] = json.dumps(fields['result'])
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute(f"SELECT {', '.join(self.columns)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(self.columns, row))
+        if job['result'] is not None:
+            job['result'] = json.loads(job['result'])
+        return job
+
+    def add_event(self, job_id, event, data):
+        with self._connect() as conn:
+            conn.execute("INSERT INTO job_events (job_id, event, data) VALUES (?, ?, ?)", (job_id, event, json.dumps(data)))
+
+    def get_events(self, job_id, after=0):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT seq, event, data FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+                (job_id, after),
+            ).fetchall()
+        return [(seq, event, json.loads(data)) for seq, event, data in rows]
+
+
+class JobQueue:
+    """
+    Runs blocking analyses on a bounded worker pool, off the event loop.
+    At most `max_workers` jobs run at once and at most `max_queued` more wait;
+    beyond that `submit` raises JobQueueFullError.
+
+    The job function is called with an `emit(event, data)` keyword argument to publish
+    progress; the queue itself publishes `status`, `result` and `error` events.
+    """
+
+    def __init__(self, backend, max_workers=2, max_queued=16):
+        self.backend = backend
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='analysis')
+        self._slots = threading.BoundedSemaphore(max_workers + max_queued)
+
+    def submit(self, func, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            raise JobQueueFullError("Too many analyses in progress, please retry later")
+        job_id = uuid.uuid4().hex
+        try:
+            self.backend.create(job_id)
+            self._executor.submit(self._run, job_id, func, args, kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        return job_id
+
+    def _run(self, job_id, func, args, kwargs):
+        def emit(event, data):
+            self.backend.add_event(job_id, event, data)
+
+        try:
+            self.backend.update(job_id, status=RUNNING, started_at=time.time())
+            emit('status', {'status': RUNNING})
+            result = func(*args, emit=emit, **kwargs)
+            self.backend.update(job_id, status=SUCCEEDED, finished_at=time.time(), result=result)
+            emit('result', result)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            self.backend.update(job_id, status=FAILED, finished_at=time.time(), error=error)
+            emit('error', {'error': error})
+        finally:
+            self._slots.release()
+
+    def get(self, job_id):
+        return self.backend.get(job_id)
+
+    def events(self, job_id, after=0):
+        """Progress events published after sequence number `after`, as (seq, event, data) tuples"""
+        return self.backend.get_events(job_id, after)
+
+
+def create_job_backend():
+    if JOB_BACKEND == 'sqlite':
+        return SQLiteJobBackend(JOB_DB_PATH, JOB_RETENTION_HOURS)
+    return InMemoryJobBackend(JOB_RETENTION_HOURS)
+
+
+def create_job_queue():
+    return JobQueue(create_job_backend(), JOB_WORKERS, JOB_QUEUE_DEPTH)
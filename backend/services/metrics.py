@@ -0,0 +1,262 @@
+import json
+import math
+import time
+import pandas as pd
+from dataclasses import dataclass, field, replace
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Dict, Optional, Tuple
+from config import METRICS_WORKERS, METRICS_TIMEOUT_SECONDS, HOLDINGS_SUMMARY_TOP_N, BASE_CURRENCY
+from tools.calculate_portfolio_tools import calculate_portfolio, time_weighted_return
+from tools.calculate_ratio import calculate_portfolio_ratios, load_portfolio_returns
+from tools.caluculate_beta import calculate_portfolio_beta
+from tools.fx_rates import convert_holdings, missing_currencies, unconverted_rows
+from tools.exposure import calculate_exposures
+from tools.tail_risk import calculate_tail_risk, load_stress_prices
+from tools.optimizer import plan_rebalance
+from services.positions import Positions, aggregate_positions
+from services.telemetry import span, current_context
+
+
+# Every field PortfolioMetrics.summary() can fill in
+SUMMARY_FIELDS = (
+    'total_return', 'portfolio_cagr', 'money_weighted_return', 'time_weighted_return_1y', 'top_performer', 'underperformer',
+    'portfolio_beta', 'sharp_ratio', 'sortino_ratio', 'max_drawdown', 'benchmark_outperformance', 'exposures', 'tail_risk', 'rebalance',
+)
+
+
+@dataclass(frozen=True)
+class PortfolioMetrics:
+    """Deterministic portfolio metrics computed before any LLM task runs"""
+    performance: Optional[dict] = None
+    positions: Optional[Positions] = None
+    portfolio_beta: Optional[float] = None
+    each_stock_result: Optional[pd.DataFrame] = None
+    missing_betas: Tuple[str, ...] = ()
+    ratios: Optional[dict] = None
+    exposures: Optional[dict] = None
+    tail_risk: Optional[dict] = None
+    # Target weights and trades for the analysis' investment strategy, see with_rebalance
+    rebalance: Optional[dict] = None
+    # The (closes, returns) the ratios were computed from, kept for portfolio snapshots
+    market: Optional[tuple] = None
+    # {scenario: closes} the stress replays ran on, kept for portfolio snapshots too
+    stress_prices: Optional[dict] = None
+    errors: Dict[str, str] = field(default_factory=dict)
+    timings: Dict[str, float] = field(default_factory=dict)
+
+    def summary(self):
+        """The numeric PortfolioStrategyAnalysis fields that are known without any LLM"""
+        fields = {}
+        if self.performance:
+            fields['total_return'] = self.performance['total_return']
+            fields['portfolio_cagr'] = self.performance['portfolio_cagr']
+            for name in ('money_weighted_return', 'time_weighted_return_1y'):
+                if self.performance.get(name) is not None:
+                    fields[name] = self.performance[name]
+            fields['top_performer'] = {
+                'ticker': self.performance['best_performer']['Ticker'],
+                'name': self.performance['best_performer']['Asset Name'],
+            }
+            fields['underperformer'] = {
+                'ticker': self.performance['worst_performer']['Ticker'],
+                'name': self.performance['worst_performer']['Asset Name'],
+            }
+        if self.portfolio_beta is not None and math.isfinite(self.portfolio_beta):
+            fields['portfolio_beta'] = float(round(self.portfolio_beta, 2))
+        if self.ratios:
+            # A ratio without enough returns to compute is NaN, and left out rather than sent as one
+            for name, ratio in (('sharp_ratio', 'Sharpe Ratio'), ('sortino_ratio', 'Sortino Ratio'), ('max_drawdown', 'Max Drawdown'),
+                                ('benchmark_outperformance', 'Benchmark Outperformance')):
+                if math.isfinite(self.ratios[ratio]):
+                    fields[name] = self.ratios[ratio]
+        if self.exposures:
+            fields['exposures'] = self.exposures
+        if self.tail_risk:
+            fields['tail_risk'] = self.tail_risk
+        if self.rebalance:
+            fields['rebalance'] = self.rebalance
+        return fields
+
+    def holdings_summary(self, top_n=HOLDINGS_SUMMARY_TOP_N):
+        """Largest positions plus aggregates, so prompt size stays flat as portfolios grow"""
+        if self.each_stock_result is None:
+            return None
+        positions = self.each_stock_result.set_index('Ticker')[['Weight', 'Beta']]
+        positions = positions.sort_values('Weight', ascending=False)
+        top = positions.head(top_n)
+        return {
+            'lots': int(self.positions.lots.shape[0]) if self.positions is not None else int(len(positions)),
+            'positions': int(len(positions)),
+            'top_positions': [
+                {'Ticker': str(ticker), 'Weight': round(float(row.Weight), 4), 'Beta': None if pd.isna(row.Beta) else round(float(row.Beta), 2)}
+                for ticker, row in top.iterrows()
+            ],
+            'top_positions_weight': round(float(top['Weight'].sum()), 4),
+            'beta_range': [round(float(positions['Beta'].min()), 2), round(float(positions['Beta'].max()), 2)] if positions['Beta'].notna().any() else None,
+        }
+
+
+def _timed(name, func, *args):
+    with span(f'metrics.{name}') as stage_span:
+        result = func(*args)
+    return result, stage_span.duration
+
+
+def _performance_stage(df):
+    return json.loads(calculate_portfolio(df))
+
+
+def _beta_stage(df):
+    return calculate_portfolio_beta(df)
+
+
+def _stress_stage(df):
+    return load_stress_prices(df['Ticker'].unique())
+
+
+def beta_map(each_stock_result):
+    """{ticker: beta} of the positions whose beta is known"""
+    if each_stock_result is None:
+        return {}
+    return each_stock_result.dropna(subset=['Beta']).set_index('Ticker')['Beta'].to_dict()
+
+
+def _ratio_stage(df):
+    # The closes and returns are handed back so the exposure breakdown and TWR can reuse them
+    market = load_portfolio_returns(df)
+    return calculate_portfolio_ratios(df, market=market), market
+
+
+class MetricsStage:
+    """
+    Runs the network-bound metric computations concurrently on a thread pool.
+    Each stage has its own timeout; a stage that fails or times out is recorded in
+    `errors` and leaves its fields empty instead of failing the whole analysis.
+    """
+
+    stages = {
+        'performance': _performance_stage,
+        'beta': _beta_stage,
+        'ratios': _ratio_stage,
+        'stress': _stress_stage,
+    }
+
+    def __init__(self, timeouts=None, max_workers=METRICS_WORKERS, base_currency=BASE_CURRENCY, fx=None):
+        self.timeouts = {name: METRICS_TIMEOUT_SECONDS for name in self.stages}
+        self.timeouts.update(timeouts or {})
+        self.max_workers = max_workers
+        self.base_currency = base_currency
+        self.fx = fx
+
+    def run(self, df_input):
+        errors = {}
+        # Values are converted to the base currency once, so every stage can sum across currencies
+        try:
+            df_input = convert_holdings(df_input, self.base_currency, self.fx)
+        except Exception as e:
+            errors['fx'] = f"{type(e).__name__}: {e}"
+            return unconverted_metrics(df_input, errors, self.base_currency)
+        converted = set_aside_unconverted(df_input, errors, self.base_currency)
+        if converted.empty:
+            return unconverted_metrics(df_input, errors, self.base_currency)
+        df_input = converted
+
+        # Lots of the same ticker are collapsed once, so position-level stages see each ticker once
+        positions = aggregate_positions(df_input)
+        inputs = {'performance': df_input, 'beta': positions.frame, 'ratios': df_input, 'stress': positions.frame}
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='metrics')
+        started = time.monotonic()
+        # Every stage gets its own copy of the input, and runs in a copy of the caller's
+        # context so its span joins the analysis trace
+        futures = {name: executor.submit(current_context().run, _timed, name, stage, inputs[name].copy()) for name, stage in self.stages.items()}
+
+        results, timings = {}, {}
+        for name, future in futures.items():
+            remaining = max(0.0, started + self.timeouts[name] - time.monotonic())
+            try:
+                results[name], timings[name] = future.result(timeout=remaining)
+            except TimeoutError:
+                errors[name] = f"timed out after {self.timeouts[name]:.0f}s"
+            except Exception as e:
+                errors[name] = f"{type(e).__name__}: {e}"
+        # Do not wait for stages that timed out
+        executor.shutdown(wait=False, cancel_futures=True)
+
+        # Exposures and TWR only regroup data that is already loaded, so they run after the stages
+        ratios, market = results.get('ratios', (None, None))
+        exposures = None
+        try:
+            exposures, timings['exposure'] = _timed('exposure', calculate_exposures, positions.frame, market and market[1])
+        except Exception as e:
+            errors['exposure'] = f"{type(e).__name__}: {e}"
+        performance = results.get('performance')
+        if performance is not None and market is not None:
+            try:
+                performance = {**performance, 'time_weighted_return_1y': time_weighted_return(df_input, *market)}
+            except Exception as e:
+                errors['twr'] = f"{type(e).__name__}: {e}"
+
+        portfolio_beta, each_stock_result, missing_betas = results.get('beta', (None, None, []))
+        stress_prices = results.get('stress')
+        tail_risk = None
+        try:
+            tail_risk, timings['tail_risk'] = _timed(
+                'tail_risk', calculate_tail_risk, positions.frame, market and market[1], beta_map(each_stock_result), stress_prices or {},
+            )
+        except Exception as e:
+            errors['tail_risk'] = f"{type(e).__name__}: {e}"
+
+        return PortfolioMetrics(
+            performance=performance,
+            positions=positions,
+            portfolio_beta=portfolio_beta,
+            each_stock_result=each_stock_result,
+            missing_betas=tuple(missing_betas),
+            ratios=ratios,
+            exposures=exposures,
+            tail_risk=tail_risk,
+            market=market,
+            stress_prices=stress_prices,
+            errors=errors,
+            timings=timings,
+        )
+
+
+def set_aside_unconverted(df, errors, base_currency=BASE_CURRENCY):
+    """
+    Converted holdings without the lots that had no rate to the base currency, which would turn every
+    sum over holdings into NaN; how many were left out, and why, is recorded in errors['fx']
+    """
+    left_out = unconverted_rows(df)
+    if left_out.any():
+        errors['fx'] = f"no {base_currency} rate for {', '.join(missing_currencies(df))}: {int(left_out.sum())} of {len(df)} lots left out"
+    return df[~left_out].reset_index(drop=True)
+
+
+def unconverted_metrics(df, errors, base_currency=BASE_CURRENCY):
+    """
+    Metrics of holdings whose values could not be converted to the base currency: every stage adds
+    values up across holdings, so none of them runs and each is reported as skipped.
+    """
+    skipped = f"skipped: holdings could not be converted to {base_currency}"
+    return PortfolioMetrics(
+        positions=aggregate_positions(df),
+        errors={**errors, **{name: skipped for name in ('performance', 'beta', 'ratios', 'exposure', 'tail_risk')}},
+    )
+
+
+def with_rebalance(metrics, strategy):
+    """
+    `metrics` with the optimizer's target weights and trade list for `strategy`, from the returns
+    the ratios were computed from; plans are cached, so each portfolio snapshot is solved once
+    """
+    if metrics.market is None or metrics.positions is None:
+        return metrics
+    if metrics.rebalance is not None and metrics.rebalance['strategy'] == strategy.strip().lower():
+        return metrics
+    try:
+        rebalance, duration = _timed('rebalance', plan_rebalance, metrics.positions.frame, metrics.market[1], strategy)
+    except Exception as e:
+        return replace(metrics, errors={**metrics.errors, 'rebalance': f"{type(e).__name__}: {e}"})
+    return replace(metrics, rebalance=rebalance, timings={**metrics.timings, 'rebalance': duration})
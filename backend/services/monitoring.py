@@ -0,0 +1,488 @@
+import time
+import asyncio
+import threading
+import numpy as np
+import pandas as pd
+from collections import deque
+from services.telemetry import telemetry
+from tools.fx_rates import convert_holdings, missing_currencies, unconverted_rows
+from tools.tick_feed import create_tick_feed
+from config import (
+    BASE_CURRENCY, MONITOR_MAX_PORTFOLIOS, MONITOR_VOLATILITY_WINDOW, MONITOR_SAMPLE_SECONDS,
+    MONITOR_DRAWDOWN_ALERT, MONITOR_MOVE_ALERT, MONITOR_VOLATILITY_ALERT, MONITOR_QUEUE_SIZE,
+)
+
+# Rolling volatility is realized over feed time, so it is annualized over calendar seconds
+SECONDS_PER_YEAR = 365.25 * 24 * 3600
+ALERTS = ('drawdown', 'volatility')
+
+
+class MonitorFullError(Exception):
+    pass
+
+
+def _grow(array, size, fill=0):
+    """`array` with its first axis extended to at least `size`, doubling so adding slots stays amortized O(1)"""
+    if len(array) >= size:
+        return array
+    grown = np.full((max(size, 2 * len(array)), *array.shape[1:]), fill, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def monitored_positions(holdings, base=BASE_CURRENCY, fx=None):
+    """
+    One row per ticker of lot-level holdings: Multiplier is the base-currency value of a unit move
+    in the listing-currency price (quantity times the spot FX rate), Price the uploaded price and
+    Total Cost the converted cost. Lots whose currency has no rate are left out.
+    """
+    converted = convert_holdings(holdings, base, fx)
+    priced = ~unconverted_rows(converted)
+    frame = pd.DataFrame({
+        'Ticker': holdings['Ticker'].astype(str).to_numpy(),
+        'Multiplier': (converted['Quantity'] * converted['FX Rate']).to_numpy(dtype=float),
+        'Price': holdings['Current Price'].to_numpy(dtype=float),
+        'Total Cost': converted['Total Cost'].to_numpy(dtype=float),
+    })[priced]
+    positions = frame.groupby('Ticker', sort=False).agg(
+        Multiplier=('Multiplier', 'sum'),
+        Price=('Price', 'last'),
+        **{'Total Cost': ('Total Cost', 'sum')},
+    ).reset_index()
+    return positions, missing_currencies(converted)
+
+
+class PortfolioBook():
+    """
+    Running aggregates of many portfolios in flat arrays, one slot per portfolio. Positions are
+    indexed by ticker, so a tick only touches the portfolios holding that ticker and each of
+    them is updated in O(1): the value moves by multiplier x price change, the peak and
+    drawdown follow, and rolling volatility keeps running sums over a ring buffer of samples.
+    Not thread-safe; the Monitor serializes access.
+    """
+
+    def __init__(self, window=MONITOR_VOLATILITY_WINDOW, sample_seconds=MONITOR_SAMPLE_SECONDS, capacity=64):
+        self.window = window
+        self.sample_seconds = sample_seconds
+        # Latest price per ticker column, in the listing currency
+        self.columns = {}
+        self.prices = np.full(capacity, np.nan)
+        self.slots = {}
+        self.ids = []
+        self._free = []
+        self._positions = {}
+        self._index = None
+        # Feed time of the latest batch, in seconds
+        self.clock = np.nan
+
+        self.cost = np.zeros(capacity)
+        self.value = np.zeros(capacity)
+        self.peak = np.zeros(capacity)
+        self.max_drawdown = np.zeros(capacity)
+        self.reference = np.zeros(capacity)
+        self.updates = np.zeros(capacity, dtype=np.int64)
+        self.updated = np.full(capacity, np.nan)
+        self.alerted = np.zeros((capacity, len(ALERTS)), dtype=bool)
+        # Ring buffer of squared log returns and the feed time each covers, with their running sums
+        self.sample_value = np.zeros(capacity)
+        self.sample_time = np.full(capacity, np.nan)
+        self.squares = np.zeros((capacity, window))
+        self.intervals = np.zeros((capacity, window))
+        self.cursor = np.zeros(capacity, dtype=np.int64)
+        self.samples = np.zeros(capacity, dtype=np.int64)
+        self.sum_squares = np.zeros(capacity)
+        self.sum_intervals = np.zeros(capacity)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _allocate(self):
+        if self._free:
+            return self._free.pop()
+        slot = len(self.ids)
+        self.ids.append(None)
+        size = slot + 1
+        for name in ('cost', 'value', 'peak', 'max_drawdown', 'reference', 'updates', 'sample_value', 'cursor',
+                     'samples', 'sum_squares', 'sum_intervals', 'squares', 'intervals', 'alerted'):
+            setattr(self, name, _grow(getattr(self, name), size))
+        for name in ('updated', 'sample_time'):
+            setattr(self, name, _grow(getattr(self, name), size, np.nan))
+        return slot
+
+    def add(self, portfolio_id, positions):
+        """Start (or restart) tracking `portfolio_id` from monitored_positions; values use the latest known prices"""
+        self.remove(portfolio_id)
+        tickers = positions['Ticker'].to_numpy()
+        for ticker in tickers:
+            if ticker not in self.columns:
+                self.columns[ticker] = len(self.columns)
+        columns = np.fromiter((self.columns[ticker] for ticker in tickers), dtype=np.int64, count=len(tickers))
+        self.prices = _grow(self.prices, len(self.columns), np.nan)
+        unpriced = np.isnan(self.prices[columns])
+        self.prices[columns[unpriced]] = positions['Price'].to_numpy(dtype=float)[unpriced]
+
+        multipliers = positions['Multiplier'].to_numpy(dtype=float)
+        value = float(np.nansum(multipliers * self.prices[columns]))
+        slot = self._allocate()
+        self.slots[portfolio_id], self.ids[slot] = slot, portfolio_id
+        self._positions[slot] = (columns, multipliers)
+        self._index = None
+
+        self.cost[slot] = positions['Total Cost'].sum()
+        self.value[slot] = self.peak[slot] = self.reference[slot] = self.sample_value[slot] = value
+        self.max_drawdown[slot] = 0.0
+        self.updates[slot] = 0
+        self.updated[slot] = self.sample_time[slot] = self.clock
+        self.alerted[slot] = False
+        self.squares[slot] = self.intervals[slot] = 0.0
+        self.cursor[slot] = self.samples[slot] = 0
+        self.sum_squares[slot] = self.sum_intervals[slot] = 0.0
+        return slot
+
+    def held_tickers(self):
+        """Tickers at least one monitored portfolio holds"""
+        names, offsets, _, _ = self._ticker_index()
+        return names[np.diff(offsets) > 0].tolist()
+
+    def remove(self, portfolio_id):
+        slot = self.slots.pop(portfolio_id, None)
+        if slot is None:
+            return False
+        self.ids[slot] = None
+        del self._positions[slot]
+        self._free.append(slot)
+        self._index = None
+        return True
+
+    def _ticker_index(self):
+        """Positions sorted by ticker column: slots[offsets[c]:offsets[c + 1]] hold column c. Rebuilt after subscriptions change."""
+        if self._index is None:
+            held = list(self._positions.items())
+            columns = np.concatenate([np.zeros(0, dtype=np.int64), *(held_columns for _, (held_columns, _) in held)])
+            slots = np.concatenate([np.zeros(0, dtype=np.int64), *(np.full(len(held_columns), slot) for slot, (held_columns, _) in held)])
+            multipliers = np.concatenate([np.zeros(0), *(held_multipliers for _, (_, held_multipliers) in held)])
+            order = np.argsort(columns, kind='stable')
+            offsets = np.zeros(len(self.columns) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(columns, minlength=len(self.columns)), out=offsets[1:])
+            self._index = (pd.Index(list(self.columns)), offsets, slots[order], multipliers[order])
+        return self._index
+
+    def apply(self, timestamp, tickers, prices):
+        """
+        Move every portfolio holding a ticked ticker. Returns the slots that changed and the alerts
+        raised; ticks for tickers nobody holds are ignored, and the last tick of a ticker wins.
+        """
+        names, offsets, entry_slots, entry_multipliers = self._ticker_index()
+        self.clock = pd.Timestamp(timestamp).value / 1e9
+        prices = np.asarray(prices, dtype=float)
+        columns = names.get_indexer(np.asarray(tickers, dtype=object))
+        known = (columns >= 0) & np.isfinite(prices) & (prices > 0)
+        columns, prices = columns[known], prices[known]
+        last = len(columns) - 1 - np.unique(columns[::-1], return_index=True)[1]
+        columns, prices = columns[last], prices[last]
+
+        change = prices - self.prices[columns]
+        self.prices[columns] = prices
+        starts, lengths = offsets[columns], offsets[columns + 1] - offsets[columns]
+        total = int(lengths.sum())
+        if not total:
+            return np.zeros(0, dtype=np.int64), []
+        # Entries of all ticked columns at once: each column's run of positions, back to back
+        entries = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(total)
+        slots = entry_slots[entries]
+        np.add.at(self.value, slots, entry_multipliers[entries] * np.repeat(change, lengths))
+        changed = np.unique(slots)
+        return changed, self._update(changed)
+
+    def _update(self, slots):
+        now = self.clock
+        value = self.value[slots]
+        self.peak[slots] = peak = np.maximum(self.peak[slots], value)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            drawdown = np.where(peak > 0, value / peak - 1, 0.0)
+        self.max_drawdown[slots] = np.minimum(self.max_drawdown[slots], drawdown)
+        self.updates[slots] += 1
+        self.updated[slots] = now
+
+        # One volatility sample per portfolio and MONITOR_SAMPLE_SECONDS: replace the oldest in the ring and its share of the sums
+        started = np.isnan(self.sample_time[slots])
+        self.sample_time[slots[started]] = now
+        due = slots[~started & (now - self.sample_time[slots] >= self.sample_seconds)]
+        if len(due):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                square = np.nan_to_num(np.log(self.value[due] / self.sample_value[due])) ** 2
+            interval = now - self.sample_time[due]
+            cursor = self.cursor[due]
+            self.sum_squares[due] += square - self.squares[due, cursor]
+            self.sum_intervals[due] += interval - self.intervals[due, cursor]
+            self.squares[due, cursor], self.intervals[due, cursor] = square, interval
+            self.cursor[due] = (cursor + 1) % self.window
+            self.samples[due] = np.minimum(self.samples[due] + 1, self.window)
+            self.sample_value[due], self.sample_time[due] = self.value[due], now
+        return self._alerts(slots, value, drawdown)
+
+    def volatility(self, slots):
+        """Annualized realized volatility over the ring, NaN until two samples are in"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            variance = np.maximum(self.sum_squares[slots], 0) / self.sum_intervals[slots] * SECONDS_PER_YEAR
+        return np.where(self.samples[slots] >= 2, np.sqrt(variance), np.nan)
+
+    def _alerts(self, slots, value, drawdown):
+        volatility = self.volatility(slots)
+        full = self.samples[slots] >= self.window
+        crossed = {
+            # (crossed now, recovered enough to fire again)
+            'drawdown': (drawdown <= -MONITOR_DRAWDOWN_ALERT, drawdown > -MONITOR_DRAWDOWN_ALERT / 2),
+            'volatility': (full & (volatility >= MONITOR_VOLATILITY_ALERT) if MONITOR_VOLATILITY_ALERT else np.zeros(len(slots), dtype=bool),
+                           ~(volatility >= MONITOR_VOLATILITY_ALERT / 2)),
+        }
+        fired = []
+        for column, name in enumerate(ALERTS):
+            hit, recovered = crossed[name]
+            alerted = self.alerted[slots, column]
+            for i in np.flatnonzero(hit & ~alerted):
+                fired.append((name, i))
+            self.alerted[slots, column] = (alerted | hit) & ~(recovered & ~hit)
+
+        # Moves fire every MONITOR_MOVE_ALERT away from the value at the previous move alert
+        with np.errstate(divide='ignore', invalid='ignore'):
+            move = np.where(self.reference[slots] > 0, value / self.reference[slots] - 1, 0.0)
+        moved = np.flatnonzero(np.abs(move) >= MONITOR_MOVE_ALERT) if MONITOR_MOVE_ALERT else []
+        fired.extend(('move', i) for i in moved)
+
+        alerts = []
+        for name, i in fired:
+            slot = slots[i]
+            alert = {'portfolio_id': self.ids[slot], 'alert': name, 'timestamp': _iso(self.clock), 'value': round(float(value[i]), 2)}
+            if name == 'drawdown':
+                alert.update(drawdown=round(float(drawdown[i]) * 100, 2), threshold=round(-MONITOR_DRAWDOWN_ALERT * 100, 2))
+            elif name == 'volatility':
+                alert.update(volatility=round(float(volatility[i]) * 100, 2), threshold=round(MONITOR_VOLATILITY_ALERT * 100, 2))
+            else:
+                alert.update(change=round(float(move[i]) * 100, 2), threshold=round(MONITOR_MOVE_ALERT * 100, 2))
+                self.reference[slot] = value[i]
+            alerts.append(alert)
+        return alerts
+
+    def state(self, slots):
+        """Current aggregates of `slots` as dicts; returns, drawdowns and volatility in percent"""
+        slots = np.asarray(slots, dtype=np.int64)
+        value, cost, peak = self.value[slots], self.cost[slots], self.peak[slots]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            total_return = np.where(cost > 0, (value / cost - 1) * 100, np.nan)
+            drawdown = np.where(peak > 0, (value / peak - 1) * 100, 0.0)
+        volatility = self.volatility(slots) * 100
+
+        def number(x, digits=2):
+            return None if np.isnan(x) else round(x, digits)
+
+        return [{
+            'portfolio_id': self.ids[slot],
+            'timestamp': _iso(updated),
+            'value': number(v),
+            'cost': number(c),
+            'total_return': number(r),
+            'drawdown': number(d),
+            'max_drawdown': number(m * 100),
+            'volatility': number(s),
+            'samples': int(n),
+            'updates': int(u),
+        } for slot, updated, v, c, r, d, m, s, n, u in zip(
+            slots.tolist(), self.updated[slots].tolist(), value.tolist(), cost.tolist(), total_return.tolist(),
+            drawdown.tolist(), self.max_drawdown[slots].tolist(), volatility.tolist(), self.samples[slots].tolist(),
+            self.updates[slots].tolist(),
+        )]
+
+
+def _iso(seconds):
+    return None if np.isnan(seconds) else pd.Timestamp(seconds, unit='s').isoformat()
+
+
+class Subscriber():
+    """
+    One WebSocket's view of the monitor. Updates are coalesced: only which portfolios changed is
+    kept and their latest state is read when sending, so a slow client gets fresh numbers instead
+    of a growing backlog. Alerts queue up to `queue_size`, beyond that the oldest are dropped and counted.
+    """
+
+    def __init__(self, portfolio_ids=None, queue_size=MONITOR_QUEUE_SIZE, loop=None):
+        # None watches every monitored portfolio
+        self.portfolio_ids = set(portfolio_ids) if portfolio_ids is not None else None
+        self.loop = loop or asyncio.get_running_loop()
+        self._ready = asyncio.Event()
+        self._lock = threading.Lock()
+        self._changed = set()
+        self._alerts = deque()
+        self._queue_size = queue_size
+        self._dropped = 0
+        self._notified = False
+
+    def _notify(self):
+        # Called with the lock held; at most one wake-up is in flight
+        if not self._notified:
+            self._notified = True
+            try:
+                self.loop.call_soon_threadsafe(self._ready.set)
+            except RuntimeError:
+                # The event loop has already closed
+                pass
+
+    def publish(self, changed, alerts):
+        """Record changed portfolio ids and alerts; called from the feed thread"""
+        if self.portfolio_ids is not None:
+            changed = [portfolio_id for portfolio_id in changed if portfolio_id in self.portfolio_ids]
+            alerts = [alert for alert in alerts if alert['portfolio_id'] in self.portfolio_ids]
+        if not changed and not alerts:
+            return
+        with self._lock:
+            self._changed.update(changed)
+            for alert in alerts:
+                if len(self._alerts) >= self._queue_size:
+                    self._alerts.popleft()
+                    self._dropped += 1
+                self._alerts.append(alert)
+            self._notify()
+
+    def watch(self, portfolio_ids):
+        """Add portfolios; their current state goes out with the next message"""
+        with self._lock:
+            if self.portfolio_ids is not None:
+                self.portfolio_ids.update(portfolio_ids)
+            self._changed.update(portfolio_ids)
+            self._notify()
+
+    def unwatch(self, portfolio_ids):
+        with self._lock:
+            if self.portfolio_ids is None:
+                return
+            self.portfolio_ids.difference_update(portfolio_ids)
+            self._changed.difference_update(portfolio_ids)
+
+    async def next(self):
+        """Wait for news, then take (changed portfolio ids, alerts, alerts dropped since the last call)"""
+        await self._ready.wait()
+        with self._lock:
+            self._ready.clear()
+            self._notified = False
+            changed, alerts, dropped = list(self._changed), list(self._alerts), self._dropped
+            self._changed.clear()
+            self._alerts.clear()
+            self._dropped = 0
+        return changed, alerts, dropped
+
+
+class Monitor():
+    """
+    Portfolios subscribed to a tick feed. The feed is consumed on a background thread that
+    updates the PortfolioBook and hands changes and alerts to the connected Subscribers.
+    """
+
+    def __init__(self, book=None, max_portfolios=MONITOR_MAX_PORTFOLIOS):
+        self.book = book or PortfolioBook()
+        self.max_portfolios = max_portfolios
+        self.feed = None
+        self.ticks = 0
+        self.error = None
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._thread = None
+
+    def subscribe(self, portfolio_id, holdings, base=BASE_CURRENCY, fx=None):
+        """Start monitoring lot-level holdings under `portfolio_id`, replacing earlier holdings of the same id"""
+        positions, missing = monitored_positions(holdings, base, fx)
+        with self._lock:
+            if portfolio_id not in self.book.slots and len(self.book) >= self.max_portfolios:
+                raise MonitorFullError(f"Already monitoring {len(self.book)} portfolios, at most {self.max_portfolios} are allowed")
+            slot = self.book.add(portfolio_id, positions)
+            state = self.book.state([slot])[0]
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.publish([portfolio_id], [])
+        return {**state, 'positions': len(positions), 'missing_currencies': missing}
+
+    def unsubscribe(self, portfolio_id):
+        with self._lock:
+            return self.book.remove(portfolio_id)
+
+    def tickers(self):
+        """Tickers the feed needs prices for"""
+        with self._lock:
+            return self.book.held_tickers()
+
+    def state(self, portfolio_ids=None):
+        """Latest aggregates of the given monitored portfolios (all when None); unknown ids are skipped"""
+        with self._lock:
+            if portfolio_ids is None:
+                slots = list(self.book.slots.values())
+            else:
+                slots = [self.book.slots[portfolio_id] for portfolio_id in portfolio_ids if portfolio_id in self.book.slots]
+            return self.book.state(slots)
+
+    def apply(self, timestamp, tickers, prices):
+        """Apply one batch of ticks sharing a timestamp and notify the subscribers"""
+        started = time.perf_counter()
+        with self._lock:
+            changed, alerts = self.book.apply(timestamp, tickers, prices)
+            changed = [self.book.ids[slot] for slot in changed.tolist()]
+            subscribers = list(self._subscribers)
+        self.ticks += len(tickers)
+        if changed:
+            for subscriber in subscribers:
+                subscriber.publish(changed, alerts)
+        telemetry.observe('monitor.ticks', time.perf_counter() - started)
+        return changed, alerts
+
+    def connect(self, portfolio_ids=None, queue_size=MONITOR_QUEUE_SIZE):
+        """A Subscriber on the running event loop, notified of every change from now on"""
+        subscriber = Subscriber(portfolio_ids, queue_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def disconnect(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def start(self, feed=None):
+        """Consume `feed` (the configured one by default) on a background thread; False without a feed"""
+        self.feed = feed or create_tick_feed(self.tickers)
+        if self.feed is None:
+            return False
+        self._thread = threading.Thread(target=self._run, name='monitor-feed', daemon=True)
+        self._thread.start()
+        return True
+
+    def _run(self):
+        try:
+            for timestamp, tickers, prices in self.feed.batches():
+                self.apply(timestamp, tickers, prices)
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+
+    def stop(self):
+        if self.feed is not None:
+            self.feed.close()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def stats(self):
+        return {
+            'portfolios': len(self.book),
+            'tickers': len(self.book.columns),
+            'subscribers': len(self._subscribers),
+            'ticks': self.ticks,
+            'feed': getattr(self.feed, 'source', None),
+            'feed_error': getattr(self.feed, 'error', None),
+            'running': self._thread is not None and self._thread.is_alive(),
+            'error': self.error,
+        }
+
+
+_default_monitor = None
+
+
+def get_default_monitor():
+    global _default_monitor
+    if _default_monitor is None:
+        _default_monitor = Monitor()
+    return _default_monitor
@@ -0,0 +1,62 @@
+import pandas as pd
+from dataclasses import dataclass
+from tools.calculate_portfolio_tools import holding_years
+
+
+@dataclass
+class Positions:
+    """
+    One row per ticker aggregated from lot-level holdings, with the lots they came from.
+    `lots['Position']` is the row of `frame` each lot belongs to.
+    """
+    frame: pd.DataFrame
+    lots: pd.DataFrame
+
+    def __len__(self):
+        return len(self.frame)
+
+
+def aggregate_positions(lots: pd.DataFrame, as_of=None):
+    """
+    Group lots by ticker in one vectorized pass.
+    Average Price is the quantity-weighted purchase price, Current Price is Market Value
+    per share and Holding Period is the age of the lots in years, weighted by Total Cost.
+    """
+    lots = lots.reset_index(drop=True)
+    years = holding_years(lots['Purchase Date'], as_of)
+    work = pd.DataFrame({
+        'Ticker': lots['Ticker'],
+        'Quantity': lots['Quantity'],
+        'Total Cost': lots['Total Cost'],
+        'Paid': lots['Quantity'] * lots['Purchase Price'],
+        'Cost Years': lots['Total Cost'] * years,
+        'Market Value': lots['Quantity'] * lots['Current Price'],
+        'Purchase Date': pd.to_datetime(lots['Purchase Date']),
+    })
+    grouped = work.groupby('Ticker', observed=True, sort=False)
+    frame = grouped.agg(
+        Lots=('Quantity', 'size'),
+        Quantity=('Quantity', 'sum'),
+        Paid=('Paid', 'sum'),
+        **{
+            'Total Cost': ('Total Cost', 'sum'),
+            'Cost Years': ('Cost Years', 'sum'),
+            'Market Value': ('Market Value', 'sum'),
+            'First Purchase': ('Purchase Date', 'min'),
+        },
+    )
+
+    # Descriptive columns are taken from the first lot of each ticker
+    first = lots.groupby('Ticker', observed=True, sort=False).head(1).set_index('Ticker')
+    for column in ['Asset Name', 'Sector', 'Currency', 'Dividend Yield']:
+        if column in first:
+            frame[column] = first[column].reindex(frame.index)
+
+    frame['Current Price'] = frame['Market Value'] / frame['Quantity']
+    frame['Average Price'] = frame['Paid'] / frame['Quantity']
+    frame['Holding Period'] = frame['Cost Years'] / frame['Total Cost']
+    frame = frame.drop(columns=['Paid', 'Cost Years']).reset_index()
+
+    lots = lots.copy()
+    lots['Position'] = grouped.ngroup().to_numpy()
+    return Positions(frame=frame, lots=lots)
@@ -0,0 +1,57 @@
+import time
+import hashlib
+import threading
+import pandas as pd
+from config import RESULT_CACHE_SIZE, RESULT_CACHE_TTL_HOURS, RESULT_CACHE_FRESHNESS_HOURS, RESULT_CACHE_PATH
+from services.cache import TieredCache, SQLiteCacheTier
+
+
+def _normalize_portfolio(df_input):
+    # Column order, row order and stray whitespace do not change the analysis
+    df = df_input.copy()
+    df.columns = [str(column).strip() for column in df.columns]
+    df = df[sorted(df.columns)]
+    for column in df.columns:
+        # Categorical order depends on row order, so compare the values themselves
+        if df[column].dtype == object or df[column].dtype == 'category':
+            df[column] = df[column].astype(str).str.strip()
+    return df.sort_values(list(df.columns), kind='mergesort').reset_index(drop=True)
+
+
+def market_data_bucket(now=None):
+    """Changes every RESULT_CACHE_FRESHNESS_HOURS, so cached results never outlive the market data they used"""
+    return int((now or time.time()) // (RESULT_CACHE_FRESHNESS_HOURS * 3600))
+
+
+def analysis_cache_key(df_input, investmentStrategy, referenceInvestor, securityMode, model, market_bucket=None):
+    df = _normalize_portfolio(df_input)
+    digest = hashlib.sha256()
+    digest.update(','.join(df.columns).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    for part in (
+        investmentStrategy.strip().lower(),
+        referenceInvestor.strip().casefold(),
+        str(bool(securityMode)),
+        model,
+        str(market_data_bucket() if market_bucket is None else market_bucket),
+    ):
+        digest.update(b'\0' + part.encode())
+    return digest.hexdigest()
+
+
+def create_result_cache():
+    disk = SQLiteCacheTier(RESULT_CACHE_PATH, 'analysis_results', RESULT_CACHE_TTL_HOURS * 3600) if RESULT_CACHE_PATH else None
+    return TieredCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL_HOURS * 3600, disk)
+
+
+_default_result_cache = None
+_default_result_cache_lock = threading.Lock()
+
+
+def get_default_result_cache():
+    # Built on first use, so importing the app does not create RESULT_CACHE_PATH
+    global _default_result_cache
+    with _default_result_cache_lock:
+        if _default_result_cache is None:
+            _default_result_cache = create_result_cache()
+    return _default_result_cache
@@ -0,0 +1,410 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+from config import (
+    SNAPSHOT_STORE_PATH, SNAPSHOT_TTL_HOURS, BASE_CURRENCY, BETA_BENCHMARK,
+    MATERIAL_RETURN_CHANGE, MATERIAL_RATIO_CHANGE, MATERIAL_BETA_CHANGE, MATERIAL_DRAWDOWN_CHANGE,
+    MATERIAL_WEIGHT_CHANGE, MATERIAL_TURNOVER,
+)
+from tools.calculate_portfolio_tools import (
+    performance_components, combine_performance, performance_from_components, performance_analysis, time_weighted_return,
+)
+from tools.calculate_ratio import load_returns, lot_start_dates, slice_market, ratio_components, ratios_from_components
+from tools.caluculate_beta import calculate_portfolio_beta
+from tools.fx_rates import convert_holdings, unconverted_rows
+from tools.exposure import calculate_exposures
+from tools.tail_risk import calculate_tail_risk, load_stress_prices, combine_stress_prices, split_stress_prices
+from services.cache import PURGE_INTERVAL_SECONDS
+from services.ingestion import SCHEMA_COLUMNS, CATEGORY_COLUMNS
+from services.metrics import PortfolioMetrics, beta_map
+from services.positions import aggregate_positions
+
+# What makes two rows the same lot; a change in any other column updates the lot in place
+IDENTITY_COLUMNS = ['Ticker', 'Purchase Date', 'Quantity', 'Purchase Price', 'Total Cost', 'Currency']
+DESCRIPTIVE_COLUMNS = [column for column in SCHEMA_COLUMNS if column not in IDENTITY_COLUMNS and column != 'Current Price']
+
+# Change in a summary field, since the narrative was written, above which it is written again
+MATERIAL_FIELDS = {
+    'total_return': MATERIAL_RETURN_CHANGE,
+    'portfolio_cagr': MATERIAL_RETURN_CHANGE,
+    'money_weighted_return': MATERIAL_RETURN_CHANGE,
+    'time_weighted_return_1y': MATERIAL_RETURN_CHANGE,
+    'benchmark_outperformance': MATERIAL_RETURN_CHANGE,
+    'sharp_ratio': MATERIAL_RATIO_CHANGE,
+    'sortino_ratio': MATERIAL_RATIO_CHANGE,
+    'portfolio_beta': MATERIAL_BETA_CHANGE,
+    'max_drawdown': MATERIAL_DRAWDOWN_CHANGE,
+}
+
+
+@dataclass
+class PortfolioSnapshot:
+    """What the last analysis of a portfolio leaves behind for the next upload to build on"""
+    portfolio_id: str
+    as_of: str
+    base_currency: str
+    benchmark: str
+    holdings: pd.DataFrame
+    # The same lots in the base currency, and the market data and additive metric components they were analysed with
+    converted: pd.DataFrame
+    closes: Optional[pd.DataFrame]
+    returns: Optional[pd.DataFrame]
+    components: Optional[pd.DataFrame]
+    # Closes of the held tickers and the benchmark through every stress scenario, see combine_stress_prices
+    stress: Optional[pd.DataFrame]
+    performance: dict
+    summary: dict
+    # The summary the narrative in `result` was written from, and the share of cost traded since
+    narrative_summary: dict
+    turnover: float = 0.0
+    result: Optional[dict] = None
+    # Strategy, reference investor and model the narrative was written for
+    context: Optional[dict] = None
+    updated_at: float = 0.0
+
+
+@dataclass
+class HoldingsDiff:
+    """Rows of a new upload matched against the previous one, lot by lot"""
+    kept: np.ndarray
+    added: np.ndarray
+    removed: np.ndarray
+    updated: np.ndarray
+
+    @property
+    def unchanged(self):
+        return not (len(self.added) or len(self.removed) or self.updated.any())
+
+    def summary(self):
+        return {'kept': int(len(self.kept)), 'added': int(len(self.added)), 'removed': int(len(self.removed)), 'updated': int(self.updated.sum())}
+
+
+@dataclass
+class SnapshotUpdate:
+    """Metrics of a new upload together with the state its snapshot is saved from"""
+    metrics: PortfolioMetrics
+    converted: Optional[pd.DataFrame]
+    components: Optional[pd.DataFrame]
+    performance: Optional[dict]
+    incremental: bool = False
+
+
+def _row_hashes(df, columns):
+    columns = [column for column in columns if column in df]
+    normalized = pd.DataFrame({
+        column: df[column].astype(str).str.strip() if df[column].dtype == object or df[column].dtype == 'category' else df[column]
+        for column in columns
+    })
+    return pd.util.hash_pandas_object(normalized, index=False).to_numpy()
+
+
+def _lot_keys(df):
+    keys = pd.Series(_row_hashes(df, IDENTITY_COLUMNS))
+    # Identical lots are told apart by their order of appearance
+    return pd.DataFrame({'key': keys, 'occurrence': keys.groupby(keys).cumcount(), 'row': np.arange(len(df))})
+
+
+def diff_holdings(previous, current):
+    merged = _lot_keys(previous).merge(_lot_keys(current), on=['key', 'occurrence'], how='outer', suffixes=('_previous', '_current'), indicator=True)
+    both = merged[merged['_merge'] == 'both']
+    kept = both[['row_previous', 'row_current']].to_numpy(dtype=int).reshape(-1, 2)
+    descriptive = [*DESCRIPTIVE_COLUMNS, 'Current Price']
+    updated = _row_hashes(previous, descriptive)[kept[:, 0]] != _row_hashes(current, descriptive)[kept[:, 1]]
+    return HoldingsDiff(
+        kept=kept,
+        added=np.sort(merged.loc[merged['_merge'] == 'right_only', 'row_current'].to_numpy(dtype=int)),
+        removed=np.sort(merged.loc[merged['_merge'] == 'left_only', 'row_previous'].to_numpy(dtype=int)),
+        updated=updated,
+    )
+
+
+def turnover(snapshot, current, diff, fx=None):
+    """
+    Net cost bought or sold in each ticker, as a share of the previous portfolio's cost. Costs are
+    compared in the snapshot's base currency: removed lots at their stored conversion, added ones converted now.
+    """
+    def cost_by_ticker(lots):
+        return lots['Total Cost'].groupby(lots['Ticker'].astype(str)).sum()
+
+    previous = snapshot.converted
+    added = convert_holdings(current.reset_index(drop=True).iloc[diff.added], snapshot.base_currency, fx)
+    traded = cost_by_ticker(added).sub(cost_by_ticker(previous.iloc[diff.removed]), fill_value=0.0).abs().sum()
+    return float(traded / previous['Total Cost'].sum())
+
+
+def _performance(converted, market, performance):
+    analysis = performance_analysis(performance_from_components(performance), converted)
+    if market is not None:
+        analysis['time_weighted_return_1y'] = time_weighted_return(converted, *market)
+    return analysis
+
+
+def full_update(metrics):
+    """SnapshotUpdate of a portfolio whose metrics were computed from scratch; its state is derived when it is saved"""
+    return SnapshotUpdate(metrics=metrics, converted=None, components=None, performance=None)
+
+
+def incremental_update(snapshot, df_input, diff, provider=None, fx=None, base_currency=BASE_CURRENCY, benchmark=BETA_BENCHMARK):
+    """
+    Metrics of `df_input` from the snapshot of its previous upload: only lots that were added,
+    removed or repriced are converted and folded into the stored performance and ratio
+    components, and only tickers the portfolio did not hold before are fetched.
+    None when the snapshot cannot be built on (another day, currency or benchmark, or new lots
+    reaching back before the stored market data), and the portfolio has to be analysed in full.
+    """
+    today = datetime.now().date()
+    if (snapshot.as_of != today.isoformat() or snapshot.base_currency != base_currency or snapshot.benchmark != benchmark
+            or snapshot.closes is None or snapshot.components is None):
+        return None
+
+    current = df_input.reset_index(drop=True)
+    previous = snapshot.converted
+    window_start = lot_start_dates(previous, today).min()
+    added = convert_holdings(current.iloc[diff.added], base_currency, fx)
+    if len(added) and lot_start_dates(added, today).min() < window_start:
+        return None
+    # Lots without a rate are set aside by a full run, which the snapshot's lot alignment cannot follow
+    if unconverted_rows(added).any():
+        return None
+
+    # Lots that stayed keep their purchase-date conversion, their current price is re-read at the stored spot rate
+    kept = previous.iloc[diff.kept[:, 0]].copy()
+    kept.index = diff.kept[:, 1]
+    for column in [column for column in DESCRIPTIVE_COLUMNS if column in current]:
+        kept[column] = current[column].to_numpy()[diff.kept[:, 1]]
+    kept['Current Price'] = current['Current Price'].to_numpy(dtype=float)[diff.kept[:, 1]] * kept['FX Rate'].to_numpy()
+    # Indexed by upload row, so the lots come back in the upload's order
+    converted = pd.concat([kept, added]).sort_index()
+    for column in [column for column in CATEGORY_COLUMNS if column in converted]:
+        converted[column] = converted[column].astype(str).astype('category')
+    converted = converted.reset_index(drop=True)
+
+    # Market data is fetched for new tickers only, over the stored window
+    closes, returns = snapshot.closes, snapshot.returns
+    new_tickers = [ticker for ticker in added['Ticker'].astype(str).unique() if ticker not in closes.columns] if len(added) else []
+    if new_tickers:
+        currencies = added.groupby('Ticker', observed=True, sort=False)['Currency'].first().astype(str).to_dict()
+        new_closes, new_returns = load_returns({ticker: currencies[ticker] for ticker in new_tickers}, window_start, provider, base_currency, fx)
+        closes = closes.join(new_closes, how='outer')
+        returns = returns.join(new_returns, how='outer').reindex(closes.index[1:])
+    market = slice_market((closes, returns), converted, benchmark)
+
+    # The components follow the lots as long as every lot still sees the same calendar;
+    # otherwise they are rebuilt from the market data already in hand
+    stored_dates = snapshot.returns.index
+    if len(market[0]) and stored_dates[stored_dates > market[0].index[0]].equals(market[1].index):
+        removed_components = ratio_components(previous.iloc[diff.removed], snapshot.closes, snapshot.returns)
+        added_components = ratio_components(added, closes, returns).reindex(stored_dates)
+        components = (snapshot.components - removed_components + added_components).reindex(market[1].index)
+    else:
+        components = ratio_components(converted, *market)
+
+    # Performance sums lose the removed and repriced lots as they were and gain them as they are now
+    repriced = diff.kept[diff.updated]
+    performance = combine_performance(snapshot.performance, performance_components(previous.iloc[np.concatenate([diff.removed, repriced[:, 0]])]), -1)
+    performance = combine_performance(performance, performance_components(converted.iloc[np.concatenate([diff.added, repriced[:, 1]])]))
+
+    positions = aggregate_positions(converted)
+    portfolio_beta, each_stock_result, missing_betas = calculate_portfolio_beta(positions.frame, benchmark, provider, None, base_currency, fx)
+    # Stress windows are history, so only tickers the snapshot has no closes for are fetched
+    stress = snapshot.stress
+    tickers = positions.frame['Ticker'].astype(str).unique()
+    if stress is None:
+        stress = combine_stress_prices(load_stress_prices(tickers, provider, benchmark))
+    else:
+        new_tickers = [ticker for ticker in tickers if ticker not in stress.columns]
+        if new_tickers:
+            new_stress = combine_stress_prices(load_stress_prices(new_tickers, provider, benchmark))
+            if new_stress is not None:
+                stress = stress.join(new_stress.drop(columns=stress.columns, errors='ignore'), how='outer')
+    stress_prices = split_stress_prices(stress)
+    metrics = PortfolioMetrics(
+        performance=_performance(converted, market, performance),
+        positions=positions,
+        portfolio_beta=portfolio_beta,
+        each_stock_result=each_stock_result,
+        missing_betas=tuple(missing_betas),
+        ratios=ratios_from_components(components, performance['total_cost'], market[1][benchmark].to_numpy()),
+        exposures=calculate_exposures(positions.frame, market[1]),
+        tail_risk=calculate_tail_risk(positions.frame, market[1], beta_map(each_stock_result), stress_prices, benchmark=benchmark),
+        market=market,
+        stress_prices=stress_prices,
+    )
+    return SnapshotUpdate(metrics=metrics, converted=converted, components=components, performance=performance, incremental=True)
+
+
+def material_changes(narrative_summary, summary, traded=0.0):
+    """Changes since the narrative was written that are large enough for it to be written again"""
+    changes = []
+    for name, threshold in MATERIAL_FIELDS.items():
+        before, after = narrative_summary.get(name), summary.get(name)
+        if before is None and after is None:
+            continue
+        if before is None or after is None or abs(after - before) > threshold:
+            changes.append({'metric': name, 'before': before, 'after': after})
+    for name in ('top_performer', 'underperformer'):
+        before, after = (narrative_summary.get(name) or {}).get('ticker'), (summary.get(name) or {}).get('ticker')
+        if before != after:
+            changes.append({'metric': name, 'before': before, 'after': after})
+
+    def sector_weights(fields):
+        return {row['sector']: row['weight'] or 0.0 for row in (fields.get('exposures') or {}).get('sectors', [])}
+
+    before_weights, after_weights = sector_weights(narrative_summary), sector_weights(summary)
+    for sector in dict.fromkeys([*before_weights, *after_weights]):
+        before, after = before_weights.get(sector, 0.0), after_weights.get(sector, 0.0)
+        if abs(after - before) > MATERIAL_WEIGHT_CHANGE:
+            changes.append({'metric': f'sector_weight:{sector}', 'before': before, 'after': after})
+    if traded > MATERIAL_TURNOVER:
+        changes.append({'metric': 'turnover', 'before': 0.0, 'after': round(traded, 4)})
+    return changes
+
+
+def next_snapshot(portfolio_id, holdings, update, result, context, previous=None, regenerated=True, traded=0.0, base_currency=BASE_CURRENCY, benchmark=BETA_BENCHMARK):
+    """The snapshot to keep after an analysis; a reused narrative keeps the summary and turnover it is judged against"""
+    summary = update.metrics.summary()
+    closes, returns = update.metrics.market or (None, None)
+    converted = update.converted
+    if converted is None:
+        converted = update.metrics.positions.lots.drop(columns=['Position']) if update.metrics.positions is not None else convert_holdings(holdings, base_currency)
+    components = update.components
+    if components is None and closes is not None:
+        components = ratio_components(converted, closes, returns)
+    return PortfolioSnapshot(
+        portfolio_id=portfolio_id,
+        as_of=datetime.now().date().isoformat(),
+        base_currency=base_currency,
+        benchmark=benchmark,
+        holdings=holdings.reset_index(drop=True),
+        converted=converted,
+        closes=closes,
+        returns=returns,
+        components=components,
+        stress=combine_stress_prices(update.metrics.stress_prices),
+        performance=update.performance or performance_components(converted),
+        summary=summary,
+        narrative_summary=summary if regenerated or previous is None else previous.narrative_summary,
+        turnover=0.0 if regenerated or previous is None else previous.turnover + traded,
+        result=result,
+        context=context,
+    )
+
+
+def _to_arrow(frame):
+    if frame is None:
+        return None
+    table = pa.Table.from_pandas(frame, preserve_index=True)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _from_arrow(blob):
+    if blob is None:
+        return None
+    return pa.ipc.open_stream(blob).read_all().to_pandas()
+
+
+class SnapshotStore():
+    """
+    SQLite-backed portfolio snapshots, one per portfolio id, shared across worker processes.
+    Frames are stored as Arrow IPC streams, everything else as JSON.
+    """
+
+    frames = ('holdings', 'converted', 'closes', 'returns', 'components', 'stress')
+
+    def __init__(self, path, ttl_hours=24 * 30):
+        self.path = path
+        self.ttl = ttl_hours * 3600
+        self._lock = threading.Lock()
+        self._purged_at = 0.0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS snapshots (
+                    portfolio_id TEXT PRIMARY KEY,
+                    updated_at REAL NOT NULL,
+                    state TEXT NOT NULL,
+                    holdings BLOB NOT NULL,
+                    converted BLOB NOT NULL,
+                    closes BLOB,
+                    returns BLOB,
+                    components BLOB,
+                    stress BLOB
+                )
+            """)
+            # Stores created before a frame was added get its column
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(snapshots)")}
+            for name in self.frames:
+                if name not in columns:
+                    conn.execute(f"ALTER TABLE snapshots ADD COLUMN {name} BLOB")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, portfolio_id):
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                f"SELECT updated_at, state, {', '.join(self.frames)} FROM snapshots WHERE portfolio_id = ? AND updated_at >= ?",
+                (portfolio_id, time.time() - self.ttl),
+            ).fetchone()
+        if row is None:
+            return None
+        updated_at, state, *blobs = row
+        state = json.loads(state)
+        state['performance']['flows'] = {int(day): amount for day, amount in state['performance']['flows'].items()}
+        return PortfolioSnapshot(portfolio_id=portfolio_id, updated_at=updated_at, **state, **{name: _from_arrow(blob) for name, blob in zip(self.frames, blobs)})
+
+    def put(self, snapshot):
+        state = {
+            name: getattr(snapshot, name)
+            for name in ('as_of', 'base_currency', 'benchmark', 'performance', 'summary', 'narrative_summary', 'turnover', 'result', 'context')
+        }
+        blobs = [_to_arrow(getattr(snapshot, name)) for name in self.frames]
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, {', '.join('?' * len(self.frames))})",
+                (snapshot.portfolio_id, time.time(), json.dumps(state, default=str), *blobs),
+            )
+        if time.time() - self._purged_at >= PURGE_INTERVAL_SECONDS:
+            self.purge()
+
+    def purge(self):
+        """Drop snapshots older than the TTL, which `get` already ignores"""
+        with self._lock, self._connect() as conn:
+            self._purged_at = time.time()
+            conn.execute("DELETE FROM snapshots WHERE updated_at < ?", (time.time() - self.ttl,))
+
+    def delete(self, portfolio_id):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM snapshots WHERE portfolio_id = ?", (portfolio_id,))
+
+
+_default_snapshot_store = None
+_default_snapshot_store_lock = threading.Lock()
+
+
+def get_default_snapshot_store():
+    # Built on first use, so importing the app does not create SNAPSHOT_STORE_PATH
+    global _default_snapshot_store
+    with _default_snapshot_store_lock:
+        if _default_snapshot_store is None:
+            _default_snapshot_store = SnapshotStore(SNAPSHOT_STORE_PATH, SNAPSHOT_TTL_HOURS)
+    return _default_snapshot_store
@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import secrets
+import threading
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+from config import TELEMETRY_ENABLED, TELEMETRY_OTLP_FILE, TELEMETRY_SERVICE_NAME
+
+# Latency buckets in seconds, from a cache hit up to a slow LLM call
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Span attributes that become Prometheus labels; everything else only goes to the trace file
+LABEL_ATTRIBUTES = ('agent', 'model', 'provider', 'tool', 'cache_hit')
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Histogram():
+    def __init__(self, name, help, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.setdefault(key, {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0})
+            series['counts'][bisect_left(self.buckets, value)] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: {**value, 'counts': list(value['counts'])} for key, value in self._series.items()}
+        for key, value in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip([*self.buckets, '+Inf'], value['counts']):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(key, le=bound)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(key)} {value['sum']:.6f}")
+            lines.append(f"{self.name}_count{_labels(key)} {value['count']}")
+        return lines
+
+
+class Counter():
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            series = dict(self._series)
+        lines += [f"{self.name}{_labels(key)} {value}" for key, value in sorted(series.items())]
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(key, **extra):
+    pairs = [*key, *extra.items()]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class OTLPJsonFileExporter():
+    """Appends each finished span to a local file as one OTLP/JSON ExportTraceServiceRequest per line"""
+
+    def __init__(self, path, service_name):
+        self.path = path
+        self.resource = {'attributes': [_otlp_attribute('service.name', service_name)]}
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def export(self, span):
+        record = {
+            'traceId': span.trace_id,
+            'spanId': span.span_id,
+            'name': span.name,
+            'kind': 1,
+            'startTimeUnixNano': str(span.start_ns),
+            'endTimeUnixNano': str(span.end_ns),
+            'attributes': [_otlp_attribute(key, value) for key, value in span.attributes.items()],
+            'status': {'code': 2, 'message': span.error} if span.error else {'code': 1},
+        }
+        if span.parent_id:
+            record['parentSpanId'] = span.parent_id
+        request = {'resourceSpans': [{'resource': self.resource, 'scopeSpans': [{'scope': {'name': 'nexa-port'}, 'spans': [record]}]}]}
+        line = json.dumps(request, default=str)
+        with self._lock, open(self.path, 'a') as f:
+            f.write(line + '\n')
+
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        typed = {'boolValue': value}
+    elif isinstance(value, int):
+        typed = {'intValue': str(value)}
+    elif isinstance(value, float):
+        typed = {'doubleValue': value}
+    else:
+        typed = {'stringValue': str(value)}
+    return {'key': key, 'value': typed}
+
+
+class Span():
+    def __init__(self, name, attributes, parent):
+        self.name = name
+        self.attributes = attributes
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.parent_id = parent.span_id if parent else None
+        self.span_id = secrets.token_hex(8)
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.duration = None
+        self.error = None
+        self._started = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class Telemetry():
+    """
+    In-process spans, histograms and counters. Nothing leaves the process except through
+    `render_prometheus` (served on /metrics) and the optional OTLP/JSON file.
+    """
+
+    def __init__(self, enabled=True, exporter=None):
+        self.enabled = enabled
+        self.exporter = exporter
+        self.durations = Histogram('nexa_span_duration_seconds', "Duration of instrumented stages")
+        self.tokens = Counter('nexa_llm_tokens_total', "LLM tokens by model and type")
+        self.cache_requests = Counter('nexa_cache_requests_total', "Cache lookups by cache and result")
+        self.errors = Counter('nexa_span_errors_total', "Instrumented stages that raised")
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Time a block; nested spans share a trace. Yields the span so attributes can be added."""
+        if not self.enabled:
+            span = Span(name, attributes, None)
+            try:
+                yield span
+            finally:
+                span.duration = time.perf_counter() - span._started
+            return
+        span = Span(name, attributes, _current_span.get())
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            self._finish(span)
+
+    def _finish(self, span):
+        span.duration = time.perf_counter() - span._started
+        span.end_ns = span.start_ns + int(span.duration * 1e9)
+        labels = {key: span.attributes[key] for key in LABEL_ATTRIBUTES if key in span.attributes}
+        self.durations.observe(span.duration, span=span.name, **labels)
+        if span.error:
+            self.errors.inc(span=span.name, **labels)
+        if self.exporter is not None:
+            try:
+                self.exporter.export(span)
+            except OSError:
+                pass
+
+    def observe(self, name, seconds, **labels):
+        """Record a duration measured outside a span"""
+        if self.enabled:
+            self.durations.observe(seconds, span=name, **labels)
+
+    def record_tokens(self, model, prompt_tokens=0, completion_tokens=0):
+        if not self.enabled:
+            return
+        self.tokens.inc(prompt_tokens or 0, model=model, type='prompt')
+        self.tokens.inc(completion_tokens or 0, model=model, type='completion')
+        span = _current_span.get()
+        if span is not None:
+            span.set(prompt_tokens=prompt_tokens or 0, completion_tokens=completion_tokens or 0)
+
+    def record_cache(self, cache, hit, count=1):
+        if self.enabled and count:
+            self.cache_requests.inc(count, cache=cache, result='hit' if hit else 'miss')
+
+    def render_prometheus(self):
+        lines = [*self.durations.render(), *self.errors.render(), *self.tokens.render(), *self.cache_requests.render()]
+        return '\n'.join(lines) + '\n'
+
+
+def current_context():
+    """Context to hand to worker threads so their spans join the caller's trace"""
+    return contextvars.copy_context()
+
+
+telemetry = Telemetry(
+    enabled=TELEMETRY_ENABLED,
+    exporter=OTLPJsonFileExporter(TELEMETRY_OTLP_FILE, TELEMETRY_SERVICE_NAME) if TELEMETRY_OTLP_FILE else None,
+)
+span = telemetry.span
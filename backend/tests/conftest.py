@@ -0,0 +1,17 @@
+import pytest
+import tools.beta_store as beta_store
+import tools.fx_rates as fx_rates
+import tools.price_history as price_history
+from benchmarks.fixtures import SyntheticPriceHistoryProvider, EmptyBetaStore
+from tools.fx_rates import FxRates
+
+
+@pytest.fixture
+def market_data(monkeypatch):
+    """Synthetic prices and FX rates behind the default singletons, so metrics run offline"""
+    provider = SyntheticPriceHistoryProvider(0)
+    fx = FxRates(provider)
+    monkeypatch.setattr(price_history, '_default_provider', provider)
+    monkeypatch.setattr(fx_rates, '_default_fx_rates', fx)
+    monkeypatch.setattr(beta_store, '_default_store', EmptyBetaStore())
+    return provider, fx
@@ -0,0 +1,31 @@
+import time
+import pytest
+from benchmarks.fixtures import synthetic_holdings
+from services.batch import BatchMetricsStage, combine_accounts
+from services.metrics import MetricsStage
+
+
+def test_batch_ratios_match_single_portfolio_ratios(market_data):
+    provider, fx = market_data
+    # One book split in two, so a ticker held in both accounts has one listing currency
+    lots = synthetic_holdings(100, tickers=12, provider=provider, seed=1)
+    frames = {'taxable': lots.iloc[:60].reset_index(drop=True), 'retirement': lots.iloc[60:].reset_index(drop=True)}
+    batch = BatchMetricsStage(fx=fx).run(combine_accounts(frames))
+
+    assert list(batch) == list(frames)
+    for account, frame in frames.items():
+        single = MetricsStage(fx=fx).run(frame)
+        assert batch[account].ratios is not None
+        assert batch[account].ratios == single.ratios
+
+
+def test_a_stage_that_times_out_is_reported_for_every_account(market_data, monkeypatch):
+    provider, fx = market_data
+    monkeypatch.setattr('services.batch.load_stress_prices', lambda *args: time.sleep(1) or {})
+    lots = synthetic_holdings(40, tickers=6, provider=provider, seed=2)
+    frames = {'taxable': lots.iloc[:20].reset_index(drop=True), 'retirement': lots.iloc[20:].reset_index(drop=True)}
+    batch = BatchMetricsStage(timeouts={'stress': 0.1}, fx=fx).run(combine_accounts(frames))
+
+    for metrics in batch.values():
+        assert metrics.errors['stress'] == "timed out after 0s"
+        assert metrics.ratios is not None
@@ -0,0 +1,27 @@
+import pytest
+from datetime import datetime, timedelta
+from config import BETA_BENCHMARK, BETA_LOOKBACK_DAYS
+from tools.beta_store import BetaStore, MAX_LOOKUP_TICKERS
+from tools.caluculate_beta import estimate_betas
+from tools.price_history import returns_matrix
+from tools.risk_engine import regression_betas
+
+
+def test_betas_are_regressed_on_base_currency_returns(market_data):
+    provider, fx = market_data
+    currencies = {'T0': 'EUR', 'T1': 'USD'}
+    betas, _ = estimate_betas(list(currencies), provider=provider, currencies=currencies, base_currency='USD', fx=fx)
+
+    today = datetime.now().date()
+    closes = provider.get_close_prices([*currencies, BETA_BENCHMARK], today - timedelta(days=BETA_LOOKBACK_DAYS), today)
+    returns = fx.convert_returns(returns_matrix(closes), {**currencies, BETA_BENCHMARK: 'USD'}, 'USD')
+    expected = regression_betas(returns[list(currencies)].to_numpy(), returns[BETA_BENCHMARK].to_numpy())
+    assert [betas['T0'], betas['T1']] == pytest.approx(list(expected))
+
+
+def test_lookups_of_more_tickers_than_one_query_takes(tmp_path):
+    store = BetaStore(str(tmp_path / 'betas.sqlite'))
+    betas = {f'T{i}': i / 1000 for i in range(2 * MAX_LOOKUP_TICKERS + 1)}
+    store.put_many(betas, 'SPY/USD', dict.fromkeys(betas, 250))
+
+    assert store.get_many(betas, 'SPY/USD') == pytest.approx(betas)
@@ -0,0 +1,21 @@
+import time
+import sqlite3
+from services.cache import TieredCache, SQLiteCacheTier
+
+
+def test_entry_read_from_disk_expires_with_its_disk_age(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    disk = SQLiteCacheTier(path, 'entries', 10)
+    disk.put('key', {'value': 1})
+    # Written 9.9s ago by another process
+    with sqlite3.connect(path) as conn:
+        conn.execute("UPDATE entries SET created_at = ?", (time.time() - 9.9,))
+
+    cache = TieredCache(8, 10, disk)
+    assert cache.get('key') == {'value': 1}
+    assert cache.stats()['disk_hits'] == 1
+
+    time.sleep(0.2)
+    # Served from memory, it would outlive the row it came from
+    assert cache.get('key') is None
+    assert cache.stats()['memory_hits'] == 0
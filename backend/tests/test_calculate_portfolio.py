@@ -0,0 +1,65 @@
+import json
+import math
+import pandas as pd
+import pytest
+from tools.calculate_portfolio_tools import xirr, calculate_portfolio, time_weighted_return
+
+AS_OF = '2026-06-30'
+
+
+def holdings(purchase_dates):
+    return pd.DataFrame({
+        'Ticker': [f'T{i}' for i in range(len(purchase_dates))],
+        'Asset Name': [f'T{i} Corp' for i in range(len(purchase_dates))],
+        'Quantity': 10.0,
+        'Purchase Price': 100.0,
+        'Current Price': [120.0, 90.0][:len(purchase_dates)],
+        'Purchase Date': pd.to_datetime(purchase_dates),
+        'Total Cost': 1000.0,
+    })
+
+
+def test_xirr_of_a_known_rate():
+    # 100 invested two years ago is worth 121 today
+    assert xirr([121, -100], [0, 2]) == pytest.approx(0.1)
+
+
+@pytest.mark.parametrize('amounts, years', [
+    ([-100, -50], [2, 1]),  # nothing ever comes back
+    ([100, 50], [0, 1]),  # nothing is ever invested
+    ([120, -100], [0, 0]),  # every flow is today
+])
+def test_xirr_without_a_solution_is_nan(amounts, years):
+    assert math.isnan(xirr(amounts, years))
+
+
+def test_money_weighted_return_without_a_solution_is_none():
+    result = json.loads(calculate_portfolio(holdings([AS_OF]), as_of=AS_OF))
+
+    assert result['money_weighted_return'] is None
+
+
+def test_lot_bought_today_is_not_annualized():
+    result = json.loads(calculate_portfolio(holdings(['2024-06-30', AS_OF]), as_of=AS_OF))
+
+    # The lot bought today contributes its simple return of -10%, the two-year one its CAGR
+    two_year_cagr = 1.2 ** (1 / 2) - 1
+    assert result['portfolio_cagr'] == pytest.approx(round((two_year_cagr - 0.1) / 2 * 100, 2), abs=0.01)
+    assert result['total_return'] == pytest.approx(5.0)
+    assert math.isfinite(result['money_weighted_return'])
+
+
+def test_time_weighted_return_ignores_the_timing_of_purchases():
+    dates = pd.bdate_range('2026-01-05', periods=10, name='Date')
+    closes = pd.DataFrame({'T0': [100, 102, 99, 105, 110, 108, 112, 115, 111, 120]}, index=dates, dtype=float)
+    returns = closes.pct_change().iloc[1:]
+    df = pd.DataFrame({
+        'Ticker': ['T0', 'T0'],
+        'Quantity': [10.0, 50.0],
+        'Current Price': 120.0,
+        'Purchase Date': pd.to_datetime(['2025-06-02', '2026-01-12']),
+        'Total Cost': [800.0, 50 * 108.0],
+    })
+
+    # A large purchase halfway through does not change the return of holding the ticker all along
+    assert time_weighted_return(df, closes, returns) == pytest.approx(20.0)
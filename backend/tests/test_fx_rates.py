@@ -0,0 +1,39 @@
+import math
+import pandas as pd
+from benchmarks.fixtures import SyntheticPriceHistoryProvider, synthetic_holdings
+from services.metrics import MetricsStage
+from tools.fx_rates import FxRates
+
+
+class NoPairsProvider(SyntheticPriceHistoryProvider):
+    """Synthetic prices with no FX pair for `missing` currencies"""
+
+    def __init__(self, missing=('EUR', 'JPY')):
+        super().__init__(0)
+        self.missing = missing
+
+    def fetch(self, tickers, start, end):
+        closes = super().fetch(tickers, start, end)
+        return closes.drop(columns=[ticker for ticker in tickers if ticker.endswith('=X') and ticker[:3] in self.missing])
+
+
+def test_base_currency_has_a_rate_without_any_pair():
+    fx = FxRates(NoPairsProvider())
+
+    spot = fx.spot(['USD', 'EUR'], 'USD')
+    assert spot['USD'] == 1.0 and math.isnan(spot['EUR'])
+    assert fx.spot(['USD'], 'USD')['USD'] == 1.0
+    assert (fx.rates(['USD'], 'USD', pd.Timestamp.now() - pd.Timedelta(days=30))['USD'] == 1.0).all()
+
+
+def test_lots_without_a_rate_are_left_out_of_the_metrics(market_data):
+    provider, _ = market_data
+    fx = FxRates(NoPairsProvider(missing=('EUR',)))
+    df = synthetic_holdings(100, tickers=12, provider=provider, seed=1)
+    euro = int((df['Currency'] == 'EUR').sum())
+    metrics = MetricsStage(fx=fx).run(df)
+
+    assert euro and metrics.errors['fx'] == f"no USD rate for EUR: {euro} of 100 lots left out"
+    assert set(metrics.errors) == {'fx'}
+    assert all(math.isfinite(metrics.summary()[name]) for name in ('total_return', 'sharp_ratio', 'sortino_ratio', 'max_drawdown'))
+    assert metrics.positions.lots['Currency'].astype(str).ne('EUR').all()
@@ -0,0 +1,40 @@
+import io
+import pytest
+from services.ingestion import load_holdings, IngestionError
+
+HEADER = "Ticker,Asset Name,Quantity,Purchase Price,Current Price,Purchase Date,Sector,Currency,Dividend Yield,Total Cost\n"
+
+
+def upload(text):
+    return io.BytesIO(text.encode('utf-8-sig'))
+
+
+def test_holdings_are_typed_across_chunks():
+    rows = "AAA,A Inc,10,90,100,2023-01-03,Tech,USD,0.01,900\nBBB,B Inc,\"1,000\",10,11,2024-05-01,Health,eur,,10000\nCCC,,2,110,100,2025-12-01,,,0,220\n"
+    holdings = load_holdings(upload(HEADER + rows), chunk_rows=2)
+
+    assert len(holdings) == 3 and holdings.rejected_rows == 0
+    frame = holdings.frame
+    assert str(frame['Ticker'].dtype) == 'category'
+    assert str(frame['Quantity'].dtype) == 'float64' and str(frame['Dividend Yield'].dtype) == 'float32'
+    assert frame['Quantity'].tolist() == [10, 1000, 2]
+    assert frame['Currency'].tolist() == ['USD', 'EUR', 'USD']
+    # Optional columns get their defaults
+    assert frame.loc[2, 'Asset Name'] == 'CCC' and frame.loc[2, 'Sector'] == 'Unknown'
+
+
+def test_bad_rows_are_dropped_and_reported_by_line():
+    rows = "AAA,A Inc,10,90,100,2023-01-03,Tech,USD,0.01,900\nZZZ,Z Co,abc,1,2,2024-01-01,Tech,USD,0,5\nYYY,Y,1,1,2,01/02/2024,Tech,USD,,5\n,X,1,1,1,2024-01-01,,,,1\n"
+    holdings = load_holdings(upload(HEADER + rows), chunk_rows=3)
+
+    assert holdings.tickers == ['AAA'] and holdings.rejected_rows == 3
+    assert [(error['row'], error['column']) for error in holdings.errors] == [(3, 'Quantity'), (4, 'Purchase Date'), (5, 'Ticker')]
+
+
+@pytest.mark.parametrize('text, message', [
+    ("Ticker,Quantity\nAAA,1\n", 'Missing required columns'),
+    (HEADER + "AAA,A Inc,-1,90,100,2023-01-03,Tech,USD,0,900\n", 'no valid holdings'),
+])
+def test_unusable_uploads_raise(text, message):
+    with pytest.raises(IngestionError, match=message):
+        load_holdings(upload(text))
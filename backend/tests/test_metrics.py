@@ -0,0 +1,9 @@
+import math
+from services.metrics import PortfolioMetrics
+
+
+def test_summary_leaves_out_ratios_that_are_not_finite():
+    ratios = {'Sharpe Ratio': math.nan, 'Sortino Ratio': math.inf, 'Max Drawdown': -0.12, 'Benchmark Outperformance': math.nan}
+    summary = PortfolioMetrics(ratios=ratios).summary()
+
+    assert summary == {'max_drawdown': -0.12}
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+from tools.optimizer import OBJECTIVES, optimize_portfolio, cap_weights
+
+MAX_WEIGHT = 0.2
+
+
+def calm_and_volatile_returns(seed=0, days=300, assets=6):
+    """One asset far calmer than the rest, so equal risk contributions would put most of the value in it"""
+    rng = np.random.default_rng(seed)
+    volatility = np.array([0.001, *np.full(assets - 1, 0.02)])
+    dates = pd.bdate_range(end=pd.Timestamp.now().normalize(), periods=days)
+    return pd.DataFrame(rng.normal(0.0003, volatility, (days, assets)), index=dates, columns=[f'T{i}' for i in range(assets)])
+
+
+def equal_positions(tickers, value=1000.0):
+    return pd.DataFrame({'Ticker': tickers, 'Market Value': value, 'Current Price': 10.0})
+
+
+@pytest.mark.parametrize('objective', OBJECTIVES)
+def test_target_weights_stay_within_the_cap(objective):
+    returns = calm_and_volatile_returns()
+    positions = equal_positions(returns.columns)
+    plan = optimize_portfolio(positions, returns, objective, max_weight=MAX_WEIGHT, max_turnover=0)
+
+    assert plan['max_weight'] == MAX_WEIGHT
+    assert plan['trades']
+    for trade in plan['trades']:
+        assert trade['target_weight'] <= MAX_WEIGHT + 1e-4
+
+
+def test_cap_weights_redistributes_the_excess():
+    weights = cap_weights(np.array([0.7, 0.1, 0.1, 0.05, 0.05]), 0.3)
+
+    assert weights.sum() == pytest.approx(1)
+    assert weights.max() <= 0.3 + 1e-12
+    # The uncapped weights keep their proportions
+    assert weights[1] / weights[3] == pytest.approx(2)
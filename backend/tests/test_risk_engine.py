@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+from tools.risk_engine import RiskEngine
+
+RISK_FREE_RATE = 0.02
+
+
+def legacy_ratios(returns, weights, risk_free_rate=RISK_FREE_RATE):
+    """The per-lot pandas loop calculate_portfolio_ratios used before RiskEngine"""
+    weighted_daily_returns = []
+    weighted_downside_returns = []
+    for column, weight in zip(returns.columns, weights):
+        daily_returns = returns[column].dropna()
+        weighted_daily_returns.append(daily_returns * weight)
+        downside_returns = daily_returns[daily_returns < risk_free_rate / 252]
+        weighted_downside_returns.append(downside_returns * weight)
+
+    portfolio_returns = pd.concat(weighted_daily_returns, axis=1).sum(axis=1)
+    downside_risk = np.sqrt(np.mean(pd.concat(weighted_downside_returns, axis=1).sum(axis=1)**2) * 252)
+    cumulative_returns = (1 + portfolio_returns).cumprod()
+    rolling_max = cumulative_returns.cummax()
+    max_drawdown = ((cumulative_returns - rolling_max) / rolling_max).min()
+    std_dev = portfolio_returns.std() * np.sqrt(252)
+    total_return = (1 + portfolio_returns).prod() - 1
+    return {
+        'Sharpe Ratio': (total_return - risk_free_rate) / std_dev,
+        'Sortino Ratio': (total_return - risk_free_rate) / downside_risk,
+        'Max Drawdown': max_drawdown,
+    }
+
+
+def synthetic_returns(seed, days=252, lots=6):
+    """Daily returns of lots bought on different dates, with a few missing trading days"""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2025-01-02', periods=days)
+    returns = pd.DataFrame(rng.normal(0.0004, 0.015, (days, lots)), index=dates)
+    for lot in range(lots):
+        returns.iloc[:rng.integers(0, days // 2), lot] = np.nan
+        returns.iloc[rng.choice(days, 5, replace=False), lot] = np.nan
+    weights = rng.random(lots)
+    return returns, weights / weights.sum()
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_risk_engine_matches_legacy_loop(seed):
+    returns, weights = synthetic_returns(seed)
+    engine = RiskEngine(returns.to_numpy(), weights, risk_free_rate=RISK_FREE_RATE)
+    legacy = legacy_ratios(returns, weights)
+
+    assert engine.sharpe_ratio() == pytest.approx(legacy['Sharpe Ratio'], rel=1e-9)
+    assert engine.sortino_ratio() == pytest.approx(legacy['Sortino Ratio'], rel=1e-9)
+    assert engine.max_drawdown() == pytest.approx(legacy['Max Drawdown'], rel=1e-9)
+
+
+def test_risk_engine_evaluates_many_portfolios_at_once():
+    returns, weights = synthetic_returns(3)
+    other = np.roll(weights, 1)
+    batch = RiskEngine(returns.to_numpy(), np.column_stack([weights, other]), risk_free_rate=RISK_FREE_RATE)
+    for i, portfolio_weights in enumerate([weights, other]):
+        single = RiskEngine(returns.to_numpy(), portfolio_weights, risk_free_rate=RISK_FREE_RATE)
+        assert batch.sharpe_ratio()[i] == pytest.approx(single.sharpe_ratio())
+        assert batch.max_drawdown()[i] == pytest.approx(single.max_drawdown())
@@ -0,0 +1,34 @@
+import pandas as pd
+from benchmarks.fixtures import synthetic_holdings
+from services.ingestion import CATEGORY_COLUMNS
+from services.metrics import MetricsStage
+from services.snapshots import SnapshotStore, diff_holdings, full_update, incremental_update, next_snapshot
+
+
+def changed_upload(df, provider):
+    """`df` with two lots sold, five repriced and three bought, one of them in a ticker not held before"""
+    new = df.drop(index=[3, 7]).copy()
+    new.loc[new.index[:5], 'Current Price'] *= 1.1
+    bought = synthetic_holdings(3, provider=provider, seed=9)
+    bought['Purchase Date'] = pd.Timestamp.now().normalize() - pd.Timedelta(days=40)
+    bought['Ticker'] = ['NEW', *bought['Ticker'].astype(str)[1:]]
+    new = pd.concat([new, bought], ignore_index=True)
+    for column in CATEGORY_COLUMNS:
+        new[column] = new[column].astype(str).astype('category')
+    return new
+
+
+def test_incremental_update_matches_a_full_run(market_data, tmp_path):
+    provider, fx = market_data
+    df = synthetic_holdings(200, provider=provider, seed=1)
+    store = SnapshotStore(str(tmp_path / 'snapshots.sqlite'))
+    store.put(next_snapshot('acct-1', df, full_update(MetricsStage(fx=fx).run(df)), None, None))
+    snapshot = store.get('acct-1')
+
+    new = changed_upload(df, provider)
+    diff = diff_holdings(snapshot.holdings, new)
+    update = incremental_update(snapshot, new, diff, fx=fx)
+
+    assert diff.summary() == {'kept': 198, 'added': 3, 'removed': 2, 'updated': 5}
+    assert update is not None and update.incremental
+    assert update.metrics.summary() == MetricsStage(fx=fx).run(new).summary()
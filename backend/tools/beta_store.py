@@ -0,0 +1,71 @@
+import os
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from config import BETA_STORE_PATH, BETA_TTL_HOURS
+
+# Tickers per lookup, well below SQLite's limit on bound variables
+MAX_LOOKUP_TICKERS = 500
+
+
+class BetaStore():
+    """SQLite-backed store of regression betas, shared across requests and worker processes."""
+
+    def __init__(self, path, ttl_hours=24):
+        self.path = path
+        self.ttl = ttl_hours * 3600
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS betas (
+                    ticker TEXT NOT NULL,
+                    benchmark TEXT NOT NULL,
+                    beta REAL NOT NULL,
+                    observations INTEGER NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (ticker, benchmark)
+                )
+            """)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get_many(self, tickers, benchmark):
+        """Return {ticker: beta} for every ticker with an entry younger than the TTL."""
+        tickers = list(tickers)
+        betas = {}
+        cutoff = time.time() - self.ttl
+        with self._lock, self._connect() as conn:
+            for start in range(0, len(tickers), MAX_LOOKUP_TICKERS):
+                chunk = tickers[start:start + MAX_LOOKUP_TICKERS]
+                placeholders = ','.join('?' * len(chunk))
+                betas.update(conn.execute(
+                    f"SELECT ticker, beta FROM betas WHERE benchmark = ? AND updated_at >= ? AND ticker IN ({placeholders})",
+                    [benchmark, cutoff, *chunk],
+                ).fetchall())
+        return betas
+
+    def put_many(self, betas, benchmark, observations):
+        now = time.time()
+        rows = [(ticker, benchmark, float(beta), int(observations[ticker]), now) for ticker, beta in betas.items()]
+        with self._lock, self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO betas VALUES (?, ?, ?, ?, ?)", rows)
+
+
+_default_store = None
+
+
+def get_default_beta_store():
+    global _default_store
+    if _default_store is None:
+        _default_store = BetaStore(BETA_STORE_PATH, BETA_TTL_HOURS)
+    return _default_store
@@ -1,39 +1,187 @@
-import io
 import json
 import pandas as pd
 import numpy as np
-from datetime import datetime
-from langchain.tools import tool
-
-def calculate_portfolio(df: pd.DataFrame):
-    df['Return'] = (df['Current Price'] / df['Purchase Price'] - 1) * 100
-    total_value = (df['Quantity'] * df['Current Price']).sum()
-    total_cost = df['Total Cost'].sum()
-    total_return = (total_value - total_cost) / total_cost * 100
-        
-    best_performer = df.loc[df['Return'].idxmax()]
-    worst_performer = df.loc[df['Return'].idxmin()]
-    
-    current_date = pd.Timestamp.now().floor('D')  
-    df['Years'] = (current_date - pd.to_datetime(df['Purchase Date'])).dt.days / 365
-    weighted_cagr = np.sum(
-        ((df['Current Price'] / df['Purchase Price']) ** (1 / df['Years']) - 1) * 
-        (df['Total Cost'] / total_cost)
-    )
-    portfolio_cagr = weighted_cagr * 100  
-        
-    analysis = {
-        "total_value": float(round(total_value, 2)),  
-        "total_cost": float(round(total_cost, 2)),    
-        "total_return": float(round(total_return, 1)),
-        "portfolio_cagr": float(round(portfolio_cagr, 2)),  
+
+# Returns over less than a year are reported as they are rather than annualized,
+# so a lot bought yesterday (or today) cannot blow up the CAGR
+MIN_ANNUALIZED_YEARS = 1.0
+DAYS_PER_YEAR = 365
+
+def holding_years(purchase_dates, as_of=None):
+    """Years from each purchase date to `as_of` (today by default), never negative"""
+    as_of = pd.Timestamp(as_of or pd.Timestamp.now()).floor('D')
+    days = (as_of.to_datetime64().astype('datetime64[D]') - pd.to_datetime(purchase_dates).to_numpy().astype('datetime64[D]')).astype(float)
+    return np.clip(days, 0, None) / DAYS_PER_YEAR
+
+def annualized_returns(growth, years):
+    # growth is end value / start value per lot
+    with np.errstate(divide='ignore', invalid='ignore'):
+        annualized = growth ** (1 / np.maximum(years, MIN_ANNUALIZED_YEARS)) - 1
+    return np.where(years >= MIN_ANNUALIZED_YEARS, annualized, growth - 1)
+
+def xirr(amounts, years, tolerance=1e-10, max_iterations=100):
+    """
+    Annualized money-weighted return of cash flows `amounts` made `years` before the valuation date
+    (negative for money invested, positive for the value received), i.e. the r that makes
+    sum(amounts * (1 + r) ** years) zero. Newton steps on log(1 + r),
+    each one a single vectorized pass over all flows, kept inside a bisection bracket.
+    Returns NaN when the flows do not define a rate.
+    """
+    amounts = np.asarray(amounts, dtype=float)
+    years = np.asarray(years, dtype=float)
+    if not (amounts > 0).any() or not (amounts < 0).any() or not (years > 0).any():
+        return float('nan')
+
+    def npv(g):
+        discounted = amounts * np.exp(g * years)
+        return discounted.sum(), (discounted * years).sum()
+
+    low, high = -10.0, 10.0
+    g = 0.0
+    for _ in range(max_iterations):
+        value, slope = npv(g)
+        if abs(value) < tolerance * np.abs(amounts).sum():
+            return float(np.expm1(g))
+        # The flows compounded to the valuation date fall as the rate rises
+        if value > 0:
+            low = g
+        else:
+            high = g
+        step = g - value / slope if slope != 0 else np.nan
+        g = step if low < step < high else (low + high) / 2
+    return float(np.expm1(g)) if low > -10.0 and high < 10.0 else float('nan')
+
+def portfolio_performance(quantity, purchase_price, current_price, total_cost, years):
+    """Performance figures from preconverted per-lot arrays; nothing is mutated"""
+    value = quantity * current_price
+    total_value = value.sum()
+    total_cost_sum = total_cost.sum()
+    lot_returns = current_price / purchase_price - 1
+
+    # Lots held for less than a year contribute their simple return
+    cagr = np.sum(annualized_returns(current_price / purchase_price, years) * (total_cost / total_cost_sum))
+
+    # Money-weighted: every lot's cost is an outflow on its purchase date, the current value an inflow today
+    money_weighted = xirr(np.append(total_value, -total_cost), np.append(0.0, years))
+
+    return {
+        'total_value': float(total_value),
+        'total_cost': float(total_cost_sum),
+        'total_return': float((total_value - total_cost_sum) / total_cost_sum * 100),
+        'portfolio_cagr': float(cagr * 100),
+        'money_weighted_return': float(money_weighted * 100),
+        'lot_returns': lot_returns,
+    }
+
+def performance_components(df, as_of=None):
+    """
+    Additive sums behind portfolio_performance, with the cost flows bucketed by holding days.
+    Lots can be added (sign=1) or removed (sign=-1) with combine_performance, no pass over the rest.
+    """
+    days = np.round(holding_years(df['Purchase Date'], as_of) * DAYS_PER_YEAR).astype(int)
+    current_price = df['Current Price'].to_numpy(dtype=float)
+    total_cost = df['Total Cost'].to_numpy(dtype=float)
+    growth = annualized_returns(current_price / df['Purchase Price'].to_numpy(dtype=float), days / DAYS_PER_YEAR)
+    flows = pd.Series(total_cost).groupby(days).sum()
+    return {
+        'total_value': float((df['Quantity'].to_numpy(dtype=float) * current_price).sum()),
+        'total_cost': float(total_cost.sum()),
+        'weighted_growth': float((growth * total_cost).sum()),
+        'flows': {int(day): float(amount) for day, amount in flows.items()},
+    }
+
+def combine_performance(components, other, sign=1):
+    flows = dict(components['flows'])
+    for day, amount in other['flows'].items():
+        flows[day] = flows.get(day, 0.0) + sign * amount
+    return {
+        'total_value': components['total_value'] + sign * other['total_value'],
+        'total_cost': components['total_cost'] + sign * other['total_cost'],
+        'weighted_growth': components['weighted_growth'] + sign * other['weighted_growth'],
+        # Buckets emptied by removals are dropped, not left as rounding noise
+        'flows': {day: amount for day, amount in flows.items() if abs(amount) > 1e-9 * max(1.0, abs(components['total_cost']))},
+    }
+
+def performance_from_components(components):
+    """The portfolio_performance figures from performance_components"""
+    total_value, total_cost = components['total_value'], components['total_cost']
+    days = np.array(list(components['flows']), dtype=float)
+    amounts = np.array(list(components['flows'].values()), dtype=float)
+    money_weighted = xirr(np.append(total_value, -amounts), np.append(0.0, days / DAYS_PER_YEAR))
+    return {
+        'total_value': float(total_value),
+        'total_cost': float(total_cost),
+        'total_return': float((total_value - total_cost) / total_cost * 100),
+        'portfolio_cagr': float(components['weighted_growth'] / total_cost * 100),
+        'money_weighted_return': float(money_weighted * 100),
+    }
+
+def performance_analysis(performance, df):
+    """The calculate_portfolio result from portfolio_performance figures and the lots they cover"""
+    lot_returns = performance.get('lot_returns')
+    if lot_returns is None:
+        lot_returns = df['Current Price'].to_numpy(dtype=float) / df['Purchase Price'].to_numpy(dtype=float) - 1
+    best_performer = df.iloc[int(np.nanargmax(lot_returns))]
+    worst_performer = df.iloc[int(np.nanargmin(lot_returns))]
+
+    return {
+        "total_value": float(round(performance['total_value'], 2)),
+        "total_cost": float(round(performance['total_cost'], 2)),
+        "total_return": float(round(performance['total_return'], 1)),
+        "portfolio_cagr": float(round(performance['portfolio_cagr'], 2)),
+        "money_weighted_return": None if np.isnan(performance['money_weighted_return']) else float(round(performance['money_weighted_return'], 2)),
         "best_performer": {
-            "Ticker": str(best_performer['Ticker']),  
-            "Asset Name": str(best_performer['Asset Name'])  
+            "Ticker": str(best_performer['Ticker']),
+            "Asset Name": str(best_performer['Asset Name'])
         },
         "worst_performer": {
-            "Ticker": str(worst_performer['Ticker']),  
-            "Asset Name": str(worst_performer['Asset Name'])  
+            "Ticker": str(worst_performer['Ticker']),
+            "Asset Name": str(worst_performer['Asset Name'])
         }
     }
-    return json.dumps(analysis)
\ No newline at end of file
+
+def calculate_portfolio(df: pd.DataFrame, as_of=None):
+    years = holding_years(df['Purchase Date'], as_of)
+    performance = portfolio_performance(
+        df['Quantity'].to_numpy(dtype=float),
+        df['Purchase Price'].to_numpy(dtype=float),
+        df['Current Price'].to_numpy(dtype=float),
+        df['Total Cost'].to_numpy(dtype=float),
+        years,
+    )
+    return json.dumps(performance_analysis(performance, df))
+
+def time_weighted_return(df, closes, returns):
+    """
+    Time-weighted return (in percent) over the window of `closes`, chain-linking daily portfolio
+    returns so the size and timing of purchases do not affect it. `returns` are the base-currency
+    daily returns of the same closes (see calculate_ratio.load_portfolio_returns).
+
+    Each ticker's value follows its growth index G: V_t = G_t * cumsum(flow_t / G_t). Lots bought
+    before the window enter on its first day at their value then, backed out of today's value.
+    """
+    dates = closes.index.to_numpy()
+    tickers, codes = np.unique(df['Ticker'].astype(str).to_numpy(), return_inverse=True)
+    daily = returns.reindex(index=closes.index[1:], columns=tickers).to_numpy(dtype=float)
+    growth = np.cumprod(1 + np.vstack([np.zeros((1, len(tickers))), np.nan_to_num(daily)]), axis=0)
+
+    purchase_dates = pd.to_datetime(df['Purchase Date']).to_numpy()
+    first_close = np.searchsorted(dates, purchase_dates)
+    inside = first_close > 0
+    # Lots purchased after the last close have not been valued yet
+    counted = first_close < len(dates)
+    current_value = (df['Quantity'] * df['Current Price']).to_numpy(dtype=float)
+    flow = np.where(inside, df['Total Cost'].to_numpy(dtype=float), current_value / growth[-1, codes])
+
+    flows = np.zeros((len(dates), len(tickers)))
+    np.add.at(flows, (first_close[counted], codes[counted]), flow[counted])
+    values = growth * np.cumsum(flows / growth, axis=0)
+
+    portfolio_value = values.sum(axis=1)
+    portfolio_flow = flows.sum(axis=1)
+    previous = np.append(0.0, portfolio_value[:-1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        daily_returns = np.where(previous > 0, (portfolio_value - portfolio_flow) / previous - 1, 0.0)
+    if not np.isfinite(daily_returns).all() or not (portfolio_value > 0).any():
+        return None
+    return float(round((np.prod(1 + daily_returns) - 1) * 100, 2))
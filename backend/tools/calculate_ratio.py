@@ -1,63 +1,133 @@
 import pandas as pd
 import numpy as np
-import yfinance as yf
 from datetime import datetime, timedelta
+from tools.price_history import get_default_provider, returns_matrix
+from tools.risk_engine import RiskEngine
+from tools.fx_rates import get_default_fx_rates
+from config import BETA_BENCHMARK, BENCHMARK_CURRENCY, BASE_CURRENCY
 
-def calculate_portfolio_ratios(df, risk_free_rate=0.02):
-    def get_yahoo_data(ticker, start_date):
-        end_date = datetime.now().date()
-        return yf.Ticker(ticker).history(start=start_date, end=end_date)
-    
-    # Calculate the total portfolio value
-    total_portfolio_value = df['Total Cost'].sum()
-    
-    weighted_daily_returns = []
-    weighted_downside_returns = []
-    weighted_drawdowns = []
-    
-    for _, row in df.iterrows():
-        # Set the start date to either the purchase date or one year ago, whichever is more recent
-        start_date = max(datetime.strptime(row['Purchase Date'], '%Y-%m-%d').date(), datetime.now().date() - timedelta(days=365))
-        data = get_yahoo_data(row['Ticker'], start_date)
-        
-        daily_returns = data['Close'].pct_change().dropna()
-        weight = row['Total Cost'] / total_portfolio_value
-        
-        # Weighted returns
-        weighted_daily_returns.append(daily_returns * weight)
-        
-        # Calculate downside returns (returns lower than the risk-free rate)
-        downside_returns = daily_returns[daily_returns < risk_free_rate / 252]
-        weighted_downside_returns.append(downside_returns * weight)
-        
-        # Calculate drawdowns
-        cumulative_returns = (1 + daily_returns).cumprod()
-        rolling_max = cumulative_returns.cummax()
-        drawdowns = (cumulative_returns - rolling_max) / rolling_max
-        weighted_drawdowns.append(drawdowns * weight)
-
-    # Sum the weighted returns, downside risk, and drawdowns for the entire portfolio
-    portfolio_returns = pd.concat(weighted_daily_returns, axis=1).sum(axis=1)
-    downside_risk = np.sqrt(np.mean(pd.concat(weighted_downside_returns, axis=1).sum(axis=1)**2) * 252)
-    cumulative_returns = (1 + portfolio_returns).cumprod()
-    rolling_max = cumulative_returns.cummax()
-    drawdowns = (cumulative_returns - rolling_max) / rolling_max
-    max_drawdown = drawdowns.min()
-    
-    # Standard deviation (volatility)
-    std_dev = portfolio_returns.std() * np.sqrt(252)
-    
-    # Annualized return
-    total_return = (1 + portfolio_returns).prod() - 1
-    annualized_return = (1 + total_return) ** (1/1) - 1  # Period is 1 year
-    
-    # Calculate Sharpe ratio and Sortino ratio
-    sharpe_ratio = (annualized_return - risk_free_rate) / std_dev
-    sortino_ratio = (annualized_return - risk_free_rate) / downside_risk
-    
-    # Return the result
-    return {
-        'Sharpe Ratio': float(round(sharpe_ratio, 2)),
-        'Sortino Ratio': float(round(sortino_ratio, 2)),
-        'Max Drawdown': float(round(max_drawdown, 2))
-    }
\ No newline at end of file
+def lot_start_dates(df, today=None):
+    # Set the start date of each lot to either the purchase date or one year ago, whichever is more recent
+    today = today or datetime.now().date()
+    return pd.to_datetime(df['Purchase Date']).clip(lower=pd.Timestamp(today - timedelta(days=365)))
+
+def load_returns(currencies, start, provider=None, base_currency=BASE_CURRENCY, fx=None, end=None):
+    """Closes and base-currency daily returns of {ticker: listing currency} from `start`, from one bulk request"""
+    provider = provider or get_default_provider()
+    closes = provider.get_close_prices(list(currencies), start, end or datetime.now().date())
+    returns = returns_matrix(closes)
+
+    # Holdings listed in other currencies earn their FX move on top of the local return
+    if set(currencies.values()) != {base_currency}:
+        returns = (fx or get_default_fx_rates()).convert_returns(returns, currencies, base_currency)
+    return closes, returns
+
+def load_portfolio_returns(df, provider=None, benchmark=BETA_BENCHMARK, base_currency=BASE_CURRENCY, fx=None):
+    """Closes and base-currency daily returns of every ticker plus the benchmark, from one bulk request"""
+    if 'Currency' in df:
+        currencies = df.groupby('Ticker', observed=True, sort=False)['Currency'].first().astype(str).to_dict()
+    else:
+        currencies = {ticker: base_currency for ticker in df['Ticker'].unique()}
+    currencies[benchmark] = BENCHMARK_CURRENCY if 'Currency' in df else base_currency
+    # One bulk request for every ticker, aligned on a shared calendar
+    return load_returns(currencies, lot_start_dates(df).min(), provider, base_currency, fx)
+
+def slice_market(market, df, benchmark=BETA_BENCHMARK):
+    """
+    The part of a wider (closes, returns) pair that load_portfolio_returns would have loaded for
+    `df` alone: its own tickers and the benchmark, from its own first start date
+    """
+    closes, returns = market
+    columns = [*dict.fromkeys([*df['Ticker'].astype(str), benchmark])]
+    start = lot_start_dates(df).min()
+    closes = closes.loc[closes.index >= start, closes.columns.intersection(columns)].dropna(how='all')
+    if closes.empty:
+        return closes, returns.iloc[:0]
+    return closes, returns.loc[returns.index > closes.index[0], returns.columns.intersection(columns)].reindex(closes.index[1:])
+
+def _held_returns(df, closes, returns):
+    # Build the dates x lots matrix, hiding returns from before each lot's first close
+    start_dates = lot_start_dates(df)
+    lot_returns = returns.reindex(columns=df['Ticker']).to_numpy()
+    first_close = np.searchsorted(closes.index.to_numpy(), start_dates.to_numpy())
+    held = np.arange(1, len(closes))[:, None] > first_close[None, :]
+    return np.where(held, lot_returns, np.nan)
+
+def _ratios(engine, benchmark_returns):
+    """Ratio dicts of every portfolio in `engine`, one per weights column"""
+    sharpe_ratio = np.atleast_1d(engine.sharpe_ratio())
+    sortino_ratio = np.atleast_1d(engine.sortino_ratio())
+    max_drawdown = np.atleast_1d(engine.max_drawdown())
+
+    # Outperformance of the benchmark over the dates each portfolio had returns, in percentage points
+    active = engine.active & np.isfinite(benchmark_returns)[:, None]
+    growth = np.prod(np.where(active, 1 + np.nan_to_num(benchmark_returns)[:, None], 1.0), axis=0)
+    benchmark_return = np.where(active.any(axis=0), growth - 1, np.nan)
+    benchmark_outperformance = (np.atleast_1d(engine.total_return()) - benchmark_return) * 100
+
+    return [
+        {
+            'Sharpe Ratio': float(round(sharpe, 2)),
+            'Sortino Ratio': float(round(sortino, 2)),
+            'Max Drawdown': float(round(drawdown, 2)),
+            'Benchmark Outperformance': float(round(outperformance, 2))
+        }
+        for sharpe, sortino, drawdown, outperformance in zip(sharpe_ratio, sortino_ratio, max_drawdown, benchmark_outperformance)
+    ]
+
+def calculate_portfolio_ratios(df, risk_free_rate=0.02, provider=None, benchmark=BETA_BENCHMARK, base_currency=BASE_CURRENCY, fx=None, market=None):
+    # `market` is the (closes, returns) pair from load_portfolio_returns when the caller already has it
+    closes, returns = market or load_portfolio_returns(df, provider, benchmark, base_currency, fx)
+
+    # Calculate the weight of each lot in the total portfolio value
+    weights = (df['Total Cost'] / df['Total Cost'].sum()).to_numpy()
+
+    # Volatility, downside risk and drawdowns for the whole portfolio in vectorized passes
+    engine = RiskEngine(_held_returns(df, closes, returns), weights, risk_free_rate=risk_free_rate)
+    return _ratios(engine, returns[benchmark].to_numpy())[0]
+
+def calculate_account_ratios(df, accounts, risk_free_rate=0.02, provider=None, benchmark=BETA_BENCHMARK, base_currency=BASE_CURRENCY, fx=None, market=None):
+    """
+    Ratios of many accounts whose lots are stacked in `df`, with `accounts` the integer account
+    code of each lot. Every account is a column of one lots x accounts weight matrix, so all of
+    them are evaluated over the same returns in a single RiskEngine pass.
+    """
+    closes, returns = market or load_portfolio_returns(df, provider, benchmark, base_currency, fx)
+    accounts = np.asarray(accounts)
+    n_accounts = int(accounts.max()) + 1 if len(accounts) else 0
+
+    # Each lot is weighted within its own account
+    cost = df['Total Cost'].to_numpy(dtype=float)
+    account_cost = np.bincount(accounts, weights=cost, minlength=n_accounts)
+    weights = np.zeros((len(df), n_accounts))
+    weights[np.arange(len(df)), accounts] = cost / account_cost[accounts]
+
+    engine = RiskEngine(_held_returns(df, closes, returns), weights, risk_free_rate=risk_free_rate)
+    return _ratios(engine, returns[benchmark].to_numpy())
+
+def ratio_components(df, closes, returns, risk_free_rate=0.02, periods_per_year=252):
+    """
+    Cost-weighted daily sums the ratios are built from. They are additive over lots, so the
+    components of a changed portfolio are the old ones plus those of the added lots minus those
+    of the removed lots, with no pass over the lots that stayed.
+    """
+    lot_returns = _held_returns(df, closes, returns)
+    cost = df['Total Cost'].to_numpy(dtype=float)
+    below = lot_returns < risk_free_rate / periods_per_year
+    return pd.DataFrame({
+        'Weighted Return': np.nan_to_num(lot_returns) @ cost,
+        'Weighted Downside': np.where(below, lot_returns, 0.0) @ cost,
+        'Held': (~np.isnan(lot_returns)).sum(axis=1),
+        'Held Downside': below.sum(axis=1),
+    }, index=returns.index)
+
+def ratios_from_components(components, total_cost, benchmark_returns, risk_free_rate=0.02):
+    """The calculate_portfolio_ratios figures of a portfolio with `components` and `total_cost`"""
+    engine = RiskEngine.from_components(
+        components['Weighted Return'].to_numpy() / total_cost,
+        components['Held'].to_numpy() > 0,
+        components['Weighted Downside'].to_numpy() / total_cost,
+        components['Held Downside'].to_numpy() > 0,
+        risk_free_rate=risk_free_rate,
+    )
+    return _ratios(engine, np.asarray(benchmark_returns, dtype=float))[0]
@@ -1,23 +1,83 @@
+import numpy as np
 import pandas as pd
-import yfinance as yf
-
-def calculate_portfolio_beta(df: pd.DataFrame):
-    betas = []
-    for ticker in df['Ticker']:
-        stock = yf.Ticker(ticker)
-        beta = stock.info.get('beta')
-        if beta is None:
-            beta = 1.0 
-        betas.append(beta)
-    
-    df['Beta'] = betas
-    
-    df['Market Value'] = df['Current Price'] * df['Quantity']
-    
-    total_market_value = df['Market Value'].sum()
-    
-    df['Weight'] = df['Market Value'] / total_market_value
-    
-    portfolio_beta = (df['Beta'] * df['Weight']).sum()
-    
-    return portfolio_beta, df[['Ticker', 'Beta', 'Weight', 'Market Value']]
+from datetime import datetime, timedelta
+from config import BETA_BENCHMARK, BETA_LOOKBACK_DAYS, BENCHMARK_CURRENCY, BASE_CURRENCY
+from tools.beta_store import get_default_beta_store
+from tools.calculate_ratio import load_returns
+from tools.risk_engine import regression_betas
+from services.telemetry import telemetry
+
+MIN_OBSERVATIONS = 20
+
+def estimate_betas(tickers, benchmark=BETA_BENCHMARK, provider=None, lookback_days=BETA_LOOKBACK_DAYS, currencies=None, base_currency=BASE_CURRENCY, fx=None):
+    """
+    Regress every ticker's daily returns against the benchmark in one pass.
+    Both sides are base-currency returns, as in the ratios and tail risk; `currencies`
+    maps tickers to their listing currency, and tickers without one are taken as base.
+    Returns ({ticker: beta}, {ticker: observations}); tickers without enough
+    overlapping history are left out.
+    """
+    tickers = [ticker for ticker in dict.fromkeys(tickers) if ticker != benchmark]
+    listing = {ticker: (currencies or {}).get(ticker, base_currency) for ticker in tickers}
+    listing[benchmark] = BENCHMARK_CURRENCY if currencies else base_currency
+    today = datetime.now().date()
+    _, returns = load_returns(listing, today - timedelta(days=lookback_days), provider, base_currency, fx, end=today)
+
+    asset_returns = returns[tickers].to_numpy()
+    benchmark_returns = returns[benchmark].to_numpy()
+    betas = regression_betas(asset_returns, benchmark_returns)
+    observations = (~np.isnan(asset_returns) & ~np.isnan(benchmark_returns)[:, None]).sum(axis=0)
+
+    estimated = {}
+    counts = {}
+    for ticker, beta, count in zip(tickers, betas, observations):
+        if count >= MIN_OBSERVATIONS and np.isfinite(beta):
+            estimated[ticker] = float(beta)
+            counts[ticker] = int(count)
+    return estimated, counts
+
+def calculate_portfolio_beta(df: pd.DataFrame, benchmark=BETA_BENCHMARK, provider=None, store=None, base_currency=BASE_CURRENCY, fx=None):
+    store = store or get_default_beta_store()
+    tickers = list(df['Ticker'].unique())
+    currencies = df.groupby('Ticker', observed=True, sort=False)['Currency'].first().astype(str).to_dict() if 'Currency' in df else None
+    # Betas of base-currency returns differ by base currency, so each base has its own entries
+    store_key = f"{benchmark}/{base_currency}"
+
+    # Reuse betas computed by earlier requests, and regress only the rest
+    betas = store.get_many(tickers, store_key)
+    stale = [ticker for ticker in tickers if ticker not in betas]
+    if benchmark in stale:
+        betas[benchmark] = 1.0
+        stale.remove(benchmark)
+    telemetry.record_cache('betas', hit=True, count=len(tickers) - len(stale))
+    telemetry.record_cache('betas', hit=False, count=len(stale))
+    if stale:
+        estimated, observations = estimate_betas(stale, benchmark, provider, currencies=currencies, base_currency=base_currency, fx=fx)
+        store.put_many(estimated, store_key, observations)
+        betas.update(estimated)
+
+    return portfolio_beta_table(df, betas)
+
+def portfolio_beta_table(df, betas):
+    """Portfolio beta and per-ticker table from known {ticker: beta}; tickers without one are returned as missing"""
+    tickers = list(df['Ticker'].unique())
+    # Tickers without enough price history keep a NaN beta and are reported, not defaulted
+    missing = [ticker for ticker in tickers if ticker not in betas]
+
+    result = df[['Ticker']].copy()
+    result['Beta'] = df['Ticker'].map(betas).astype(float)
+    result['Market Value'] = df['Current Price'] * df['Quantity']
+
+    total_market_value = result['Market Value'].sum()
+
+    result['Weight'] = result['Market Value'] / total_market_value
+
+    # Portfolio beta over the holdings that have one, re-weighted to their share of the portfolio;
+    # None when no holding has one
+    covered = result['Beta'].notna()
+    covered_weight = result.loc[covered, 'Weight'].sum()
+    portfolio_beta = None
+    if covered_weight > 0:
+        portfolio_beta = (result.loc[covered, 'Beta'] * result.loc[covered, 'Weight']).sum() / covered_weight
+
+    return portfolio_beta, result[['Ticker', 'Beta', 'Weight', 'Market Value']], missing
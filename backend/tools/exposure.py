@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+from config import HOLDINGS_SUMMARY_TOP_N
+
+
+def calculate_exposures(positions: pd.DataFrame, returns=None, top_n=HOLDINGS_SUMMARY_TOP_N, periods_per_year=252):
+    """
+    Sector weights, contribution to return and risk, and concentration for one position per ticker.
+    `returns` is the dates x tickers returns frame already loaded for the ratios; without it
+    only the holdings-based figures are filled in.
+
+    Risk is split by sector through the sector sub-portfolios: with S[:, k] the weighted return
+    of sector k, the portfolio variance is the sum of cov(S), and sector k contributes its row.
+    """
+    market_value = positions['Market Value'].to_numpy(dtype=float)
+    cost = positions['Total Cost'].to_numpy(dtype=float)
+    weights = market_value / market_value.sum()
+
+    sector_labels = positions['Sector'].astype(str) if 'Sector' in positions else pd.Series('Unknown', index=positions.index)
+    codes, sectors = pd.factorize(sector_labels)
+    k = len(sectors)
+
+    sector_weights = np.bincount(codes, weights, minlength=k)
+    # Percentage points of the portfolio's total return, so sectors add up to total_return
+    return_contribution = np.bincount(codes, market_value - cost, minlength=k) / cost.sum() * 100
+    sector_positions = np.bincount(codes, minlength=k)
+
+    sorted_weights = np.sort(weights)[::-1]
+    hhi = float(np.sum(weights ** 2))
+    concentration = {
+        'hhi': round(hhi, 4),
+        'effective_positions': round(1 / hhi, 1) if hhi else None,
+        'top_n': int(min(top_n, len(weights))),
+        'top_n_share': round(float(sorted_weights[:top_n].sum()), 4),
+        'sector_hhi': round(float(np.sum(sector_weights ** 2)), 4),
+    }
+
+    risk_contribution = np.full(k, np.nan)
+    sector_volatility = np.full(k, np.nan)
+    covariance = None
+    portfolio_volatility = None
+    if returns is not None and len(returns) > 1:
+        # Weighted returns folded into sectors with one matrix product: dates x tickers @ tickers x sectors
+        asset_returns = returns.reindex(columns=positions['Ticker']).to_numpy(dtype=float)
+        asset_returns = asset_returns[~np.isnan(asset_returns).all(axis=1)]
+        membership = np.zeros((len(weights), k))
+        membership[np.arange(len(weights)), codes] = weights
+        sector_returns = np.nan_to_num(asset_returns) @ membership
+
+        if len(sector_returns) > 1:
+            covariance = np.atleast_2d(np.cov(sector_returns, rowvar=False)) * periods_per_year
+            variance = covariance.sum()
+            if variance > 0:
+                risk_contribution = covariance.sum(axis=1) / variance
+                portfolio_volatility = float(np.sqrt(variance))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                sector_volatility = np.sqrt(np.diag(covariance)) / sector_weights
+
+    def _round(value, digits=4):
+        return None if not np.isfinite(value) else round(float(value), digits)
+
+    breakdown = [
+        {
+            'sector': str(sector),
+            'positions': int(sector_positions[i]),
+            'weight': _round(sector_weights[i]),
+            'return_contribution': _round(return_contribution[i], 2),
+            'risk_contribution': _round(risk_contribution[i]),
+            'volatility': _round(sector_volatility[i]),
+        }
+        for i, sector in enumerate(sectors)
+    ]
+    breakdown.sort(key=lambda row: row['weight'] or 0, reverse=True)
+
+    return {
+        'sectors': breakdown,
+        'concentration': concentration,
+        'portfolio_volatility': None if portfolio_volatility is None else round(portfolio_volatility, 4),
+        'sector_covariance': None if covariance is None else {
+            str(sector): {str(other): round(float(covariance[i, j]), 6) for j, other in enumerate(sectors)}
+            for i, sector in enumerate(sectors)
+        },
+    }
@@ -0,0 +1,181 @@
+import threading
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from datetime import date, timedelta
+from config import BASE_CURRENCY, FX_PROVIDER, FX_DATA_DIR, FX_CACHE_DIR, FX_LOOKUP_CACHE_SIZE
+from tools.price_history import (
+    CachedPriceHistoryProvider,
+    FilePriceHistoryProvider,
+    YahooPriceHistoryProvider,
+)
+
+# Every rate is stored against one pivot currency and crossed from there
+PIVOT_CURRENCY = 'USD'
+# How far back to look for the latest rate when markets were closed
+SPOT_LOOKBACK_DAYS = 10
+
+
+def pair_ticker(currency, pivot=PIVOT_CURRENCY):
+    """Yahoo-style pair whose close is the price of one `currency` in `pivot`, e.g. EURUSD=X"""
+    return f"{currency}{pivot}=X"
+
+
+class FxRates():
+    """
+    Daily FX rates from a price history provider (pair tickers, cached on disk like prices),
+    with an in-process LRU of recent lookups so repeated requests do not touch the store.
+    """
+
+    def __init__(self, provider, pivot=PIVOT_CURRENCY, max_entries=FX_LOOKUP_CACHE_SIZE, live=None):
+        self.provider = provider
+        # Today's rate is still moving, so it is read from `live` (uncached) and never stored
+        self.live = live
+        self.pivot = pivot
+        self.max_entries = max_entries
+        self._lookups = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _pivot_rates(self, currencies, start, end):
+        # Price of one unit of each currency in the pivot currency, dates x currencies
+        currencies = tuple(sorted(set(currencies)))
+        key = (currencies, pd.Timestamp(start).date(), pd.Timestamp(end).date())
+        with self._lock:
+            if key in self._lookups:
+                self._lookups.move_to_end(key)
+                return self._lookups[key]
+
+        rates = self._fetch_pivot_rates(self.provider, currencies, key[1], key[2])
+        with self._lock:
+            self._lookups[key] = rates
+            while len(self._lookups) > self.max_entries:
+                self._lookups.popitem(last=False)
+        return rates
+
+    def _fetch_pivot_rates(self, provider, currencies, start, end):
+        others = [currency for currency in currencies if currency != self.pivot]
+        # Every requested day is a row, so the pivot has its rate of 1 even when no pair traded
+        days = pd.date_range(start, pd.Timestamp(end) - timedelta(days=1), freq='D', name='Date')
+        if others:
+            closes = provider.get_close_prices([pair_ticker(currency, self.pivot) for currency in others], start, end)
+            rates = closes.rename(columns={pair_ticker(currency, self.pivot): currency for currency in others})
+            rates = rates.reindex(pd.DatetimeIndex(rates.index).union(days))
+        else:
+            rates = pd.DataFrame(index=days)
+        if self.pivot in currencies:
+            rates[self.pivot] = 1.0
+        return rates.reindex(columns=list(currencies)).ffill()
+
+    def _cross(self, pivot_rates, currencies, base):
+        # Units of `base` per unit of each currency; `base` itself is 1 whether or not its own pair has a rate
+        rates = pivot_rates[currencies].div(pivot_rates[base], axis=0)
+        if base in currencies:
+            rates[base] = 1.0
+        return rates
+
+    def rates(self, currencies, base, start, end=None):
+        """Units of `base` per unit of each currency on every day in [start, end); `end` defaults to today"""
+        end = end or date.today()
+        pivot_rates = self._pivot_rates([*currencies, base], start, end)
+        return self._cross(pivot_rates, list(dict.fromkeys(currencies)), base)
+
+    def spot(self, currencies, base, as_of=None):
+        """Latest known rate per currency as a Series; NaN where no rate is available"""
+        today = date.today()
+        as_of = pd.Timestamp(as_of or today).date()
+        currencies = list(dict.fromkeys(currencies))
+        # Closed days come from the cache; today's rate, if any yet, is looked up live
+        rates = self.rates(currencies, base, as_of - timedelta(days=SPOT_LOOKBACK_DAYS), min(as_of + timedelta(days=1), today))
+        if as_of >= today and self.live is not None:
+            try:
+                live = self._fetch_pivot_rates(self.live, tuple(sorted({*currencies, base})), today, today + timedelta(days=1))
+                rates = pd.concat([rates, self._cross(live, currencies, base)])
+            except Exception:
+                pass
+        return rates.ffill().iloc[-1] if len(rates) else pd.Series(np.nan, index=currencies)
+
+    def convert(self, amounts, currencies, base, dates=None):
+        """
+        Convert amounts quoted in `currencies` to `base` in one vectorized pass.
+        Without `dates` every amount uses the spot rate, otherwise the rate on (or just before) its date.
+        """
+        amounts = np.asarray(amounts, dtype=float)
+        currencies = pd.Categorical(np.asarray(currencies, dtype=object))
+        codes = currencies.codes
+        unique = list(currencies.categories)
+        if not unique:
+            return amounts.copy()
+
+        if dates is None:
+            rates = self.spot(unique, base).reindex(unique).to_numpy()
+            return amounts * rates[codes]
+
+        dates = pd.to_datetime(pd.Series(dates)).dt.normalize()
+        history = self.rates(unique, base, dates.min() - timedelta(days=SPOT_LOOKBACK_DAYS))
+        # Rates as of each date: the last close on or before it, or the first one after for dates before the history
+        on_date = history.reindex(history.index.union(pd.DatetimeIndex(dates.unique()))).ffill().bfill().reindex(dates).to_numpy()
+        return amounts * on_date[np.arange(len(amounts)), codes]
+
+    def convert_returns(self, returns, currencies, base):
+        """
+        Turn local-currency daily returns (dates x tickers) into `base` returns:
+        (1 + local) * (1 + fx) - 1, where fx is the daily return of each ticker's currency.
+        """
+        currencies = pd.Series(currencies).reindex(returns.columns)
+        foreign = sorted(set(currencies.dropna()) - {base})
+        if not foreign or returns.empty:
+            return returns
+        start = returns.index.min() - timedelta(days=SPOT_LOOKBACK_DAYS)
+        history = self.rates(foreign, base, start, returns.index.max() + timedelta(days=1))
+        fx_returns = history.reindex(history.index.union(returns.index)).ffill().pct_change(fill_method=None).reindex(returns.index)
+        fx_returns[base] = 0.0
+        aligned = fx_returns.reindex(columns=currencies.fillna(base).to_numpy()).to_numpy()
+        return (1 + returns) * (1 + aligned) - 1
+
+
+def convert_holdings(df, base=BASE_CURRENCY, fx=None):
+    """
+    Copy of lot-level holdings with Purchase Price and Total Cost converted at the
+    purchase date rate and Current Price at spot, so values can be summed across currencies.
+    Currency keeps each holding's listing currency; FX Rate is the spot rate used.
+    """
+    df = df.copy()
+    if 'Currency' not in df or (df['Currency'].astype(str) == base).all():
+        df['FX Rate'] = 1.0
+        return df
+
+    fx = fx or get_default_fx_rates()
+    currencies = df['Currency'].astype(str).to_numpy()
+    purchase_rates = fx.convert(np.ones(len(df)), currencies, base, dates=df['Purchase Date'])
+    spot_rates = fx.convert(np.ones(len(df)), currencies, base)
+    df['Purchase Price'] = df['Purchase Price'] * purchase_rates
+    df['Total Cost'] = df['Total Cost'] * purchase_rates
+    df['Current Price'] = df['Current Price'] * spot_rates
+    df['FX Rate'] = spot_rates
+    return df
+
+
+def unconverted_rows(df):
+    """Mask of the converted holdings with no spot or purchase-date rate, whose values cannot be summed with the rest"""
+    if 'FX Rate' not in df:
+        return np.zeros(len(df), dtype=bool)
+    return (df['FX Rate'].isna() | df['Total Cost'].isna()).to_numpy()
+
+
+def missing_currencies(df):
+    """Currencies of converted holdings that had no rate"""
+    return sorted(set(df.loc[unconverted_rows(df), 'Currency'].astype(str)))
+
+
+_default_fx_rates = None
+
+
+def get_default_fx_rates():
+    global _default_fx_rates
+    if _default_fx_rates is None:
+        if FX_PROVIDER == 'file':
+            upstream = FilePriceHistoryProvider(FX_DATA_DIR)
+        else:
+            upstream = YahooPriceHistoryProvider()
+        _default_fx_rates = FxRates(CachedPriceHistoryProvider(upstream, FX_CACHE_DIR), live=upstream)
+    return _default_fx_rates
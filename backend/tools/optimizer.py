@@ -0,0 +1,266 @@
+import hashlib
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+from services.cache import TieredCache
+from services.telemetry import telemetry
+from tools.tail_risk import estimate_covariance, top_eigenpairs
+from config import (
+    OPTIMIZER_LOOKBACK_DAYS, OPTIMIZER_MAX_WEIGHT, OPTIMIZER_MAX_TURNOVER, OPTIMIZER_RETURN_SHRINKAGE,
+    OPTIMIZER_MIN_TRADE, OPTIMIZER_CACHE_SIZE, OPTIMIZER_CACHE_TTL_HOURS, HOLDINGS_SUMMARY_TOP_N,
+)
+
+# The objective each investmentStrategy of the upload form is optimized for
+STRATEGY_OBJECTIVES = {
+    'conservative': 'min_variance',
+    'balanced': 'risk_parity',
+    'aggressive': 'max_sharpe',
+}
+OBJECTIVES = ('min_variance', 'max_sharpe', 'risk_parity')
+PERIODS_PER_YEAR = 252
+# Risk aversions of the mean-variance portfolios the max-Sharpe search walks along the frontier
+RISK_AVERSIONS = np.geomspace(1, 100, 10)
+
+
+def project_capped_simplex(v, cap, tol=1e-12, max_iterations=100):
+    """
+    Closest weights to `v` that are between 0 and `cap` and sum to 1: v shifted by the root of
+    a piecewise-linear sum, found by Newton steps safeguarded by bisection
+    """
+    low, high = v.min() - cap, v.max()
+    shift = (low + high) / 2
+    for _ in range(max_iterations):
+        w = np.clip(v - shift, 0, cap)
+        excess = w.sum() - 1
+        if abs(excess) < tol:
+            break
+        if excess > 0:
+            low = shift
+        else:
+            high = shift
+        # Within one linear piece the sum falls by one for every weight strictly inside (0, cap)
+        free = np.count_nonzero((w > 0) & (w < cap))
+        shift = shift + excess / free if free else (low + high) / 2
+        if not low < shift < high:
+            shift = (low + high) / 2
+    return w
+
+
+def quadratic_program(A, b, cap, start, tol=1e-7, max_iterations=5000):
+    """
+    Minimize 1/2 w'Aw - b'w over long-only, fully invested weights capped at `cap`, by accelerated
+    projected gradient (FISTA with adaptive restart) from `start`. Returns (weights, iterations, converged).
+    """
+    step = 1 / max(float(top_eigenpairs(A, 1)[0][0]), 1e-12)
+    w = project_capped_simplex(start, cap)
+    momentum, t = w, 1.0
+    for iteration in range(1, max_iterations + 1):
+        previous = w
+        w = project_capped_simplex(momentum - step * (A @ momentum - b), cap)
+        if np.abs(w - previous).max() < tol:
+            return w, iteration, True
+        if (momentum - w) @ (w - previous) > 0:
+            # The momentum points uphill, start accelerating again from here
+            momentum, t = w, 1.0
+            continue
+        t_next = (1 + np.sqrt(1 + 4 * t * t)) / 2
+        momentum = w + (t - 1) / t_next * (w - previous)
+        t = t_next
+    return w, max_iterations, False
+
+
+def min_variance(covariance, cap, start):
+    return quadratic_program(covariance, np.zeros(len(covariance)), cap, start)
+
+
+def max_sharpe(covariance, expected, risk_free_rate, cap, start):
+    """
+    The highest-Sharpe portfolio among the mean-variance optima for RISK_AVERSIONS and the
+    minimum-variance portfolio; each solve warm-starts from the previous one
+    """
+    best, best_sharpe, iterations, converged = None, -np.inf, 0, True
+    w = start
+    for risk_aversion in [*RISK_AVERSIONS, None]:
+        if risk_aversion is None:
+            w, used, done = min_variance(covariance, cap, w)
+        else:
+            w, used, done = quadratic_program(risk_aversion * covariance, expected, cap, w)
+        iterations, converged = iterations + used, converged and done
+        sharpe = (expected @ w - risk_free_rate) / np.sqrt(max(w @ covariance @ w, 1e-18))
+        if sharpe > best_sharpe:
+            best, best_sharpe = w, sharpe
+    return best, iterations, converged
+
+
+def cap_weights(w, cap):
+    """
+    Weights clipped at `cap`, the excess shared out over the uncapped ones in proportion to their
+    weight, again and again until none is above the cap
+    """
+    w = w / w.sum()
+    capped = np.zeros(len(w), dtype=bool)
+    while True:
+        over = ~capped & (w > cap)
+        if not over.any():
+            return w
+        capped |= over
+        free = w[~capped].sum()
+        w = np.where(capped, cap, w * (1 - cap * capped.sum()) / free if free > 0 else 0.0)
+
+
+def risk_parity(covariance, cap, start, tol=1e-8, max_iterations=2000):
+    """
+    Equal risk contributions from the convex form min 1/2 y'Cy - sum(log y) / n, solved for every
+    asset at once with the closed-form coordinate update, then scaled to weights. Equal risk
+    usually means a large weight in the calmest assets, which is then held to `cap`.
+    """
+    n = len(covariance)
+    diagonal = np.diag(covariance)
+    budget = np.full(n, 1 / n)
+    y = np.maximum(start, 1e-6) / np.sqrt(max(start @ covariance @ start, 1e-18))
+    for iteration in range(1, max_iterations + 1):
+        others = covariance @ y - diagonal * y
+        updated = (np.sqrt(others ** 2 + 4 * diagonal * budget) - others) / (2 * diagonal)
+        # Half steps keep the simultaneous update from oscillating when assets are strongly correlated
+        updated = (y + updated) / 2
+        if np.abs(updated - y).max() <= tol * updated.max():
+            return cap_weights(updated, cap), iteration, True
+        y = updated
+    return cap_weights(y, cap), max_iterations, False
+
+
+def limit_turnover(current, target, max_turnover):
+    """
+    Scale the move from `current` towards `target` back so one-way turnover stays within
+    `max_turnover`. For the convex objectives the result is still at least as good as `current`.
+    """
+    turnover = np.abs(target - current).sum() / 2
+    if not max_turnover or turnover <= max_turnover:
+        return target, False
+    return current + (target - current) * (max_turnover / turnover), True
+
+
+def _statistics(weights, expected, covariance, risk_free_rate):
+    expected_return = float(expected @ weights)
+    volatility = float(np.sqrt(max(weights @ covariance @ weights, 0)))
+    return {
+        'expected_return': round(expected_return * 100, 2),
+        'volatility': round(volatility * 100, 2),
+        'sharpe_ratio': round((expected_return - risk_free_rate) / volatility, 2) if volatility else None,
+    }
+
+
+def trade_list(positions, current, target, total_value, min_trade=OPTIMIZER_MIN_TRADE, top_n=HOLDINGS_SUMMARY_TOP_N):
+    """
+    The largest weight changes as buy/sell orders in the base currency and in shares, the rest
+    summed so prompt size stays flat
+    """
+    change = target - current
+    amount = change * total_value
+    price = positions['Current Price'].to_numpy(dtype=float)
+    order = np.argsort(-np.abs(change), kind='stable')
+    listed = [i for i in order if abs(change[i]) >= min_trade]
+    trades = [{
+        'ticker': str(positions['Ticker'].iloc[i]),
+        'action': 'buy' if change[i] > 0 else 'sell',
+        'current_weight': round(float(current[i]), 4),
+        'target_weight': round(float(target[i]), 4),
+        'amount': round(abs(float(amount[i])), 2),
+        'quantity': round(abs(float(amount[i] / price[i])), 4) if price[i] else None,
+    } for i in listed[:top_n]]
+    rest = np.array(listed[top_n:], dtype=int)
+    return trades, {
+        'count': int(len(rest)),
+        'buy_amount': round(float(amount[rest][amount[rest] > 0].sum()), 2),
+        'sell_amount': round(abs(float(amount[rest][amount[rest] < 0].sum())), 2),
+    }
+
+
+def optimize_portfolio(positions, returns, strategy='balanced', risk_free_rate=0.02, max_weight=OPTIMIZER_MAX_WEIGHT,
+                       max_turnover=OPTIMIZER_MAX_TURNOVER, lookback_days=OPTIMIZER_LOOKBACK_DAYS):
+    """
+    Target weights of one position per ticker for `strategy` (an investmentStrategy or an objective
+    name), from the same base-currency returns and covariance as the risk metrics, and the trades
+    that get there. Positions without enough history keep their weight and are not traded.
+    """
+    strategy = strategy.strip().lower()
+    objective = strategy if strategy in OBJECTIVES else STRATEGY_OBJECTIVES.get(strategy, STRATEGY_OBJECTIVES['balanced'])
+
+    market_value = np.nan_to_num(positions['Market Value'].to_numpy(dtype=float))
+    total_value = market_value.sum()
+    tickers = positions['Ticker'].astype(str).to_numpy()
+    recent = returns.loc[returns.index > returns.index[-1] - timedelta(days=lookback_days)]
+    columns, covariance = estimate_covariance(recent.reindex(columns=tickers))
+    if len(columns) < 2 or total_value <= 0:
+        return None
+
+    covered = np.isin(tickers, columns)
+    current = market_value / total_value
+    share = current[covered].sum()
+    order = pd.Index(columns).get_indexer(tickers[covered])
+    # Annualized, with each asset's mean return shrunk towards the cross-section's
+    covariance = covariance[np.ix_(order, order)] * PERIODS_PER_YEAR
+    mean = recent[tickers[covered]].mean().to_numpy() * PERIODS_PER_YEAR
+    expected = (1 - OPTIMIZER_RETURN_SHRINKAGE) * mean + OPTIMIZER_RETURN_SHRINKAGE * mean.mean()
+
+    # Solved within the covered block, warm-started from its current mix
+    start = current[covered] / share if share > 0 else np.full(covered.sum(), 1 / covered.sum())
+    cap = max(max_weight, 1 / len(start) + 1e-9) if max_weight else 1.0
+    if objective == 'min_variance':
+        solution, iterations, converged = min_variance(covariance, cap, start)
+    elif objective == 'max_sharpe':
+        solution, iterations, converged = max_sharpe(covariance, expected, risk_free_rate, cap, start)
+    else:
+        solution, iterations, converged = risk_parity(covariance, cap, start)
+
+    solution, limited = limit_turnover(start, solution, max_turnover / share if share > 0 else max_turnover)
+    target = current.copy()
+    target[covered] = solution * share
+    trades, other_trades = trade_list(positions, current, target, total_value)
+    return {
+        'strategy': strategy,
+        'objective': objective,
+        'assets': int(covered.sum()),
+        'coverage': round(float(share), 4),
+        'max_weight': round(float(cap), 4),
+        'turnover': round(float(np.abs(target - current).sum() / 2), 4),
+        'turnover_limited': bool(limited),
+        'iterations': int(iterations),
+        'converged': bool(converged),
+        'current': _statistics(start, expected, covariance, risk_free_rate),
+        'target': _statistics(solution, expected, covariance, risk_free_rate),
+        'trades': trades,
+        'other_trades': other_trades,
+    }
+
+
+def rebalance_cache_key(positions, returns, strategy):
+    """Same positions, market data and settings give the same plan, so each portfolio snapshot is solved once"""
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(positions[['Ticker', 'Market Value']].astype({'Ticker': str}), index=False).to_numpy().tobytes())
+    digest.update(pd.util.hash_pandas_object(returns.index.to_series(), index=False).to_numpy().tobytes())
+    for part in (strategy.strip().lower(), OPTIMIZER_MAX_WEIGHT, OPTIMIZER_MAX_TURNOVER, OPTIMIZER_RETURN_SHRINKAGE, OPTIMIZER_LOOKBACK_DAYS):
+        digest.update(b'\0' + str(part).encode())
+    return digest.hexdigest()
+
+
+_default_cache = None
+
+
+def get_default_rebalance_cache():
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = TieredCache(OPTIMIZER_CACHE_SIZE, OPTIMIZER_CACHE_TTL_HOURS * 3600)
+    return _default_cache
+
+
+def plan_rebalance(positions, returns, strategy, cache=None):
+    """optimize_portfolio through the rebalance cache"""
+    cache = cache or get_default_rebalance_cache()
+    key = rebalance_cache_key(positions, returns, strategy)
+    plan = cache.get(key)
+    telemetry.record_cache('rebalance', hit=plan is not None)
+    if plan is None:
+        plan = optimize_portfolio(positions, returns, strategy)
+        cache.put(key, plan)
+    return plan
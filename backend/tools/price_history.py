@@ -0,0 +1,247 @@
+import os
+import json
+import threading
+import pandas as pd
+from datetime import date, timedelta
+from services.telemetry import span
+from config import PRICE_PROVIDER, PRICE_DATA_DIR, PRICE_CACHE_DIR, PRICE_STORE, PRICE_WAREHOUSE_DIR, PRICE_WAREHOUSE_REFRESH
+
+# Daily bar fields kept by the price warehouse
+BAR_FIELDS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+
+def _to_date(value):
+    return pd.Timestamp(value).date()
+
+
+def _normalize_closes(closes, tickers):
+    # Always hand back a tz-naive, date-indexed frame with one column per ticker
+    if isinstance(closes, pd.Series):
+        closes = closes.to_frame(name=tickers[0])
+    closes = closes.copy()
+    index = pd.to_datetime(closes.index)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    closes.index = index.normalize()
+    closes.index.name = 'Date'
+    closes = closes[~closes.index.duplicated(keep='last')].sort_index()
+    return closes.reindex(columns=tickers).astype(float)
+
+
+def missing_ranges(covered, start, end):
+    """Date ranges of [start, end) outside the `covered` [first, last] window, as [start, end) pairs"""
+    last = end - timedelta(days=1)
+    if covered is None:
+        return [(start, end)]
+    covered_start, covered_end = _to_date(covered[0]), _to_date(covered[1])
+    # Only fill what is missing on each side of the cached window
+    ranges = []
+    if start < covered_start:
+        ranges.append((start, covered_start))
+    if last > covered_end:
+        ranges.append((covered_end + timedelta(days=1), end))
+    return ranges
+
+
+class PriceHistoryProvider():
+    """Source of daily close prices. `end` is exclusive, like yfinance."""
+
+    def fetch(self, tickers, start, end):
+        raise NotImplementedError
+
+    def get_close_prices(self, tickers, start, end=None):
+        tickers = list(dict.fromkeys(tickers))
+        end = end or date.today()
+        if not tickers:
+            return pd.DataFrame()
+        with span('prices.get_close_prices', provider=type(self).__name__, tickers=len(tickers)):
+            return _normalize_closes(self.fetch(tickers, _to_date(start), _to_date(end)), tickers)
+
+    def fetch_bars(self, tickers, start, end):
+        """{ticker: daily OHLCV frame}; sources that only know closes leave the other fields empty."""
+        closes = self.get_close_prices(tickers, start, end)
+        return {ticker: closes[[ticker]].rename(columns={ticker: 'Close'}).reindex(columns=BAR_FIELDS) for ticker in tickers}
+
+
+class YahooPriceHistoryProvider(PriceHistoryProvider):
+    """Fetches all tickers in a single bulk yfinance download."""
+
+    def fetch(self, tickers, start, end):
+        import yfinance as yf
+
+        with span('prices.download', provider='yahoo', tickers=len(tickers)):
+            data = yf.download(
+                tickers,
+                start=start,
+                end=end,
+                auto_adjust=True,
+                progress=False,
+                threads=True,
+            )
+        if data.empty:
+            return pd.DataFrame(columns=tickers)
+        closes = data['Close']
+        if isinstance(closes, pd.Series) or len(tickers) == 1 and tickers[0] not in closes.columns:
+            closes = pd.DataFrame({tickers[0]: closes.squeeze()})
+        return closes
+
+    def fetch_bars(self, tickers, start, end):
+        import yfinance as yf
+
+        with span('prices.download', provider='yahoo', tickers=len(tickers)):
+            data = yf.download(tickers, start=start, end=end, auto_adjust=True, progress=False, threads=True)
+        bars = {}
+        for ticker in tickers:
+            if data.empty:
+                break
+            if isinstance(data.columns, pd.MultiIndex):
+                if ticker not in data.columns.get_level_values(1):
+                    continue
+                frame = data.xs(ticker, axis=1, level=1)
+            else:
+                frame = data
+            bars[ticker] = _normalize_closes(frame.reindex(columns=BAR_FIELDS), BAR_FIELDS).dropna(subset=['Close'])
+        return bars
+
+
+class FilePriceHistoryProvider(PriceHistoryProvider):
+    """Offline stand-in reading `<directory>/<TICKER>.csv` files with Date and Close columns."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def fetch(self, tickers, start, end):
+        frames = {}
+        for ticker in tickers:
+            path = os.path.join(self.directory, f"{ticker}.csv")
+            if not os.path.exists(path):
+                continue
+            data = pd.read_csv(path, parse_dates=['Date'], index_col='Date')
+            closes = data['Close']
+            frames[ticker] = closes[(closes.index >= pd.Timestamp(start)) & (closes.index < pd.Timestamp(end))]
+        if not frames:
+            return pd.DataFrame(columns=tickers)
+        return pd.DataFrame(frames)
+
+    def fetch_bars(self, tickers, start, end):
+        bars = {}
+        for ticker in tickers:
+            path = os.path.join(self.directory, f"{ticker}.csv")
+            if not os.path.exists(path):
+                continue
+            data = pd.read_csv(path, parse_dates=['Date'], index_col='Date')
+            data = data[(data.index >= pd.Timestamp(start)) & (data.index < pd.Timestamp(end))]
+            bars[ticker] = _normalize_closes(data.reindex(columns=BAR_FIELDS), BAR_FIELDS)
+        return bars
+
+
+class CachedPriceHistoryProvider(PriceHistoryProvider):
+    """
+    On-disk cache in front of another provider. Each ticker keeps the date range it covers,
+    so a request only downloads the days that are missing (usually just the most recent ones),
+    grouped so tickers that share a gap are fetched together in one bulk call.
+    """
+
+    def __init__(self, upstream, cache_dir):
+        self.upstream = upstream
+        self.cache_dir = cache_dir
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path) as f:
+            return json.load(f)
+
+    def _save_index(self, index):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _path(self, ticker):
+        return os.path.join(self.cache_dir, f"{ticker.replace('/', '_')}.csv")
+
+    def _read(self, ticker):
+        path = self._path(ticker)
+        if not os.path.exists(path):
+            return pd.Series(dtype=float, name=ticker, index=pd.DatetimeIndex([], name='Date'))
+        data = pd.read_csv(path, parse_dates=['Date'], index_col='Date')
+        return data['Close'].rename(ticker)
+
+    def _write(self, ticker, closes):
+        closes.rename('Close').to_frame().to_csv(self._path(ticker), index_label='Date')
+
+    def fetch(self, tickers, start, end):
+        with self._lock:
+            index = self._load_index()
+
+            gaps = {}
+            for ticker in tickers:
+                for gap in missing_ranges(index.get(ticker), start, end):
+                    gaps.setdefault(gap, []).append(ticker)
+
+            fetched = {}
+            for (gap_start, gap_end), gap_tickers in gaps.items():
+                closes = self.upstream.get_close_prices(gap_tickers, gap_start, gap_end)
+                for ticker in gap_tickers:
+                    part = closes[ticker].dropna()
+                    # A gap that came back empty (not listed yet, a holiday, an upstream outage)
+                    # stays uncovered so the next request asks for it again
+                    if not part.empty:
+                        fetched.setdefault(ticker, []).append((gap_start, gap_end, part))
+
+            frames = {}
+            for ticker in tickers:
+                closes = self._read(ticker)
+                if ticker in fetched:
+                    parts = [part for part in [closes, *(part for _, _, part in fetched[ticker])] if not part.empty]
+                    closes = pd.concat(parts)
+                    closes = closes[~closes.index.duplicated(keep='last')].sort_index()
+                    self._write(ticker, closes)
+                    # Gaps border the covered window, so adding them keeps it one range
+                    covered = index.get(ticker)
+                    for gap_start, gap_end, _ in fetched[ticker]:
+                        covered_start, covered_end = gap_start, gap_end - timedelta(days=1)
+                        if covered is not None:
+                            covered_start = min(covered_start, _to_date(covered[0]))
+                            covered_end = max(covered_end, _to_date(covered[1]))
+                        covered = [covered_start.isoformat(), covered_end.isoformat()]
+                    index[ticker] = covered
+                frames[ticker] = closes[(closes.index >= pd.Timestamp(start)) & (closes.index < pd.Timestamp(end))]
+
+            if fetched:
+                self._save_index(index)
+
+        return pd.DataFrame(frames)
+
+
+def returns_matrix(closes):
+    # Returns are computed against each ticker's own previous close, so a holiday in one
+    # market neither drops the next return nor shows up as a fake zero return
+    returns = closes.ffill().pct_change(fill_method=None).where(closes.notna())
+    return returns.iloc[1:] if len(returns) else returns
+
+
+_default_provider = None
+
+
+def get_upstream_provider():
+    if PRICE_PROVIDER == 'file':
+        return FilePriceHistoryProvider(PRICE_DATA_DIR)
+    return YahooPriceHistoryProvider()
+
+
+def get_default_provider():
+    global _default_provider
+    if _default_provider is None:
+        if PRICE_STORE == 'warehouse':
+            from tools.price_warehouse import PriceWarehouse, WarehousePriceHistoryProvider
+
+            warehouse = PriceWarehouse(PRICE_WAREHOUSE_DIR)
+            _default_provider = WarehousePriceHistoryProvider(get_upstream_provider(), warehouse, refresh=PRICE_WAREHOUSE_REFRESH)
+        else:
+            _default_provider = CachedPriceHistoryProvider(get_upstream_provider(), PRICE_CACHE_DIR)
+    return _default_provider
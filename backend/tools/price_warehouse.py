@@ -0,0 +1,275 @@
+import os
+import sys
+import glob
+import json
+import fcntl
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date, timedelta
+from config import PRICE_WAREHOUSE_TABLES
+from tools.price_history import BAR_FIELDS, PriceHistoryProvider, missing_ranges, _to_date
+
+SCHEMA = pa.schema([
+    ('Date', pa.timestamp('ns')),
+    *[(field, pa.float64()) for field in BAR_FIELDS],
+])
+
+
+class PriceWarehouse():
+    """
+    Daily OHLCV per ticker in uncompressed Arrow IPC files under `<directory>/<TICKER>/`.
+    Updates only ever add a new segment file, reads memory-map the segments so closes are
+    handed to numpy without parsing or copying, and `compact` folds a ticker's segments into one.
+    `manifest.json` records the date range each ticker has been fetched for. Writers hold
+    `.lock` so several worker processes can share one directory.
+    """
+
+    def __init__(self, directory, max_tables=PRICE_WAREHOUSE_TABLES):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, 'manifest.json')
+        self.max_tables = max_tables
+        self._lock = threading.RLock()
+        self._lock_file = None
+        self._lock_depth = 0
+        self._tables = OrderedDict()
+        os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def locked(self):
+        """Exclusive access against other threads and, through an flock on `.lock`, other processes; reentrant"""
+        with self._lock:
+            if self._lock_depth == 0:
+                self._lock_file = open(os.path.join(self.directory, '.lock'), 'a')
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    def _ticker_dir(self, ticker):
+        return os.path.join(self.directory, ticker.replace('/', '_'))
+
+    def _segments(self, ticker):
+        return sorted(glob.glob(os.path.join(self._ticker_dir(ticker), '*.arrow')))
+
+    def load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path) as f:
+            return json.load(f)
+
+    def save_manifest(self, manifest):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def table(self, ticker):
+        """All bars of a ticker as one Arrow table backed by memory-mapped segments, sorted by date"""
+        segments = tuple(self._segments(ticker))
+        with self._lock:
+            cached = self._tables.get(ticker)
+            if cached is not None and cached[0] == segments:
+                self._tables.move_to_end(ticker)
+                return cached[1]
+        if not segments:
+            table = SCHEMA.empty_table()
+        else:
+            try:
+                tables = [pa.ipc.open_file(pa.memory_map(path, 'r')).read_all() for path in segments]
+            except FileNotFoundError:
+                # Compacted by another process after the listing; nothing changes while the lock is held
+                with self.locked():
+                    return self.table(ticker)
+            table = pa.concat_tables(tables) if len(tables) > 1 else tables[0]
+            dates = table.column('Date').to_numpy()
+            if len(tables) > 1 or not (np.diff(dates.astype('int64')) > 0).all():
+                # Backfilled segments or overlaps: sort and keep the newest row per date
+                order = np.argsort(dates, kind='stable')
+                keep = np.append(np.diff(dates[order].astype('int64')) != 0, True)
+                table = table.take(pa.array(order[keep])).combine_chunks()
+        with self._lock:
+            self._tables[ticker] = (segments, table)
+            self._tables.move_to_end(ticker)
+            while len(self._tables) > self.max_tables:
+                self._tables.popitem(last=False)
+        return table
+
+    def append(self, ticker, bars):
+        """Write the bars for dates not already stored as a new segment; returns the rows added"""
+        if bars is None or bars.empty:
+            return 0
+        with self.locked():
+            stored = self.table(ticker).column('Date').to_numpy()
+            bars = bars.reindex(columns=BAR_FIELDS).astype(float).dropna(subset=['Close'])
+            bars = bars[~bars.index.isin(pd.DatetimeIndex(stored))]
+            bars = bars[~bars.index.duplicated(keep='last')].sort_index()
+            if bars.empty:
+                return 0
+            directory = self._ticker_dir(ticker)
+            os.makedirs(directory, exist_ok=True)
+            segments = self._segments(ticker)
+            sequence = int(os.path.basename(segments[-1]).split('.')[0]) + 1 if segments else 0
+            self._write_segment(os.path.join(directory, f"{sequence:06d}.arrow"), bars)
+            return len(bars)
+
+    def _write_segment(self, path, bars):
+        table = pa.Table.from_pandas(bars.rename_axis('Date').reset_index(), schema=SCHEMA, preserve_index=False)
+        tmp_path = path + '.tmp'
+        with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, SCHEMA) as writer:
+            writer.write_table(table)
+        os.replace(tmp_path, path)
+
+    def compact(self, ticker):
+        """Replace a ticker's segments with a single sorted one"""
+        with self.locked():
+            segments = self._segments(ticker)
+            if len(segments) < 2:
+                return False
+            bars = self.table(ticker).to_pandas().set_index('Date')
+            sequence = int(os.path.basename(segments[-1]).split('.')[0]) + 1
+            self._write_segment(os.path.join(self._ticker_dir(ticker), f"{sequence:06d}.arrow"), bars)
+            for path in segments:
+                os.remove(path)
+            self._tables.pop(ticker, None)
+            return True
+
+    def tickers(self):
+        return sorted(self.load_manifest())
+
+    def closes(self, tickers, start, end):
+        """Dates x tickers closes in [start, end), read straight from the memory-mapped columns"""
+        start, end = pd.Timestamp(start).to_datetime64(), pd.Timestamp(end).to_datetime64()
+        frames = {}
+        for ticker in tickers:
+            table = self.table(ticker)
+            if table.num_rows == 0:
+                continue
+            dates = table.column('Date').to_numpy()
+            close = table.column('Close').to_numpy()
+            first, last = np.searchsorted(dates, start), np.searchsorted(dates, end)
+            frames[ticker] = pd.Series(close[first:last], index=pd.DatetimeIndex(dates[first:last], name='Date'))
+        if not frames:
+            return pd.DataFrame(columns=list(tickers))
+        return pd.DataFrame(frames)
+
+
+class WarehousePriceHistoryProvider(PriceHistoryProvider):
+    """
+    Serves closes from the warehouse. With `refresh`, days missing from the manifest are fetched
+    from `upstream` first (grouped by gap so tickers share bulk calls) and appended;
+    without it, requests never touch the network and rely on `warm` having run.
+    """
+
+    def __init__(self, upstream, warehouse, refresh=True):
+        self.upstream = upstream
+        self.warehouse = warehouse
+        self.refresh = refresh
+
+    def warm(self, tickers, start, end):
+        """Fetch and store whatever is missing for [start, end); returns {ticker: rows added}"""
+        added = {}
+        # The manifest is read, extended and written back by one process at a time
+        with self.warehouse.locked():
+            manifest = self.warehouse.load_manifest()
+            gaps = {}
+            for ticker in tickers:
+                for gap in missing_ranges(manifest.get(ticker), start, end):
+                    gaps.setdefault(gap, []).append(ticker)
+
+            for (gap_start, gap_end), gap_tickers in gaps.items():
+                bars = self.upstream.fetch_bars(gap_tickers, gap_start, gap_end)
+                for ticker in gap_tickers:
+                    added[ticker] = added.get(ticker, 0) + self.warehouse.append(ticker, bars.get(ticker))
+                    covered_start, covered_end = gap_start, gap_end - timedelta(days=1)
+                    if ticker in manifest:
+                        covered_start = min(covered_start, _to_date(manifest[ticker][0]))
+                        covered_end = max(covered_end, _to_date(manifest[ticker][1]))
+                    manifest[ticker] = [covered_start.isoformat(), covered_end.isoformat()]
+
+            if gaps:
+                self.warehouse.save_manifest(manifest)
+        return added
+
+    def fetch(self, tickers, start, end):
+        if self.refresh:
+            self.warm(tickers, start, end)
+        return self.warehouse.closes(tickers, start, end)
+
+
+def _universe(args):
+    from config import BETA_BENCHMARK
+
+    tickers = list(args.tickers)
+    for path in args.universe or []:
+        with open(path) as f:
+            tickers += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    for path in args.holdings or []:
+        from services.ingestion import load_holdings
+        tickers += load_holdings(path).tickers
+    if args.benchmark:
+        tickers.append(BETA_BENCHMARK)
+    return list(dict.fromkeys(tickers))
+
+
+def main(argv=None):
+    from config import PRICE_WAREHOUSE_DIR
+    from tools.price_history import get_upstream_provider
+
+    parser = argparse.ArgumentParser(prog='python -m tools.price_warehouse', description="Maintain the local daily price warehouse")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    warm = commands.add_parser('warm', help="fetch missing days for a universe of tickers, e.g. from a nightly cron")
+    warm.add_argument('tickers', nargs='*', help="tickers to warm")
+    warm.add_argument('--universe', action='append', help="file with one ticker per line")
+    warm.add_argument('--holdings', action='append', help="holdings CSV whose tickers to warm")
+    warm.add_argument('--all', action='store_true', help="every ticker already in the warehouse")
+    warm.add_argument('--benchmark', action='store_true', help="include the beta benchmark")
+    warm.add_argument('--days', type=int, default=400, help="history to keep, in calendar days")
+    warm.add_argument('--compact', action='store_true', help="compact segments after warming")
+
+    compact = commands.add_parser('compact', help="fold each ticker's segments into one file")
+    compact.add_argument('tickers', nargs='*', help="tickers to compact (default: all)")
+
+    commands.add_parser('stats', help="show what the warehouse holds")
+
+    parser.add_argument('--directory', default=PRICE_WAREHOUSE_DIR)
+    args = parser.parse_args(argv)
+    warehouse = PriceWarehouse(args.directory)
+
+    if args.command == 'warm':
+        tickers = _universe(args) + (warehouse.tickers() if args.all else [])
+        tickers = list(dict.fromkeys(tickers))
+        if not tickers:
+            parser.error("no tickers to warm")
+        provider = WarehousePriceHistoryProvider(get_upstream_provider(), warehouse)
+        today = date.today()
+        # `end` is exclusive, so this covers everything up to yesterday's close
+        added = provider.warm(tickers, today - timedelta(days=args.days), today)
+        print(f"warmed {len(tickers)} tickers, {sum(added.values())} new rows")
+        if args.compact:
+            for ticker in tickers:
+                warehouse.compact(ticker)
+    elif args.command == 'compact':
+        compacted = [ticker for ticker in (args.tickers or warehouse.tickers()) if warehouse.compact(ticker)]
+        print(f"compacted {len(compacted)} tickers")
+    elif args.command == 'stats':
+        manifest = warehouse.load_manifest()
+        for ticker in sorted(manifest):
+            table = warehouse.table(ticker)
+            print(f"{ticker}\t{manifest[ticker][0]}..{manifest[ticker][1]}\t{table.num_rows} rows\t{len(warehouse._segments(ticker))} segments")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
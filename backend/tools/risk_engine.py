@@ -0,0 +1,151 @@
+import numpy as np
+
+
+def _masked_mean(values, mask, axis=0):
+    count = mask.sum(axis=axis)
+    total = np.where(mask, values, 0.0).sum(axis=axis)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return total / count, count
+
+
+class RiskEngine():
+    """
+    Vectorized portfolio risk over a dates x assets returns array.
+
+    NaN marks a day on which an asset was not held or did not trade; it contributes nothing
+    to that day's portfolio return. Weights may be a vector, or an assets x portfolios array
+    to evaluate many portfolios over the same returns in one pass.
+    """
+
+    def __init__(self, returns, weights, benchmark=None, risk_free_rate=0.02, periods_per_year=252):
+        self.returns = np.asarray(returns, dtype=float)
+        weights = np.asarray(weights, dtype=float)
+        self.single = weights.ndim == 1
+        self.weights = weights[:, None] if self.single else weights
+        self.benchmark = None if benchmark is None else np.asarray(benchmark, dtype=float)
+        self.risk_free_rate = risk_free_rate
+        self.periods_per_year = periods_per_year
+
+        valid = ~np.isnan(self.returns)
+        held = self.weights != 0
+        # A portfolio has a return on a date when at least one of its assets has one
+        self.active = (valid.astype(float) @ held.astype(float)) > 0
+        portfolio_returns = np.nan_to_num(self.returns) @ self.weights
+        self.portfolio_returns = np.where(self.active, portfolio_returns, np.nan)
+
+    @classmethod
+    def from_components(cls, portfolio_returns, active, downside, has_downside, risk_free_rate=0.02, periods_per_year=252):
+        """
+        Build one portfolio from daily aggregates already weighted across its assets (e.g. kept
+        up to date as lots are added and removed): its returns, the dates it has one, the weighted
+        returns below the risk-free threshold and the dates some holding had one.
+        """
+        engine = cls.__new__(cls)
+        engine.returns = None
+        engine.weights = None
+        engine.single = True
+        engine.benchmark = None
+        engine.risk_free_rate = risk_free_rate
+        engine.periods_per_year = periods_per_year
+        engine.active = np.asarray(active, dtype=bool)[:, None]
+        engine.portfolio_returns = np.where(engine.active, np.asarray(portfolio_returns, dtype=float)[:, None], np.nan)
+        engine._downside = (np.asarray(downside, dtype=float)[:, None], np.asarray(has_downside, dtype=bool)[:, None])
+        return engine
+
+    def _out(self, values):
+        return float(values[0]) if self.single else values
+
+    def _volatility(self):
+        return np.nanstd(self.portfolio_returns, axis=0, ddof=1) * np.sqrt(self.periods_per_year)
+
+    def _period_return(self):
+        return np.nanprod(1 + self.portfolio_returns, axis=0) - 1
+
+    def _downside_components(self):
+        if self.returns is None:
+            return self._downside
+        threshold = self.risk_free_rate / self.periods_per_year
+        downside = np.where(self.returns < threshold, self.returns, np.nan)
+        # Only dates on which some holding fell below the threshold enter the mean
+        has_downside = ((~np.isnan(downside)).astype(float) @ (self.weights != 0).astype(float)) > 0
+        return np.nan_to_num(downside) @ self.weights, has_downside
+
+    def _downside_risk(self):
+        weighted, has_downside = self._downside_components()
+        mean_square, _ = _masked_mean(weighted**2, has_downside)
+        return np.sqrt(mean_square * self.periods_per_year)
+
+    def volatility(self):
+        return self._out(self._volatility())
+
+    def total_return(self):
+        return self._out(self._period_return())
+
+    def cagr(self):
+        periods = self.active.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self._out((1 + self._period_return()) ** (self.periods_per_year / periods) - 1)
+
+    # The lookback window is capped at one year, so the period return is used as the
+    # annual return in the Sharpe and Sortino ratios
+    def sharpe_ratio(self):
+        return self._out((self._period_return() - self.risk_free_rate) / self._volatility())
+
+    def downside_risk(self):
+        return self._out(self._downside_risk())
+
+    def sortino_ratio(self):
+        return self._out((self._period_return() - self.risk_free_rate) / self._downside_risk())
+
+    def drawdowns(self):
+        cumulative_returns = np.cumprod(1 + np.nan_to_num(self.portfolio_returns), axis=0)
+        rolling_max = np.maximum.accumulate(cumulative_returns, axis=0)
+        return (cumulative_returns - rolling_max) / rolling_max
+
+    def max_drawdown(self):
+        return self._out(self.drawdowns().min(axis=0))
+
+    def asset_betas(self):
+        """OLS beta of every asset column against the benchmark, over the dates both have data."""
+        if self.benchmark is None:
+            raise ValueError("RiskEngine needs benchmark returns to compute beta")
+        return regression_betas(self.returns, self.benchmark)
+
+    def beta(self):
+        if self.benchmark is None:
+            raise ValueError("RiskEngine needs benchmark returns to compute beta")
+        return self._out(regression_betas(self.portfolio_returns, self.benchmark))
+
+    def metrics(self):
+        result = {
+            'Volatility': self.volatility(),
+            'Sharpe Ratio': self.sharpe_ratio(),
+            'Sortino Ratio': self.sortino_ratio(),
+            'Max Drawdown': self.max_drawdown(),
+            'CAGR': self.cagr(),
+        }
+        if self.benchmark is not None:
+            result['Beta'] = self.beta()
+        return result
+
+
+def regression_betas(returns, benchmark):
+    """
+    Vectorized OLS slope of each column of `returns` against `benchmark`, using for every
+    column only the dates on which both series are present. Columns without two
+    overlapping observations come back as NaN.
+    """
+    returns = np.asarray(returns, dtype=float)
+    benchmark = np.asarray(benchmark, dtype=float)
+    if returns.ndim == 1:
+        returns = returns[:, None]
+    mask = ~np.isnan(returns) & ~np.isnan(benchmark)[:, None]
+    bench = np.broadcast_to(benchmark[:, None], returns.shape)
+
+    mean_r, count = _masked_mean(returns, mask)
+    mean_b, _ = _masked_mean(bench, mask)
+    dev_r = np.where(mask, returns - mean_r, 0.0)
+    dev_b = np.where(mask, bench - mean_b, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        betas = (dev_r * dev_b).sum(axis=0) / (dev_b**2).sum(axis=0)
+    return np.where(count > 1, betas, np.nan)
@@ -0,0 +1,290 @@
+import numpy as np
+import pandas as pd
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from tools.price_history import get_default_provider
+from config import (
+    BETA_BENCHMARK, TAIL_RISK_PATHS, TAIL_RISK_LOOKBACK_DAYS, TAIL_RISK_CHUNK_PATHS, TAIL_RISK_WORKERS, TAIL_RISK_METHOD,
+    TAIL_RISK_CHOLESKY_MAX_ASSETS, TAIL_RISK_FACTORS, TAIL_RISK_DOF, TAIL_RISK_SHRINKAGE, TAIL_RISK_SEED,
+)
+
+HORIZONS = (1, 10)
+CONFIDENCE_LEVELS = (0.95, 0.99)
+MIN_OBSERVATIONS = 20
+
+# Historical windows replayed on today's holdings, peak to trough of the broad market
+STRESS_SCENARIOS = (
+    ('2008 financial crisis', '2008-09-12', '2009-03-09'),
+    ('2018 Q4 sell-off', '2018-09-20', '2018-12-24'),
+    ('2020 COVID-19 crash', '2020-02-19', '2020-03-23'),
+    ('2022 rate shock', '2022-01-03', '2022-10-12'),
+)
+
+
+def estimate_covariance(returns, shrinkage=TAIL_RISK_SHRINKAGE, min_observations=MIN_OBSERVATIONS):
+    """
+    Daily log-return covariance of the columns of `returns` with at least `min_observations`,
+    from pairwise-complete dates, shrunk towards its diagonal so it stays positive definite.
+    Returns the columns used and the covariance.
+    """
+    log_returns = np.log1p(returns.to_numpy(dtype=float))
+    valid = ~np.isnan(log_returns)
+    enough = valid.sum(axis=0) >= min_observations
+    log_returns, valid = log_returns[:, enough], valid[:, enough]
+
+    means = np.nansum(log_returns, axis=0) / valid.sum(axis=0)
+    centred = np.where(valid, log_returns - means, 0.0)
+    # Each pair of assets is estimated over the dates both traded
+    pairs = valid.T.astype(float) @ valid.astype(float)
+    covariance = (centred.T @ centred) / np.maximum(pairs - 1, 1)
+    covariance = (1 - shrinkage) * covariance + shrinkage * np.diag(np.diag(covariance))
+    return returns.columns[enough], covariance
+
+
+def top_eigenpairs(matrix, k, oversample=10, iterations=4, seed=0):
+    # Randomized subspace iteration: only the leading k pairs are needed, which is far
+    # cheaper than a full eigendecomposition once there are thousands of assets
+    n = len(matrix)
+    if n <= 2 * (k + oversample):
+        values, vectors = np.linalg.eigh(matrix)
+        return values[::-1][:k], vectors[:, ::-1][:, :k]
+    basis = np.random.default_rng(seed).standard_normal((n, k + oversample))
+    for _ in range(iterations):
+        basis, _ = np.linalg.qr(matrix @ basis)
+    values, vectors = np.linalg.eigh(basis.T @ matrix @ basis)
+    return values[::-1][:k], (basis @ vectors)[:, ::-1][:, :k]
+
+
+def shock_model(covariance, method=TAIL_RISK_METHOD, factors=TAIL_RISK_FACTORS, max_cholesky_assets=TAIL_RISK_CHOLESKY_MAX_ASSETS):
+    """
+    (method, loadings, residual) with shocks = z @ loadings.T + residual * e for standard normal z and e.
+    Cholesky reproduces the covariance exactly; the factor model keeps its top principal
+    components plus each asset's own remaining variance, which is much cheaper for wide portfolios.
+    """
+    n = len(covariance)
+    if method == 'auto':
+        method = 'cholesky' if n <= max_cholesky_assets or n <= factors else 'factor'
+    if method == 'cholesky':
+        try:
+            return method, np.linalg.cholesky(covariance), None
+        except np.linalg.LinAlgError:
+            # Pairwise estimates can still be slightly indefinite, take the nearest square root instead
+            values, vectors = np.linalg.eigh(covariance)
+            return method, vectors * np.sqrt(np.clip(values, 0, None)), None
+    values, vectors = top_eigenpairs(covariance, factors)
+    loadings = vectors * np.sqrt(np.clip(values, 0, None))
+    residual = np.sqrt(np.clip(np.diag(covariance) - (loadings ** 2).sum(axis=1), 0, None))
+    return 'factor', loadings, residual
+
+
+def simulate_chunk(loadings, residual, weights, horizons, dof, paths, seed):
+    """Portfolio returns of `paths` scenarios at each horizon, as a horizons x paths array"""
+    # The Student-t rescaling needs a finite variance; 0 draws normal shocks
+    if dof and not dof > 2:
+        raise ValueError(f"Student-t degrees of freedom must be above 2 (or 0 for normal shocks), got {dof:g}")
+    rng = np.random.default_rng(seed)
+    loadings = loadings.astype(np.float32)
+    shocks = rng.standard_normal((paths, loadings.shape[1]), dtype=np.float32) @ loadings.T
+    if residual is not None:
+        shocks += rng.standard_normal((paths, len(residual)), dtype=np.float32) * residual.astype(np.float32)
+    if dof:
+        # Multivariate Student-t: one chi-square draw per path fattens every asset's tail together,
+        # rescaled so the covariance is unchanged
+        shocks *= np.sqrt((dof - 2) / rng.chisquare(dof, size=(paths, 1))).astype(np.float32)
+
+    weights = weights.astype(np.float32)
+    # Log returns drift down by half their variance, so no asset has a positive expected return
+    variance = (loadings ** 2).sum(axis=1) + (0 if residual is None else residual.astype(np.float32) ** 2)
+    result = np.empty((len(horizons), paths))
+    scratch = np.empty_like(shocks)
+    for i, days in enumerate(horizons):
+        # Multi-day log returns scale with the square root of time; assets compound, the portfolio is their weighted sum
+        np.multiply(shocks, np.float32(np.sqrt(days)), out=scratch)
+        scratch -= variance * np.float32(days / 2)
+        np.expm1(scratch, out=scratch)
+        result[i] = scratch @ weights
+    return result
+
+
+def _simulate_chunks(loadings, residual, weights, horizons, dof, chunks):
+    return np.hstack([simulate_chunk(loadings, residual, weights, horizons, dof, paths, seed) for paths, seed in chunks])
+
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool(workers):
+    # Spawned, not forked, so the worker processes never inherit the server's threads and locks
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None or _process_pool._max_workers != workers:
+            if _process_pool is not None:
+                # Simulations already submitted to the old pool still finish
+                _process_pool.shutdown(wait=False)
+            _process_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        return _process_pool
+
+
+def simulate_portfolio_returns(loadings, residual, weights, paths=TAIL_RISK_PATHS, horizons=HORIZONS, dof=TAIL_RISK_DOF,
+                               chunk_paths=TAIL_RISK_CHUNK_PATHS, workers=TAIL_RISK_WORKERS, seed=TAIL_RISK_SEED):
+    """
+    Horizons x paths portfolio returns, generated `chunk_paths` at a time so memory stays at one
+    chunk x assets block. Every chunk has its own seed from `seed`, so results do not depend on
+    `workers`; with workers > 0 the chunks are shared out over a process pool.
+    """
+    sizes = [min(chunk_paths, paths - start) for start in range(0, paths, chunk_paths)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    chunks = list(zip(sizes, seeds))
+    if workers and len(chunks) > 1:
+        # One run of consecutive chunks per worker, so the loadings are sent to each process once
+        bounds = np.linspace(0, len(chunks), min(workers, len(chunks)) + 1).astype(int)
+        groups = [chunks[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+        n = len(groups)
+        parts = get_process_pool(workers).map(_simulate_chunks, [loadings] * n, [residual] * n, [weights] * n, [horizons] * n, [dof] * n, groups)
+        return np.hstack(list(parts))
+    return _simulate_chunks(loadings, residual, weights, horizons, dof, chunks)
+
+
+def var_cvar(portfolio_returns, confidence):
+    """Value at risk and expected shortfall beyond it, as positive losses"""
+    losses = -np.asarray(portfolio_returns)
+    var = np.quantile(losses, confidence)
+    return float(var), float(losses[losses >= var].mean())
+
+
+def monte_carlo_var(positions, returns, paths=TAIL_RISK_PATHS, method=TAIL_RISK_METHOD, dof=TAIL_RISK_DOF,
+                    workers=TAIL_RISK_WORKERS, seed=TAIL_RISK_SEED, horizons=HORIZONS, confidence_levels=CONFIDENCE_LEVELS):
+    """
+    1- and 10-day VaR and CVaR of one position per ticker from correlated simulated shocks,
+    in percent of the portfolio's value and in its base currency
+    """
+    # Positions without a base-currency value cannot be weighted and are left out
+    market_value = np.nan_to_num(positions['Market Value'].to_numpy(dtype=float))
+    tickers = positions['Ticker'].astype(str).to_numpy()
+    columns, covariance = estimate_covariance(returns.reindex(columns=pd.unique(tickers)))
+    covered = pd.Series(market_value).groupby(tickers).sum().reindex(columns).to_numpy()
+    if not len(columns) or covered.sum() <= 0:
+        return None
+
+    # Positions without enough history are left out too, and the rest re-weighted to the whole portfolio
+    weights = covered / covered.sum()
+    method, loadings, residual = shock_model(covariance, method)
+    simulated = simulate_portfolio_returns(loadings, residual, weights, paths, horizons, dof, workers=workers, seed=seed)
+
+    total_value = market_value.sum()
+    rows = []
+    for i, days in enumerate(horizons):
+        for confidence in confidence_levels:
+            var, cvar = var_cvar(simulated[i], confidence)
+            rows.append({
+                'horizon_days': days,
+                'confidence': confidence,
+                'var': round(var * 100, 2),
+                'cvar': round(cvar * 100, 2),
+                'var_amount': round(var * total_value, 2),
+                'cvar_amount': round(cvar * total_value, 2),
+            })
+    return {
+        'method': method,
+        'distribution': f'student-t({dof:g})' if dof else 'normal',
+        'paths': int(paths),
+        'assets': int(len(columns)),
+        'coverage': round(float(covered.sum() / total_value), 4),
+        'var': rows,
+    }
+
+
+def load_stress_prices(tickers, provider=None, benchmark=BETA_BENCHMARK, scenarios=STRESS_SCENARIOS):
+    """{scenario: closes} of `tickers` and the benchmark, one bulk request per scenario window"""
+    provider = provider or get_default_provider()
+    tickers = [*dict.fromkeys([*map(str, tickers), benchmark])]
+    return {
+        name: provider.get_close_prices(tickers, pd.Timestamp(start).date(), pd.Timestamp(end).date() + timedelta(days=1))
+        for name, start, end in scenarios
+    }
+
+
+def combine_stress_prices(stress_prices):
+    """The scenario windows' closes as one frame, or None when there are none; see split_stress_prices"""
+    frames = [closes for closes in (stress_prices or {}).values() if closes is not None]
+    if not frames:
+        return None
+    combined = pd.concat(frames).sort_index()
+    return combined[~combined.index.duplicated()]
+
+
+def split_stress_prices(closes, scenarios=STRESS_SCENARIOS):
+    """{scenario: closes} back from combine_stress_prices, each window sliced out by date"""
+    if closes is None:
+        return {}
+    return {name: closes.loc[pd.Timestamp(start):pd.Timestamp(end)] for name, start, end in scenarios}
+
+
+def _replay_paths(closes):
+    # Buy-and-hold growth of each ticker that traded at both ends of the window, others are NaN
+    edge = 5
+    has_history = closes.iloc[:edge].notna().any() & closes.iloc[-edge:].notna().any()
+    filled = closes.ffill().bfill()
+    growth = filled / filled.iloc[0]
+    growth.loc[:, ~has_history] = np.nan
+    return growth
+
+
+def stress_test(positions, stress_prices, benchmark=BETA_BENCHMARK, betas=None, scenarios=STRESS_SCENARIOS):
+    """
+    Replay historical windows on today's positions, in each holding's listing currency.
+    Holdings that did not trade through a window follow the benchmark, scaled by their beta
+    (1 when unknown); `coverage` is the share of value replayed from its own history.
+    """
+    market_value = positions.groupby(positions['Ticker'].astype(str), sort=False)['Market Value'].sum()
+    if market_value.sum() <= 0:
+        return []
+    weights = market_value / market_value.sum()
+    beta = pd.Series(betas or {}, dtype=float).reindex(weights.index).fillna(1.0).to_numpy()
+
+    results = []
+    for name, start, end in scenarios:
+        closes = stress_prices.get(name)
+        row = {'scenario': name, 'start': start, 'end': end, 'portfolio_return': None, 'max_drawdown': None, 'benchmark_return': None, 'loss_amount': None, 'coverage': 0.0}
+        results.append(row)
+        if closes is None or closes.empty or benchmark not in closes:
+            continue
+        paths = _replay_paths(closes.reindex(columns=[*dict.fromkeys([*weights.index, benchmark])]))
+        market = paths[benchmark]
+        # Without the benchmark through the window there is nothing to proxy the other holdings with
+        if market.isna().any():
+            continue
+        own = paths[weights.index].notna().all()
+        proxy = 1 + np.outer(market - 1, beta)
+        growth = np.where(own.to_numpy(), paths[weights.index].to_numpy(), proxy)
+        portfolio = growth @ weights.to_numpy()
+        drawdown = portfolio / np.maximum.accumulate(portfolio) - 1
+        row.update({
+            'portfolio_return': round(float(portfolio[-1] - 1) * 100, 2),
+            'max_drawdown': round(float(drawdown.min()) * 100, 2),
+            'benchmark_return': round(float(market.iloc[-1] - 1) * 100, 2),
+            'loss_amount': round(float(max(1 - portfolio[-1], 0) * market_value.sum()), 2),
+            'coverage': round(float(weights[own].sum()), 4),
+        })
+    return results
+
+
+def calculate_tail_risk(positions, returns=None, betas=None, stress_prices=None, provider=None, benchmark=BETA_BENCHMARK,
+                        lookback_days=TAIL_RISK_LOOKBACK_DAYS, **simulation):
+    """
+    Monte Carlo VaR/CVaR from the last `lookback_days` of the already loaded base-currency returns,
+    and the historical stress replays, of one position per ticker
+    """
+    monte_carlo = None
+    if returns is not None and len(returns):
+        recent = returns.loc[returns.index > returns.index[-1] - timedelta(days=lookback_days)]
+        monte_carlo = monte_carlo_var(positions, recent, **simulation)
+    if stress_prices is None:
+        stress_prices = load_stress_prices(positions['Ticker'].unique(), provider, benchmark)
+    return {
+        'monte_carlo': monte_carlo,
+        'stress': stress_test(positions, stress_prices, benchmark, betas),
+    }
@@ -0,0 +1,156 @@
+import os
+import time
+import threading
+import numpy as np
+import pandas as pd
+from datetime import date, timedelta
+from tools.price_history import get_upstream_provider
+from config import MONITOR_FEED_PATH, MONITOR_REPLAY_SPEED, MONITOR_REPLAY_LOOP, MONITOR_POLL_SECONDS, INGEST_CHUNK_ROWS
+
+# Columns of a recorded tick file; Price is in the ticker's listing currency
+TICK_COLUMNS = ['Timestamp', 'Ticker', 'Price']
+
+
+class TickFeed():
+    """
+    Source of price ticks for the monitor. `batches()` yields (timestamp, tickers, prices) with
+    every tick sharing one timestamp, tickers as a string array and prices as a float array.
+    """
+
+    # Where the ticks come from, reported by the monitor
+    source = None
+
+    def batches(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class FileTickFeed(TickFeed):
+    """
+    Replays a recorded CSV (or .jsonl) file of Timestamp, Ticker and Price rows sorted by time.
+    `speed` 1 replays in real time, 60 a minute per second, 0 as fast as possible. With `loop`
+    the file starts over, shifted in time, so timestamps keep increasing.
+    """
+
+    def __init__(self, path, speed=1.0, loop=False, chunk_rows=INGEST_CHUNK_ROWS):
+        self.path = self.source = path
+        self.speed = speed
+        self.loop = loop
+        self.chunk_rows = chunk_rows
+        self._closed = False
+
+    def _chunks(self):
+        if self.path.endswith('.jsonl'):
+            reader = pd.read_json(self.path, lines=True, chunksize=self.chunk_rows, dtype=False)
+        else:
+            reader = pd.read_csv(self.path, usecols=TICK_COLUMNS, chunksize=self.chunk_rows, dtype={'Ticker': str})
+        for chunk in reader:
+            chunk = chunk.dropna(subset=TICK_COLUMNS)
+            yield (
+                pd.to_datetime(chunk['Timestamp']).to_numpy(dtype='datetime64[ns]'),
+                chunk['Ticker'].astype(str).to_numpy(),
+                chunk['Price'].to_numpy(dtype=float),
+            )
+
+    def _replay(self):
+        """Batches of one pass over the file; a timestamp split across two chunks is carried over"""
+        carried = None
+        for stamps, tickers, prices in self._chunks():
+            if carried is not None:
+                stamps, tickers, prices = (np.concatenate([a, b]) for a, b in zip(carried, (stamps, tickers, prices)))
+            if not len(stamps):
+                continue
+            bounds = np.flatnonzero(stamps[1:] != stamps[:-1]) + 1
+            starts = np.concatenate([[0], bounds])
+            ends = np.concatenate([bounds, [len(stamps)]])
+            for start, end in zip(starts[:-1], ends[:-1]):
+                yield stamps[start], tickers[start:end], prices[start:end]
+            carried = stamps[starts[-1]:], tickers[starts[-1]:], prices[starts[-1]:]
+        if carried is not None and len(carried[0]):
+            yield carried[0][0], carried[1], carried[2]
+
+    def batches(self):
+        shift = np.timedelta64(0, 'ns')
+        while not self._closed:
+            first = last = None
+            started = time.monotonic()
+            for stamp, tickers, prices in self._replay():
+                if self._closed:
+                    return
+                first = stamp if first is None else first
+                if self.speed:
+                    # Sleep until the tick is due relative to the start of the pass
+                    delay = started + (stamp - first) / np.timedelta64(1, 's') / self.speed - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                last = stamp
+                yield pd.Timestamp(stamp + shift), tickers, prices
+            if not self.loop or first is None:
+                return
+            # The next pass starts a second after this one ended
+            shift += (last - first) + np.timedelta64(1, 's')
+
+    def close(self):
+        self._closed = True
+
+
+class PollingTickFeed(TickFeed):
+    """
+    Live prices polled every `interval` seconds from a PriceHistoryProvider (yfinance by default):
+    the latest daily close of each ticker `tickers()` returns, which during the session is the
+    last traded price as the provider reports it (delayed for most exchanges). Only tickers whose
+    price changed since the last poll are yielded. A failed poll is recorded in `error` and retried.
+    """
+
+    def __init__(self, tickers, provider=None, interval=MONITOR_POLL_SECONDS, lookback_days=7):
+        self.tickers = tickers
+        self.provider = provider or get_upstream_provider()
+        self.interval = interval
+        self.lookback_days = lookback_days
+        self.source = f"poll:{type(self.provider).__name__}"
+        self.error = None
+        self._last = {}
+        self._closed = threading.Event()
+
+    def poll(self):
+        """(tickers, prices) of the latest close of every ticker that changed since the last poll"""
+        tickers = list(self.tickers())
+        if not tickers:
+            return np.zeros(0, dtype=str), np.zeros(0)
+        # A few days back, so tickers that did not trade today still have a last price
+        closes = self.provider.get_close_prices(tickers, date.today() - timedelta(days=self.lookback_days), date.today() + timedelta(days=1))
+        latest = closes.ffill().iloc[-1].dropna() if len(closes) else pd.Series(dtype=float)
+        changed = latest[[self._last.get(ticker) != price for ticker, price in latest.items()]]
+        self._last.update(changed.to_dict())
+        return changed.index.astype(str).to_numpy(), changed.to_numpy(dtype=float)
+
+    def batches(self):
+        while not self._closed.is_set():
+            try:
+                tickers, prices = self.poll()
+                self.error = None
+            except Exception as e:
+                self.error = f"{type(e).__name__}: {e}"
+            else:
+                if len(tickers):
+                    yield pd.Timestamp.now(), tickers, prices
+            self._closed.wait(self.interval)
+
+    def close(self):
+        self._closed.set()
+
+
+def create_tick_feed(tickers=None):
+    """
+    The configured feed: MONITOR_FEED_PATH replayed, else live prices of `tickers()` polled every
+    MONITOR_POLL_SECONDS; None when neither is set
+    """
+    if MONITOR_FEED_PATH:
+        if not os.path.exists(MONITOR_FEED_PATH):
+            raise FileNotFoundError(f"Tick feed {MONITOR_FEED_PATH} does not exist")
+        return FileTickFeed(MONITOR_FEED_PATH, speed=MONITOR_REPLAY_SPEED, loop=MONITOR_REPLAY_LOOP)
+    if MONITOR_POLL_SECONDS and tickers is not None:
+        return PollingTickFeed(tickers)
+    return None
@@ -19,6 +19,8 @@ interface PortfolioDetailsProps {
   setActiveTab: (tab: string) => void;
 }
 
+const PENDING = "Generating analysis..."
+
 export default function PortfolioDetails({ activeTab, setActiveTab }: PortfolioDetailsProps) {
   const [analysisData, setAnalysisData] = useState<AnalysisResult | null>(null);
 
@@ -27,7 +29,40 @@ export default function PortfolioDetails({ activeTab, setActiveTab }: PortfolioD
     if (storedResult) {
       const parsedResult: AnalysisResult = JSON.parse(storedResult);
       setAnalysisData(parsedResult);
+      return
     }
+
+    // Numbers arrive first, narrative fields fill in as each agent finishes
+    const jobId = localStorage.getItem('analysisJob');
+    if (!jobId) return
+    const events = new EventSource(`http://localhost:8080/jobs/${jobId}/events`);
+    const merge = (fields: Partial<AnalysisResult>) =>
+      setAnalysisData(prev => ({ ...(prev || {}), ...fields } as AnalysisResult));
+
+    events.addEventListener('metrics', (e) => merge(JSON.parse((e as MessageEvent).data)));
+    events.addEventListener('task', (e) => {
+      const { output } = JSON.parse((e as MessageEvent).data);
+      if (output && typeof output === 'object') {
+        const { best_performer, underperformer, ...narrative } = output;
+        merge(narrative);
+      }
+    });
+    events.addEventListener('result', (e) => {
+      const result: AnalysisResult = JSON.parse((e as MessageEvent).data);
+      setAnalysisData(result);
+      localStorage.setItem('analysisResult', JSON.stringify(result));
+      localStorage.removeItem('analysisJob');
+      events.close();
+    });
+    events.addEventListener('error', (e) => {
+      const data = (e as MessageEvent).data;
+      if (data) {
+        toast.error(JSON.parse(data).error);
+        localStorage.removeItem('analysisJob');
+        events.close();
+      }
+    });
+    return () => events.close();
   }, [])
 
 
@@ -104,7 +139,7 @@ function OverallAnalysis({ data }: { data: AnalysisResult }) {
                   <div style={{ width: `${data.overall_score }%` }} className="shadow-none flex flex-col text-center whitespace-nowrap text-white justify-center bg-primary"></div>
                 </div>
               </div>
-              <p className={styles.description}>{data.overall_analysis}</p>
+              <p className={styles.description}>{data.overall_analysis ?? PENDING}</p>
             </div>
           </CardContent>
         </Card>
@@ -130,7 +165,7 @@ function OverallAnalysis({ data }: { data: AnalysisResult }) {
                 <div style={{ width: `${data.potential_improvement_score}%` }} className="shadow-none flex flex-col text-center whitespace-nowrap text-white justify-center bg-green-500"></div>
               </div>
             <div className={styles.overallContent}>
-              <p className={styles.description}>{data.portfolio_suggestion}</p>
+              <p className={styles.description}>{data.portfolio_suggestion ?? PENDING}</p>
             </div>
             <div className={styles.feedbackContainer}>
               <div className={styles.feedbackButtons}>
@@ -170,7 +205,7 @@ function PerformanceAnalysis({ data }: { data: AnalysisResult }) {
           </CardHeader>
           <CardContent>
             <div className={styles.overallContent}>
-              <p className={styles.description}>{data.performance_overview}</p>
+              <p className={styles.description}>{data.performance_overview ?? PENDING}</p>
             </div>
           </CardContent>
         </Card>
@@ -184,28 +219,28 @@ function PerformanceAnalysis({ data }: { data: AnalysisResult }) {
         <AnalysisCard
           title="Sharpe Ratio (1 Year)"
           value={data.sharp_ratio}
-          description={data.sharp_ratio_explanation}
+          description={data.sharp_ratio_explanation ?? PENDING}
           icon={<BarChart2Icon className="h-4 w-4 text-green-600" />}
         />
       </div>
       <div className="grid grid-cols-1 md:grid-cols-2 gap-4">
         <AnalysisCard
           title="Top Performer"
-          value={data.top_performer.ticker}
-          description={`${data.top_performer.name} has the highest return in your portfolio.`}
+          value={data.top_performer?.ticker}
+          description={`${data.top_performer?.name} has the highest return in your portfolio.`}
           icon={<ArrowUpIcon className="h-8 w-8 text-green-600" />}
         />
         <AnalysisCard
           title="Underperformer"
-          value={data.underperformer.ticker}
-          description={`${data.underperformer.name} is currently underperforming. Consider reviewing.`}
+          value={data.underperformer?.ticker}
+          description={`${data.underperformer?.name} is currently underperforming. Consider reviewing.`}
           icon={<ArrowDownIcon className="h-8 w-8 text-blue-600" />}
         />
       </div>
       <AnalysisCard
           title="CAGR"
           value={data.portfolio_cagr}
-          description={data.portfolio_cagr_explanation}
+          description={data.portfolio_cagr_explanation ?? PENDING}
           icon={<TrendingUpIcon className="h-8 w-8 text-green-600" />}
         />
     </div>
@@ -217,15 +252,15 @@ function RiskAnalysis({ data }: { data: AnalysisResult }) {
     <div className={styles.analysisContainer}>
       <RiskCard
         title="Volatility"
-        value={data.volatility}
-        description={`${data.volatility_explanation}`}
+        value={data.volatility ?? PENDING}
+        description={data.volatility_explanation ?? PENDING}
         icon={<BarChart3Icon className="h-6 w-6 text-blue-600" />}
         titleStyle="titleBlue"
       />
       <RiskCard
         title="Anomaly"
-        value={data.anomaly}
-        description={`${data.anomaly_explanation}`}
+        value={data.anomaly ?? PENDING}
+        description={data.anomaly_explanation ?? PENDING}
         icon={<AlertTriangleIcon className="h-6 w-6 text-green-600" />}
         titleStyle="titleGreen"
       />
@@ -233,13 +268,13 @@ function RiskAnalysis({ data }: { data: AnalysisResult }) {
         <AnalysisCard
           title="Sortino Ratio (1 Year)"
           value={data.sortino_ratio}
-          description={data.sortino_ratio_explanation}
+          description={data.sortino_ratio_explanation ?? PENDING}
           icon={<BarChart2Icon className="h-4 w-4 text-red-600" />}
         />
         <AnalysisCard
           title="Max Drawdown (1 Year)"
           value={data.max_drawdown}
-          description={data.max_drawdown_explanation}
+          description={data.max_drawdown_explanation ?? PENDING}
           icon={<TrendingDownIcon className="h-4 w-4 text-blue-600" />}
         />
       </div>
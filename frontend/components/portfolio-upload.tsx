@@ -80,8 +80,19 @@ export default function PortfolioUploadComponent() {
           method: 'POST',
           body: formData,
         })
-        const result = await response.json()
-        localStorage.setItem('analysisResult', JSON.stringify(result))
+        const job = await response.json()
+        if (!response.ok) {
+          throw new Error(job.detail)
+        }
+        if (job.result) {
+          // Served from the backend's result cache
+          localStorage.setItem('analysisResult', JSON.stringify(job.result))
+          localStorage.removeItem('analysisJob')
+        } else {
+          // Results stream into the analysis page as each stage finishes
+          localStorage.setItem('analysisJob', job.job_id)
+          localStorage.removeItem('analysisResult')
+        }
         setIsUploading(false)
         router.push("/portfolio-analysis")
       } catch (error) {
@@ -27,8 +27,131 @@ export interface AnalysisResult {
   performance_overview: string
   portfolio_cagr: number;
   portfolio_cagr_explanation: string;
+  money_weighted_return?: number;
+  time_weighted_return_1y?: number;
+  exposures?: PortfolioExposures;
+  tail_risk?: TailRisk;
+  rebalance?: RebalancePlan;
+  errors?: Record<string, string> | null;
 }
 
+export interface SectorExposure {
+  sector: string;
+  positions: number;
+  weight: number;
+  return_contribution: number;
+  risk_contribution: number | null;
+  volatility: number | null;
+}
+
+export interface PortfolioExposures {
+  sectors: SectorExposure[];
+  concentration: {
+    hhi: number;
+    effective_positions: number | null;
+    top_n: number;
+    top_n_share: number;
+    sector_hhi: number;
+  };
+  portfolio_volatility: number | null;
+  sector_covariance: Record<string, Record<string, number>> | null;
+}
+
+export interface ValueAtRisk {
+  horizon_days: number;
+  confidence: number;
+  var: number;
+  cvar: number;
+  var_amount: number;
+  cvar_amount: number;
+}
+
+export interface StressScenario {
+  scenario: string;
+  start: string;
+  end: string;
+  portfolio_return: number | null;
+  max_drawdown: number | null;
+  benchmark_return: number | null;
+  loss_amount: number | null;
+  coverage: number;
+}
+
+export interface TailRisk {
+  monte_carlo: {
+    method: string;
+    distribution: string;
+    paths: number;
+    assets: number;
+    coverage: number;
+    var: ValueAtRisk[];
+  } | null;
+  stress: StressScenario[];
+}
+
+export interface RebalanceTrade {
+  ticker: string;
+  action: 'buy' | 'sell';
+  current_weight: number;
+  target_weight: number;
+  amount: number;
+  quantity: number | null;
+}
+
+export interface PortfolioStatistics {
+  expected_return: number;
+  volatility: number;
+  sharpe_ratio: number | null;
+}
+
+export interface RebalancePlan {
+  strategy: string;
+  objective: 'min_variance' | 'max_sharpe' | 'risk_parity';
+  assets: number;
+  coverage: number;
+  max_weight: number;
+  turnover: number;
+  turnover_limited: boolean;
+  iterations: number;
+  converged: boolean;
+  current: PortfolioStatistics;
+  target: PortfolioStatistics;
+  trades: RebalanceTrade[];
+  other_trades: {
+    count: number;
+    buy_amount: number;
+    sell_amount: number;
+  };
+}
+
+export interface MonitoredPortfolio {
+  portfolio_id: string;
+  timestamp: string | null;
+  value: number | null;
+  cost: number | null;
+  total_return: number | null;
+  drawdown: number | null;
+  max_drawdown: number | null;
+  volatility: number | null;
+  samples: number;
+  updates: number;
+}
+
+export interface MonitorAlert {
+  portfolio_id: string;
+  alert: 'drawdown' | 'move' | 'volatility';
+  timestamp: string | null;
+  value: number;
+  threshold: number;
+  drawdown?: number;
+  change?: number;
+  volatility?: number;
+}
+
+export type MonitorEvent =
+  | { event: 'updates'; data: MonitoredPortfolio[] }
+  | { event: 'alerts'; data: MonitorAlert[]; dropped: number };
+
 export interface PortfolioItem {
   Ticker: string;
   'Asset Name': string;